@@ -0,0 +1,145 @@
+"""
+CPU cost per message of decoding decorated notifications.
+
+Compares the previous decoder (ujson.loads of the whole payload, copy of main fields and additional_fields
+and the event formatted for the per-event log line) with the typed msgspec decoder, which projects
+only the fields needed for aggregation and logs at most CONSUMER_EVENT_LOG_PER_SECOND events.
+The typed decoder is measured with consumer metrics, per message in single mode
+(ConsumeMessages.process_message without DB writes) and per batch (ConsumeMessages.decode_batch).
+
+    python benchmarks/notification_decoding.py
+    python benchmarks/notification_decoding.py --messages 200000 --body-size 0 1024 16384 --labels 5 50
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeMessage(object):
+    def __init__(self, value):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+    def error(self):
+        return None
+
+    def timestamp(self):
+        # TIMESTAMP_NOT_AVAILABLE
+        return 0, 0
+
+
+def build_messages(messages, labels, body_size, seed):
+    import ujson as json
+
+    rnd = random.Random(seed)
+    result = []
+    for event_id in range(messages):
+        payload = {
+            'event_id': event_id,
+            'alert_name': f"alert_{rnd.randrange(1000)}",
+            'source': f"host_{rnd.randrange(1000)}",
+            'monitoring_system': rnd.choice(['prometheus', 'zabbix', 'nagios']),
+            'additional_fields': {f"label_{label_num}": f"value_{rnd.randrange(100)}" for label_num in range(labels)},
+            'body': {'message': 'x' * body_size, 'graph_url': 'https://grafana/d/abc', 'studio': 42},
+            'notification_output': 'y' * (body_size // 4)
+        }
+        result.append(FakeMessage(json.dumps(payload).encode('utf-8')))
+
+    return result
+
+
+def legacy_parse_message(msg, consumer_num, logger):
+    """
+    Decoder used before the typed projection
+    """
+    import ujson as json
+
+    parsed_json = json.loads(msg.value().decode('utf-8'))
+
+    logger.info(
+        msg=f"Get event from Kafka:\nJSON: {parsed_json}.\nConsumer: {consumer_num}",
+        extra={'tags': {
+            'event_id': parsed_json['event_id']
+        }}
+    )
+
+    main_fields = {
+        'alert_name': parsed_json['alert_name'],
+        'source': parsed_json['source'],
+        'monitoring_system': parsed_json['monitoring_system'],
+    }
+
+    return {**main_fields, **parsed_json['additional_fields']}
+
+
+def cpu_per_message(decode, messages, batch_size, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.process_time()
+        for start in range(0, len(messages), batch_size):
+            decode(messages[start:start + batch_size])
+        elapsed = (time.process_time() - started) / len(messages)
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decorated notifications decoding benchmark')
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--labels', type=int, nargs='+', default=[5, 20], help='additional fields per event')
+    parser.add_argument('--body-size', type=int, nargs='+', default=[256, 4096], help='size of notification body')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=3, help='best of rounds is reported')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ.setdefault('LOG_LEVEL', args.log_level)
+
+    from microservice_template_core.tools.logger import get_logger
+    from harp_filters.logic.labels_processor import ConsumeMessages
+
+    class DecodeOnly(ConsumeMessages):
+        def aggregate_event(self, data):
+            pass
+
+    logger = get_logger()
+    worker = DecodeOnly()
+
+    def legacy(batch):
+        for msg in batch:
+            legacy_parse_message(msg, 'benchmark', logger)
+
+    def single(batch):
+        for msg in batch:
+            worker.process_message(msg, 'benchmark')
+
+    def batch(messages):
+        worker.decode_batch(messages, 'benchmark')
+
+    header = f"{'labels':>7}{'body':>7}{'legacy us/msg':>15}{'single us/msg':>15}{'saved':>7}{'batch us/msg':>14}{'saved':>7}"
+    print(header)
+    print('-' * len(header))
+
+    for labels, body_size in itertools.product(args.labels, args.body_size):
+        messages = build_messages(args.messages, labels, body_size, args.seed)
+        legacy_cpu = cpu_per_message(legacy, messages, args.batch_size, args.rounds)
+        single_cpu = cpu_per_message(single, messages, args.batch_size, args.rounds)
+        batch_cpu = cpu_per_message(batch, messages, args.batch_size, args.rounds)
+        print(
+            f"{labels:>7}{body_size:>7}{legacy_cpu * 1e6:>15.2f}"
+            f"{single_cpu * 1e6:>15.2f}{(1 - single_cpu / legacy_cpu) * 100:>6.0f}%"
+            f"{batch_cpu * 1e6:>14.2f}{(1 - batch_cpu / legacy_cpu) * 100:>6.0f}%"
+        )
+
+
+if __name__ == '__main__':
+    main()
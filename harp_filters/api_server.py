@@ -0,0 +1,70 @@
+from gunicorn.app.base import BaseApplication
+from microservice_template_core import db
+from microservice_template_core.settings import ServiceConfig
+from microservice_template_core.tools.logger import get_logger
+import harp_filters.settings as settings
+from harp_filters.logic.catalog_stream import catalog_stream
+from harp_filters.metrics.instrumentation import mark_process_dead
+
+logger = get_logger()
+
+
+def post_fork(server, worker):
+    # Connections of the engine created in master process must not be shared by workers
+    db.engine.dispose()
+
+
+def child_exit(server, worker):
+    mark_process_dead(worker.pid)
+
+
+class ApiServer(BaseApplication):
+    """
+    Gunicorn server with API_WORKERS processes. App is created once in master process and inherited by workers
+    """
+
+    def __init__(self, app):
+        self.application = app
+        super().__init__()
+
+    def load_config(self):
+        self.cfg.set('bind', f"{ServiceConfig.SERVER_NAME}:{ServiceConfig.SERVICE_PORT}")
+        self.cfg.set('worker_class', settings.API_WORKER_CLASS)
+        self.cfg.set('workers', settings.API_WORKERS)
+        self.cfg.set('threads', settings.API_THREADS)
+        self.cfg.set('worker_connections', settings.API_WORKER_CONNECTIONS)
+        self.cfg.set('timeout', settings.API_TIMEOUT_SECONDS)
+        self.cfg.set('preload_app', True)
+        self.cfg.set('post_fork', post_fork)
+        self.cfg.set('child_exit', child_exit)
+
+    def load(self):
+        return self.application
+
+
+def stream_threads():
+    """
+    Return number of threads of a worker which catalog streams may hold, None if streams don't hold threads
+    """
+    if settings.API_WORKER_CLASS == 'gthread':
+        return max(settings.API_THREADS - settings.API_STREAM_FREE_THREADS, 0)
+    if settings.API_WORKER_CLASS == 'sync':
+        return 0
+
+    return None
+
+
+def run_api_server(core):
+    """
+    Serve API with gunicorn
+    """
+    max_streams = stream_threads()
+    if max_streams is not None and max_streams < catalog_stream.max_clients:
+        # Workers are forked after this, so all of them inherit the cap
+        catalog_stream.max_clients = max_streams
+        logger.warning(
+            msg=f"Catalog streams are capped at {max_streams} per worker of {settings.API_WORKER_CLASS} class, "
+                f"use the default API_WORKER_CLASS=gevent for more streams"
+        )
+    logger.info(msg=f"Start API server. Workers: {settings.API_WORKERS}, threads: {settings.API_THREADS}")
+    ApiServer(core.app).run()
@@ -1,37 +1,71 @@
-from microservice_template_core import Core
+from microservice_template_core import Core, db
 from microservice_template_core.settings import ServiceConfig, FlaskConfig, DbConfig
 from harp_filters.endpoints.filter_config import ns as filter_config
 from harp_filters.endpoints.filter_labels import ns as filter_labels
 from harp_filters.endpoints.health import ns as health
+from harp_filters.endpoints.catalog_stream import ns as catalog_stream
 from harp_filters.logic.labels_processor import ConsumeMessages
+from harp_filters.logic.consumer_pool import ConsumerPool
+from harp_filters.metrics.instrumentation import (
+    track_db_queries, serve_metrics, metrics_registry, tag_api_queries, QueryComponent
+)
+from harp_filters.api_server import run_api_server
+from microservice_template_core.tools.prometheus_metrics import start_http_server
+import harp_filters.settings as settings
 import threading
 from microservice_template_core.tools.logger import get_logger
 
 logger = get_logger()
 
-
 def init_consumer():
     logger.debug(msg=f"Initialize consumer")
-    worker = ConsumeMessages()
+    if settings.CONSUMER_WORKERS > 1:
+        worker = ConsumerPool(workers=settings.CONSUMER_WORKERS)
+    else:
+        worker = ConsumeMessages()
     worker.main()
 
 
-def start_flask():
-    ServiceConfig.configuration['namespaces'] = [filter_config, filter_labels, health]
+def init_flask():
+    ServiceConfig.configuration['namespaces'] = [filter_config, filter_labels, catalog_stream, health]
     FlaskConfig.FLASK_DEBUG = False
     DbConfig.USE_DB = True
     app = Core()
-    app.run()
+    serve_metrics(app.app)
+    app.app.before_request(tag_api_queries)
+    track_db_queries(db.engine)
+    return app
+
+
+def run_api():
+    logger.debug(msg=f"Start API")
+    run_api_server(init_flask())
+
 
+def run_consumer():
+    # Flask app is still created to bind DB, but only metrics are served
+    init_flask()
+    start_http_server(int(ServiceConfig.SERVICE_PORT), registry=metrics_registry())
+    logger.debug(msg=f"Start Consumer")
+    init_consumer()
 
-def main():
+
+def run_combined():
     logger.debug(msg=f"Start Flask")
-    api_service = threading.Thread(name='Web App', target=start_flask, daemon=True)
+    # App is created before the consumer starts, so DB is bound before consumer workers are forked
+    app = init_flask()
+    api_service = threading.Thread(name='Web App', target=app.run, daemon=True)
     api_service.start()
     logger.debug(msg=f"Start Consumer")
     init_consumer()
 
 
-if __name__ == '__main__':
-    main()
-
+def run(mode):
+    logger.info(msg=f"Start {ServiceConfig.SERVICE_NAME} in {mode} mode")
+    QueryComponent.process = 'api' if mode == 'api' else 'consumer'
+    if mode == 'api':
+        run_api()
+    elif mode == 'consumer':
+        run_consumer()
+    else:
+        run_combined()
@@ -0,0 +1,83 @@
+from microservice_template_core.tools.flask_restplus import api
+from flask_restx import Resource
+from microservice_template_core.tools.logger import get_logger
+from flask import request, Response
+from harp_filters.logic.token import token_required, request_token, get_user_id_by_token
+from harp_filters.logic.catalog_stream import catalog_stream
+import harp_filters.settings as settings
+from harp_filters.metrics.instrumentation import endpoint_latency
+
+logger = get_logger()
+ns = api.namespace('api/v1/filters/stream', description='Harp endpoint with stream of catalog changes', decorators=[endpoint_latency])
+
+
+@ns.route('')
+class CatalogStream(Resource):
+    @staticmethod
+    @api.response(200, 'Stream has been opened')
+    @api.response(400, 'Parameters are not valid')
+    @api.response(503, 'Too many open streams')
+    @api.doc(params={
+        'since': 'Send changes after this change id first. Last-Event-ID header of reconnected EventSource takes precedence',
+        'auth_token': 'Token for clients which can\'t set AuthToken header, AuthToken cookie is accepted as well'
+    })
+    @token_required(browser=True)
+    def get():
+        """
+        Server-Sent Events stream of Labels and Filters changes
+        Events "labels" and "filters" have the format of /labels/changes and /config/changes items,
+        event id is change_id. Event "resync" means that changes were dropped for a slow client:
+        load /all again. Comment lines are sent as heartbeats
+        ```
+            id: 124
+            event: labels
+            data: {"change_id": 124, "operation": "add_values", "label_name": "source", "label_values": ["host-5"]}
+
+            id: 130
+            event: resync
+            data: {"last_change_id": 130}
+        ```
+        """
+        auth_token = request_token(browser=True)
+        username = get_user_id_by_token(auth_token)
+
+        try:
+            since = request.headers.get('Last-Event-ID', request.args.get('since'))
+            since = None if since is None else int(since)
+        except ValueError as val_exc:
+            logger.warning(
+                msg=str(val_exc),
+                extra={'tags': {}})
+            return {"msg": str(val_exc)}, 400
+
+        try:
+            client, position = catalog_stream.subscribe(username, since=since)
+        except RuntimeError as exc:
+            logger.warning(
+                msg=str(exc),
+                extra={'tags': {}})
+            return {"msg": str(exc)}, 503
+
+        try:
+            frames = catalog_stream.catch_up(client, since, position)
+        except Exception:
+            catalog_stream.unsubscribe(client)
+            raise
+
+        def generate():
+            try:
+                yield ': connected\n\n'
+                yield from frames
+                while True:
+                    frames_batch = client.pop(timeout=settings.CATALOG_STREAM_HEARTBEAT_SECONDS)
+                    if not frames_batch:
+                        yield ': heartbeat\n\n'
+                    yield from frames_batch
+            finally:
+                catalog_stream.unsubscribe(client)
+
+        return Response(
+            generate(),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
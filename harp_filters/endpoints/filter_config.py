@@ -5,11 +5,17 @@ from microservice_template_core.tools.logger import get_logger
 from harp_filters.models.filter_config import FilterConfig, FilterConfigSchema
 from flask import request
 from werkzeug.exceptions import BadRequest
-from microservice_template_core.decorators.auth_decorator import token_required
-from harp_filters.logic.token import get_user_id_by_token
+from harp_filters.logic.token import token_required, get_user_id_by_token
+from harp_filters.logic.response_cache import response_cache
+from harp_filters.logic.catalog_changes import catalog_changes
+from harp_filters.models.catalog_version import FILTERS_CATALOG
+from harp_filters.logic.filter_engine import filter_engine
+from harp_filters.logic.recent_events import recent_events_view
+import harp_filters.settings as settings
+from harp_filters.metrics.instrumentation import endpoint_latency
 
 logger = get_logger()
-ns = api.namespace('api/v1/filters/config', description='Harp endpoint with filter configs')
+ns = api.namespace('api/v1/filters/config', description='Harp endpoint with filter configs', decorators=[endpoint_latency])
 filter_config = FilterConfigSchema()
 
 
@@ -178,21 +184,178 @@ class UpdateFilter(Resource):
 class AllFilters(Resource):
     @staticmethod
     @api.response(200, 'Info has been collected')
+    @api.response(304, 'Filters were not changed since version in If-None-Match header')
     @token_required()
     def get():
         """
         Return All exist Filters
+        Response has ETag header. Send it back in If-None-Match header to get 304 while filters are not changed
         """
 
         auth_token = request.headers.get('AuthToken')
         username = get_user_id_by_token(auth_token)
 
         try:
-            new_obj = FilterConfig.get_all_filters(username)
-
-            result = {'filters': new_obj}
+            return response_cache.respond(
+                FILTERS_CATALOG,
+                lambda: {'filters': FilterConfig.get_all_filters(username)},
+                scope=username
+            )
         except Exception as err:
             result = {'filters': f'Can`t get all filters - {err}'}
             logger.error(msg=f"Can`t get all filters - {err}. Trace: {traceback.format_exc()}")
 
         return result, 200
+
+
+@ns.route('/changes')
+class FiltersChanges(Resource):
+    @staticmethod
+    @api.response(200, 'Info has been collected')
+    @api.response(400, 'Parameters are not valid')
+    @api.doc(params={
+        'since': 'last_change_id from the previous response. Without it only current last_change_id is returned',
+        'limit': f'Max number of changes. Default - {settings.CATALOG_CHANGES_PAGE_SIZE}'
+    })
+    @token_required()
+    def get():
+        """
+        Return changes of Filters visible to the user after since change id
+        Start with a request without since, load /all and poll with since=last_change_id.
+        Operations: create, update, delete. On "reset": true load /all again and continue from last_change_id.
+        "more": true means the next page is ready
+        ```
+            {
+                "changes": [
+                    {
+                        "change_id": 125,
+                        "operation": "update",
+                        "filter_id": "3",
+                        "filter_name": "My Filter",
+                        "filter_status": "public",
+                        "filter_config": [{"tag": "dc_name", "condition": "equal", "value": "FA0"}]
+                    },
+                    {
+                        "change_id": 126,
+                        "operation": "delete",
+                        "filter_id": "4"
+                    }
+                ],
+                "last_change_id": 126,
+                "more": false,
+                "reset": false
+            }
+        ```
+        """
+        auth_token = request.headers.get('AuthToken')
+        username = get_user_id_by_token(auth_token)
+
+        try:
+            since = request.args.get('since')
+            limit = int(request.args.get('limit', settings.CATALOG_CHANGES_PAGE_SIZE))
+            result = catalog_changes(
+                FILTERS_CATALOG,
+                since=None if since is None else int(since),
+                limit=min(limit, settings.CATALOG_CHANGES_MAX_PAGE_SIZE),
+                username=username
+            )
+        except ValueError as val_exc:
+            logger.warning(
+                msg=str(val_exc),
+                extra={'tags': {}})
+            return {"msg": str(val_exc)}, 400
+
+        return result, 200
+
+
+@ns.route('/match')
+class MatchFilters(Resource):
+    @staticmethod
+    @api.response(200, 'Events have been matched')
+    @api.response(400, 'Request is not valid')
+    @api.response(500, 'Unexpected error on backend side')
+    @token_required()
+    def post():
+        """
+        Match batch of events against Filters visible to the user
+        Returns list of matched filter ids for every event, in the same order as events
+        * Send a JSON object
+        ```
+            {
+                "events": [
+                    {
+                        "alert_name": "High CPU",
+                        "source": "host-1",
+                        "monitoring_system": "prometheus",
+                        "additional_fields": {"dc_name": "FA0"}
+                    }
+                ],
+                "filter_ids": [1, 2] # optional, all visible filters by default
+            }
+        ```
+        """
+        auth_token = request.headers.get('AuthToken')
+        username = get_user_id_by_token(auth_token)
+
+        data = request.get_json(silent=True) or {}
+        events = data.get('events')
+        filter_ids = data.get('filter_ids')
+        if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+            return {'msg': 'events should be a list of objects'}, 400
+        if len(events) > settings.FILTER_MATCH_MAX_EVENTS:
+            return {'msg': f'Max number of events in one request is {settings.FILTER_MATCH_MAX_EVENTS}'}, 400
+        try:
+            if filter_ids is not None:
+                filter_ids = [int(filter_id) for filter_id in filter_ids]
+        except (TypeError, ValueError):
+            return {'msg': 'filter_ids should be a list of filter ids'}, 400
+
+        try:
+            matches = filter_engine.match_events(events, username, filter_ids=filter_ids)
+        except Exception as exc:
+            logger.critical(
+                msg=f"Filters matching exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                extra={'tags': {}})
+            return {'msg': 'Exception raised. Check logs for additional info'}, 500
+
+        return {'matches': matches}, 200
+
+
+@ns.route('/preview')
+class PreviewFilter(Resource):
+    @staticmethod
+    @api.response(200, 'Filter has been evaluated')
+    @api.response(400, 'Request is not valid')
+    @api.response(500, 'Unexpected error on backend side')
+    @token_required()
+    def post():
+        """
+        Evaluate draft filter_config against the most recent events seen by consumers
+        Returns number of matched and scanned events and up to samples matched events
+        * Send a JSON object
+        ```
+            {
+                "filter_config": [
+                    {"tag": "source", "condition": "starts_with", "value": "host-"}
+                ],
+                "samples": 10 # optional
+            }
+        ```
+        """
+        data = request.get_json(silent=True) or {}
+        try:
+            samples = min(int(data.get('samples', settings.FILTER_PREVIEW_SAMPLES)), settings.FILTER_PREVIEW_MAX_SAMPLES)
+        except (TypeError, ValueError):
+            return {'msg': 'samples should be a number'}, 400
+
+        try:
+            preview = recent_events_view.preview(data.get('filter_config'), samples=max(samples, 0))
+        except ValueError as val_exc:
+            return {'msg': str(val_exc)}, 400
+        except Exception as exc:
+            logger.critical(
+                msg=f"Filter preview exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                extra={'tags': {}})
+            return {'msg': 'Exception raised. Check logs for additional info'}, 500
+
+        return preview, 200
@@ -3,12 +3,24 @@ from flask_restx import Resource
 import traceback
 from microservice_template_core.tools.logger import get_logger
 from harp_filters.models.filter_labels import FilterLabels, FilterLabelsSchema
-from flask import request
+from harp_filters.logic.labels_search import LabelsSearch
+from harp_filters.logic.labels_bulk import LabelsImport
+from harp_filters.logic.typeahead_index import typeahead_index
+from harp_filters.logic.token import token_required
+from harp_filters.logic.response_cache import response_cache
+from harp_filters.logic.catalog_changes import catalog_changes
+from harp_filters.logic.source_snapshots import updated_since
+from harp_filters.models.filter_label_stats import FilterLabelStats
+from harp_filters.logic.label_cardinality import merged_cardinality
+from harp_filters.models.catalog_version import LABELS_CATALOG
+from flask import request, Response, stream_with_context
 from werkzeug.exceptions import BadRequest
-from microservice_template_core.decorators.auth_decorator import token_required
+import harp_filters.settings as settings
+from harp_filters.metrics.instrumentation import endpoint_latency
+import ujson as json
 
 logger = get_logger()
-ns = api.namespace('api/v1/filters/labels', description='Harp endpoint with filter labels')
+ns = api.namespace('api/v1/filters/labels', description='Harp endpoint with filter labels', decorators=[endpoint_latency])
 filter_labels = FilterLabelsSchema()
 
 
@@ -134,17 +146,294 @@ class UpdateLabel(Resource):
         return {'msg': f"Label with id: {label_id} successfully deleted"}, 200
 
 
+@ns.route('/import')
+class ImportLabels(Resource):
+    @staticmethod
+    @api.response(200, 'Labels have been imported')
+    @api.response(400, 'Line is not valid')
+    @api.response(500, 'Chunk can not be written to DB')
+    @token_required()
+    def post():
+        """
+        Merge NDJSON stream of labels into existing values, one label per line.
+        Body is read line by line and written in chunks, chunks written before an error are kept
+        ```
+            {"label_name": "some_prometheus_key", "label_values": ["value_1", "value_2"]}
+            {"label_name": "another_key", "label_values": ["value_3"]}
+        ```
+        """
+        labels_import = LabelsImport()
+        try:
+            stats = labels_import.run(request.stream)
+        except ValueError as val_exc:
+            logger.warning(
+                msg=f"Labels import was stopped - {str(val_exc)}",
+                extra={'tags': {}})
+            return {'msg': str(val_exc), 'imported': labels_import.stats()}, 400
+        except Exception as exc:
+            logger.critical(
+                msg=f"Labels import exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                extra={'tags': {}})
+            return {'msg': 'Exception raised. Check logs for additional info', 'imported': labels_import.stats()}, 500
+
+        logger.info(msg=f"Labels have been imported - {stats}")
+        return {'imported': stats}, 200
+
+
+@ns.route('/export')
+class ExportLabels(Resource):
+    @staticmethod
+    @api.response(200, 'Labels are streamed')
+    @token_required()
+    def get():
+        """
+        Stream all Labels as NDJSON in the format of /import, ordered by label name.
+        Values of a big label are split into several lines
+        """
+        def generate():
+            for label in FilterLabels.iter_export(chunk_size=settings.LABELS_BULK_CHUNK_SIZE):
+                yield json.dumps(label) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @ns.route('/all')
 class AllLabels(Resource):
     @staticmethod
     @api.response(200, 'Info has been collected')
+    @api.response(304, 'Labels were not changed since version in If-None-Match header')
     @token_required()
     def get():
         """
         Return All exist Labels
+        Response has ETag header. Send it back in If-None-Match header to get 304 while labels are not changed
         """
-        new_obj = FilterLabels.get_all_labels()
+        return response_cache.respond(LABELS_CATALOG, lambda: {'labels': FilterLabels.get_all_labels()})
 
-        result = {'labels': new_obj}
+
+@ns.route('/changes')
+class LabelsChanges(Resource):
+    @staticmethod
+    @api.response(200, 'Info has been collected')
+    @api.response(400, 'Parameters are not valid')
+    @api.doc(params={
+        'since': 'last_change_id from the previous response. Without it only current last_change_id is returned',
+        'limit': f'Max number of changes. Default - {settings.CATALOG_CHANGES_PAGE_SIZE}'
+    })
+    @token_required()
+    def get():
+        """
+        Return changes of Labels after since change id
+        Start with a request without since, load /all and poll with since=last_change_id.
+        Operations: create, add_values, remove_values, update (label_values replace all values), delete
+        and reset. On reset or "reset": true load /all again and continue from last_change_id.
+        "more": true means the next page is ready
+        ```
+            {
+                "changes": [
+                    {
+                        "change_id": 124,
+                        "operation": "add_values",
+                        "label_name": "some_prometheus_key",
+                        "label_values": ["value_3"]
+                    },
+                    {
+                        "change_id": 127,
+                        "operation": "update",
+                        "label_name": "new_name",
+                        "old_label_name": "some_prometheus_key",
+                        "label_values": ["value_1"]
+                    }
+                ],
+                "last_change_id": 127,
+                "more": false,
+                "reset": false
+            }
+        ```
+        """
+        try:
+            since = request.args.get('since')
+            limit = int(request.args.get('limit', settings.CATALOG_CHANGES_PAGE_SIZE))
+            result = catalog_changes(
+                LABELS_CATALOG,
+                since=None if since is None else int(since),
+                limit=min(limit, settings.CATALOG_CHANGES_MAX_PAGE_SIZE)
+            )
+        except ValueError as val_exc:
+            logger.warning(
+                msg=str(val_exc),
+                extra={'tags': {}})
+            return {"msg": str(val_exc)}, 400
 
         return result, 200
+
+
+@ns.route('/search')
+class SearchLabels(Resource):
+    @staticmethod
+    @api.response(200, 'Info has been collected')
+    @api.response(400, 'Search parameters are not valid')
+    @api.doc(params={
+        'label': 'Search by label name',
+        'value': 'Search by label value',
+        'match': 'prefix (default) or substring',
+        'limit': f'Max number of values in the page. Default - {settings.LABELS_SEARCH_PAGE_SIZE}',
+        'cursor': 'next_cursor from the previous page'
+    })
+    @token_required()
+    def get():
+        """
+        Return one page of Labels ordered by label name
+        Response is streamed and has the same label format as /all
+        ```
+            {
+                "labels": [
+                    {
+                        "label_id": 1,
+                        "label_name": "some_prometheus_key",
+                        "label_values": ["value_1", "value_2"]
+                    }
+                ],
+                "next_cursor": "WyJzb21lX3Byb21ldGhldXNfa2V5IiwxXQ==" # null on the last page
+            }
+        ```
+        """
+        try:
+            limit = int(request.args.get('limit', settings.LABELS_SEARCH_PAGE_SIZE))
+            search = LabelsSearch(
+                label_search=request.args.get('label'),
+                value_search=request.args.get('value'),
+                match=request.args.get('match', 'prefix'),
+                cursor=request.args.get('cursor'),
+                limit=min(limit, settings.LABELS_SEARCH_MAX_PAGE_SIZE)
+            )
+        except ValueError as val_exc:
+            logger.warning(
+                msg=str(val_exc),
+                extra={'tags': {}})
+            return {"msg": str(val_exc)}, 400
+
+        def generate():
+            yield '{"labels": ['
+            for index, label in enumerate(search):
+                yield (',' if index else '') + json.dumps(label)
+            yield f'], "next_cursor": {json.dumps(search.next_cursor)}}}'
+
+        return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+@ns.route('/typeahead')
+class TypeaheadLabelValues(Resource):
+    @staticmethod
+    @api.response(200, 'Info has been collected')
+    @api.response(400, 'Search parameters are not valid')
+    @api.response(503, 'Index is being built after start of the process')
+    @api.doc(params={
+        'label': 'Label name',
+        'prefix': 'Case-insensitive prefix of label value',
+        'limit': f'Max number of values. Default - {settings.TYPEAHEAD_DEFAULT_LIMIT}'
+    })
+    @token_required()
+    def get():
+        """
+        Return values of the Label which start with the prefix, in alphabetical order
+        ```
+            {
+                "label_name": "some_prometheus_key",
+                "label_values": ["value_1", "value_2"]
+            }
+        ```
+        """
+        label_name = request.args.get('label')
+        if not label_name:
+            return {'msg': 'label should be specified'}, 400
+        try:
+            limit = min(int(request.args.get('limit', settings.TYPEAHEAD_DEFAULT_LIMIT)), settings.TYPEAHEAD_MAX_LIMIT)
+        except ValueError as val_exc:
+            return {"msg": str(val_exc)}, 400
+
+        try:
+            if not typeahead_index.ensure_started(FilterLabels.iter_all_values):
+                return {'msg': 'Typeahead index is being built, retry later'}, 503
+            label_values = typeahead_index.search(label_name, prefix=request.args.get('prefix', ''), limit=limit)
+        except Exception as exc:
+            logger.critical(
+                msg=f"Typeahead exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                extra={'tags': {}})
+            return {'msg': 'Exception raised. Check logs for additional info'}, 500
+
+        return {'label_name': label_name, 'label_values': label_values}, 200
+
+
+@ns.route('/top')
+class TopLabelValues(Resource):
+    @staticmethod
+    @api.response(200, 'Info has been collected')
+    @api.response(400, 'Parameters are not valid')
+    @api.doc(params={
+        'label': 'Label name',
+        'limit': f'Max number of values. Default and max - {settings.LABELS_FREQUENCY_TOP_K}'
+    })
+    @token_required()
+    def get():
+        """
+        Return the most frequent values of the Label in recent events, most frequent first
+        frequency is the number of events with the value, where an event counts half after every
+        LABELS_FREQUENCY_HALF_LIFE_SECONDS. True frequency is between frequency - error and frequency
+        ```
+            {
+                "label_name": "source",
+                "label_values": [
+                    {"label_value": "host-1", "frequency": 1520.5, "error": 0.0},
+                    {"label_value": "host-7", "frequency": 310.2, "error": 12.1}
+                ]
+            }
+        ```
+        """
+        label_name = request.args.get('label')
+        if not label_name:
+            return {'msg': 'label should be specified'}, 400
+        try:
+            limit = min(int(request.args.get('limit', settings.LABELS_FREQUENCY_TOP_K)), settings.LABELS_FREQUENCY_TOP_K)
+        except ValueError as val_exc:
+            return {"msg": str(val_exc)}, 400
+
+        try:
+            label_values = FilterLabelStats.top_values(label_name, updated_since=updated_since(settings.LABELS_FREQUENCY_FLUSH_SECONDS), limit=limit)
+        except Exception as exc:
+            logger.critical(
+                msg=f"Top label values exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                extra={'tags': {}})
+            return {'msg': 'Exception raised. Check logs for additional info'}, 500
+
+        return {'label_name': label_name, 'label_values': label_values}, 200
+
+
+@ns.route('/cardinality')
+class LabelsCardinality(Resource):
+    @staticmethod
+    @api.response(200, 'Info has been collected')
+    @api.doc(params={'label': 'Label name. All labels are returned without it'})
+    @token_required()
+    def get():
+        """
+        Return estimated number of distinct values of Labels seen by consumers, highest first
+        policy: allow - label is in allow-list, aggregate - below the limit, drop or sample - above the limit
+        ```
+            {
+                "labels": [
+                    {"label_name": "request_id", "cardinality": 1843211, "policy": "drop"},
+                    {"label_name": "source", "cardinality": 5230, "policy": "allow"}
+                ]
+            }
+        ```
+        """
+        try:
+            labels = merged_cardinality(label_name=request.args.get('label'))
+        except Exception as exc:
+            logger.critical(
+                msg=f"Labels cardinality exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                extra={'tags': {}})
+            return {'msg': 'Exception raised. Check logs for additional info'}, 500
+
+        return {'labels': labels}, 200
@@ -0,0 +1,42 @@
+import datetime
+import harp_filters.settings as settings
+from harp_filters.models.catalog_change import CatalogChange
+
+
+def settled_change_id(settle_seconds=settings.CATALOG_CHANGES_SETTLE_SECONDS):
+    """
+    Last change_id created at least settle_seconds ago, but not below the last trimmed change_id.
+    Newer changes are held back, so a change committed later than a change with bigger change_id
+    is not skipped by clients. create_ts is set by DB, so the window is measured by DB clock as well
+    """
+    last_change_id = CatalogChange.last_change_id(
+        created_before=CatalogChange.db_now() - datetime.timedelta(seconds=settle_seconds)
+    )
+    return max(last_change_id, CatalogChange.trimmed_change_id())
+
+
+def catalog_changes(catalog, since=None, limit=settings.CATALOG_CHANGES_PAGE_SIZE, username=None):
+    """
+    Return changes of the catalog after since. Without since, or when changes after since were already trimmed,
+    no changes are returned and the client has to load the whole catalog and continue from last_change_id
+    """
+    if since is not None and since < 0:
+        raise ValueError(f"since must be a non-negative change id, got {since}")
+    if limit <= 0:
+        raise ValueError(f"limit must be positive, got {limit}")
+
+    trimmed_change_id = CatalogChange.trimmed_change_id()
+    until = settled_change_id()
+    if since is None or since < trimmed_change_id:
+        return {'changes': [], 'last_change_id': until, 'more': False, 'reset': since is not None}
+
+    changes = CatalogChange.changes_between(catalog, since, until, limit + 1, username=username)
+    more = len(changes) > limit
+    changes = changes[:limit]
+
+    return {
+        'changes': [change.dict() for change in changes],
+        'last_change_id': changes[-1].change_id if more else max(since, until),
+        'more': more,
+        'reset': False
+    }
@@ -0,0 +1,183 @@
+import threading
+import time
+import traceback
+from collections import deque
+from microservice_template_core import db
+from microservice_template_core.tools.logger import get_logger
+import ujson as json
+import harp_filters.settings as settings
+from harp_filters.metrics.service_monitoring import Prom
+from harp_filters.metrics.instrumentation import tag_api_queries
+from harp_filters.models.catalog_change import CatalogChange
+from harp_filters.logic.catalog_changes import settled_change_id
+
+logger = get_logger()
+
+
+def change_frame(change):
+    return f"id: {change.change_id}\nevent: {change.catalog}\ndata: {json.dumps(change.dict())}\n\n"
+
+
+def resync_frame(last_change_id):
+    Prom.CATALOG_STREAM_RESYNCS.inc()
+    return f"id: {last_change_id}\nevent: resync\ndata: {json.dumps({'last_change_id': last_change_id})}\n\n"
+
+
+class StreamClient(object):
+    """
+    Bounded buffer of SSE frames of one open stream. When the client does not read max_size frames in time,
+    the buffer is dropped and the client gets a single resync event instead
+    """
+
+    def __init__(self, username, last_change_id, max_size=settings.CATALOG_STREAM_QUEUE_SIZE):
+        self.username = username
+        self.last_change_id = last_change_id
+        self.max_size = max_size
+        self.frames = deque()
+        self.resync = False
+        self.cond = threading.Condition()
+
+    def visible(self, owner):
+        return owner is None or owner == self.username
+
+    def push(self, changes):
+        """
+        Add (change_id, owner, frame) changes ordered by change_id
+        """
+        with self.cond:
+            for change_id, owner, frame in changes:
+                if change_id <= self.last_change_id:
+                    continue
+                self.last_change_id = change_id
+                if self.resync or not self.visible(owner):
+                    continue
+                if len(self.frames) >= self.max_size:
+                    self.frames.clear()
+                    self.resync = True
+                    continue
+                self.frames.append(frame)
+            self.cond.notify()
+
+    def pop(self, timeout):
+        """
+        Wait up to timeout seconds and return buffered frames
+        """
+        with self.cond:
+            if not self.frames and not self.resync:
+                self.cond.wait(timeout)
+            if self.resync:
+                self.resync = False
+                return [resync_frame(self.last_change_id)]
+
+            frames = list(self.frames)
+            self.frames.clear()
+
+        return frames
+
+
+class CatalogStream(object):
+    """
+    Fan-out of catalog changes to open SSE streams of API process. Change log is polled by one thread
+    per process and only while streams are open, so with gevent workers idle streams cost a greenlet and a heartbeat
+    """
+
+    def __init__(self, poll_ms=settings.CATALOG_STREAM_POLL_MS, queue_size=settings.CATALOG_STREAM_QUEUE_SIZE,
+                 max_clients=settings.CATALOG_STREAM_MAX_CLIENTS):
+        self.poll_ms = poll_ms
+        self.queue_size = queue_size
+        self.max_clients = max_clients
+        self.clients = set()
+        self.position = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, username, since=None):
+        """
+        Register a stream and return it with the change_id from which it gets changes
+        """
+        with self._lock:
+            if len(self.clients) >= self.max_clients:
+                raise RuntimeError(f"Max number of catalog streams is reached: {self.max_clients}")
+            if not self.clients:
+                # Change log was not polled while there were no streams
+                self.position = settled_change_id()
+
+            client = StreamClient(username, max(self.position, since or 0), max_size=self.queue_size)
+            self.clients.add(client)
+            Prom.CATALOG_STREAM_CLIENTS.set(len(self.clients))
+            position = self.position
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(name='Catalog stream', target=self.run, daemon=True)
+                self._thread.start()
+
+        return client, position
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self.clients.discard(client)
+            Prom.CATALOG_STREAM_CLIENTS.set(len(self.clients))
+
+    def catch_up(self, client, since, position):
+        """
+        Return frames of changes since < change_id <= position missed by reconnected client
+        """
+        if since is None or since >= position:
+            return []
+        if since < CatalogChange.trimmed_change_id():
+            return [resync_frame(position)]
+
+        changes = CatalogChange.changes_after(since, position, limit=self.queue_size + 1)
+        if len(changes) > self.queue_size:
+            return [resync_frame(position)]
+
+        return [change_frame(change) for change in changes if client.visible(change.owner)]
+
+    def poll(self):
+        """
+        Push changes after position to open streams. Return True if more changes are waiting
+        """
+        with self._lock:
+            if not self.clients:
+                return False
+            position = self.position
+
+        until = settled_change_id()
+        if until <= position:
+            return False
+
+        changes = CatalogChange.changes_after(position, until, limit=self.queue_size)
+        changes = [(change.change_id, change.owner, change_frame(change)) for change in changes]
+
+        with self._lock:
+            changes = [change for change in changes if change[0] > self.position]
+            if not changes:
+                return False
+            self.position = changes[-1][0]
+            clients = list(self.clients)
+
+        for client in clients:
+            client.push(changes)
+
+        return len(changes) >= self.queue_size
+
+    def run(self):
+        tag_api_queries()
+        while True:
+            more = False
+            try:
+                more = self.poll()
+            except Exception as exc:
+                logger.error(
+                    msg=f"Catalog stream poll exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                    extra={'tags': {}}
+                )
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+            if not more:
+                time.sleep(self.poll_ms / 1000)
+
+
+catalog_stream = CatalogStream()
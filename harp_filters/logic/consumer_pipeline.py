@@ -0,0 +1,84 @@
+import queue
+import threading
+import traceback
+from microservice_template_core.tools.logger import get_logger
+import harp_filters.settings as settings
+from harp_filters.metrics.service_monitoring import Prom
+
+logger = get_logger()
+
+
+class ConsumerPipeline(object):
+    """
+    Consumer split into poll -> decode -> aggregate -> write stages joined by bounded queues.
+    Full queue blocks the previous stage, so slow DB writes throttle polling instead of growing memory.
+    While a write is in flight, aggregated batches are coalesced and written with the next commit
+    """
+    STAGES = ('decode', 'aggregate', 'write')
+
+    def __init__(self, worker, consumer, consumer_num, queue_size=settings.CONSUMER_PIPELINE_QUEUE_SIZE):
+        self.worker = worker
+        self.consumer = consumer
+        self.consumer_num = consumer_num
+        self.queues = {stage: queue.Queue(maxsize=queue_size) for stage in self.STAGES}
+
+        for stage, stage_queue in self.queues.items():
+            Prom.CONSUMER_PIPELINE_QUEUE_DEPTH.labels(stage=stage).set_function(stage_queue.qsize)
+
+    def decode_stage(self):
+        while True:
+            messages = self.queues['decode'].get()
+            events = self.worker.decode_batch(messages, self.consumer_num)
+            if events:
+                self.queues['aggregate'].put(events)
+
+    def aggregate_stage(self):
+        while True:
+            events = self.queues['aggregate'].get()
+            batch_labels = self.worker.merge_events(events)
+            if batch_labels:
+                self.queues['write'].put(batch_labels)
+
+    def write_stage(self):
+        while True:
+            batch_labels = self.queues['write'].get()
+            while True:
+                try:
+                    self.merge_batches(batch_labels, self.queues['write'].get_nowait())
+                except queue.Empty:
+                    break
+
+            labels = self.worker.select_labels(self.worker.unique_labels(batch_labels))
+            if labels:
+                self.worker.aggregate_labels(labels)
+
+    @staticmethod
+    def merge_batches(batch_labels, other_labels):
+        for label_name, label_values in other_labels.items():
+            batch_labels.setdefault(label_name, {}).update(label_values)
+
+        return batch_labels
+
+    def run_stage(self, stage):
+        target = getattr(self, f"{stage}_stage")
+        while True:
+            try:
+                target()
+            except Exception as exc:
+                logger.critical(
+                    msg=f"Consumer pipeline stage {stage} exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                    extra={'tags': {}}
+                )
+
+    def run(self):
+        for stage in self.STAGES:
+            stage_thread = threading.Thread(name=f"Consumer {stage} stage", target=self.run_stage, args=(stage,), daemon=True)
+            stage_thread.start()
+
+        while True:
+            messages = self.consumer.consume(
+                num_messages=settings.CONSUMER_BATCH_SIZE,
+                timeout=settings.CONSUMER_BATCH_LINGER_MS / 1000
+            )
+            if messages:
+                self.queues['decode'].put(messages)
@@ -0,0 +1,142 @@
+import multiprocessing
+import multiprocessing.connection
+import threading
+import traceback
+import zlib
+from microservice_template_core import db
+from microservice_template_core.settings import ServiceConfig
+from microservice_template_core.tools.logger import get_logger
+from microservice_template_core.tools.prometheus_metrics import start_http_server
+import harp_filters.settings as settings
+from harp_filters.logic.labels_processor import ConsumeMessages
+from harp_filters.models.filter_labels import FilterLabels
+
+logger = get_logger()
+
+
+def label_owner(label_name, workers):
+    """
+    Return number of the worker which owns the label. crc32 is stable between processes unlike hash()
+    """
+    return zlib.crc32(label_name.encode('utf-8')) % workers
+
+
+class ConsumerWorker(ConsumeMessages):
+    """
+    Consumer worker process. Polls Kafka in the shared consumer group and routes labels of every event
+    to the worker which owns them. Owned labels are written by a single aggregator thread
+    """
+
+    def __init__(self, worker_num, queues):
+        super().__init__()
+        self.worker_num = worker_num
+        self.queues = queues
+
+    def owns_label(self, label_name):
+        if settings.CONSUMER_MODE == 'write_behind':
+            # Write-behind workers write all labels of their events directly, so they cache all of them
+            return True
+
+        return label_owner(label_name, len(self.queues)) == self.worker_num
+
+    def runs_compaction(self):
+        return self.worker_num == 0
+
+    def snapshot_path(self):
+        if not settings.LABELS_SNAPSHOT_PATH:
+            return settings.LABELS_SNAPSHOT_PATH
+
+        return f"{settings.LABELS_SNAPSHOT_PATH}.{self.worker_num}"
+
+    def stats_source(self):
+        return f"{super().stats_source()}-{self.worker_num}"
+
+    def route_labels(self, labels):
+        routed = {}
+        for label_name, label_values in labels.items():
+            routed.setdefault(label_owner(label_name, len(self.queues)), {})[label_name] = label_values
+
+        for owner, owner_labels in routed.items():
+            self.queues[owner].put(owner_labels)
+
+    def aggregate_event(self, data):
+        self.route_labels({label_name: [label_value] for label_name, label_value in data.items()})
+
+    def aggregate_labels(self, labels):
+        self.route_labels(labels)
+
+    def aggregate_owned_labels(self):
+        queue = self.queues[self.worker_num]
+        while True:
+            labels = queue.get()
+            try:
+                FilterLabels.aggr_labels_bulk(labels)
+            except Exception as exc:
+                logger.critical(
+                    msg=f"Labels aggregation exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                    extra={'tags': {}}
+                )
+
+    def run(self):
+        # Connections inherited from the parent process must not be shared
+        db.engine.dispose()
+
+        if settings.CONSUMER_WORKER_METRICS_PORT:
+            start_http_server(settings.CONSUMER_WORKER_METRICS_PORT + self.worker_num)
+
+        aggregator = threading.Thread(name='Labels aggregator', target=self.aggregate_owned_labels, daemon=True)
+        aggregator.start()
+
+        self.start_consumer(consumer_num=f"{ServiceConfig.SERVICE_NAME}-{self.worker_num}")
+
+
+def run_worker(worker_num, queues):
+    ConsumerWorker(worker_num=worker_num, queues=queues).run()
+
+
+class ConsumerPool(object):
+    def __init__(self, workers=settings.CONSUMER_WORKERS):
+        self.context = multiprocessing.get_context('fork')
+        self.workers = workers
+        self.queues = [self.context.Queue(maxsize=settings.CONSUMER_ROUTING_QUEUE_SIZE) for _ in range(workers)]
+        self.processes = []
+
+    def start(self):
+        if settings.CONSUMER_MODE == 'write_behind' and settings.LABELS_STORAGE_MODE != 'normalized':
+            # Blob of a label is rewritten by read-modify-write, concurrent writes of workers would lose values
+            logger.critical(
+                msg=f"Write-behind mode with {self.workers} workers requires normalized labels storage, "
+                    f"got {settings.LABELS_STORAGE_MODE}"
+            )
+            raise SystemExit(1)
+
+        for worker_num in range(self.workers):
+            process = self.context.Process(
+                name=f"Consumer worker {worker_num}",
+                target=run_worker,
+                args=(worker_num, self.queues),
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+
+        logger.info(msg=f"Consumer pool has been started. Workers: {self.workers}")
+
+    def join(self):
+        """
+        Wait for workers. If any worker exits the whole pool is stopped, as its labels are not aggregated anymore
+        """
+        multiprocessing.connection.wait([process.sentinel for process in self.processes])
+
+        for process in self.processes:
+            if not process.is_alive():
+                logger.critical(msg=f"{process.name} exited with code {process.exitcode}. Stopping consumer pool")
+
+        for process in self.processes:
+            process.terminate()
+
+        raise SystemExit(1)
+
+    def main(self):
+        self.start()
+        self.join()
@@ -0,0 +1,365 @@
+import copy
+import re
+import threading
+from microservice_template_core.tools.logger import get_logger
+import ujson as json
+import harp_filters.settings as settings
+from harp_filters.logic.catalog_changes import settled_change_id
+from harp_filters.models.filter_config import FilterConfig
+from harp_filters.models.catalog_change import CatalogChange
+from harp_filters.models.catalog_version import CatalogVersion, FILTERS_CATALOG
+
+logger = get_logger()
+
+
+def event_tags(event):
+    """
+    Return tags of decorated notification - top level fields with additional_fields merged on top,
+    the same way consumer builds labels
+    """
+    additional_fields = event.get('additional_fields') or {}
+    tags = {tag: value for tag, value in event.items() if tag != 'additional_fields'}
+    tags.update(additional_fields)
+
+    return tags
+
+
+def tag_value(tags, tag):
+    value = tags.get(tag)
+    if value is None:
+        return None
+
+    return value if isinstance(value, str) else str(value)
+
+
+def clause_values(clause):
+    value = clause.get('value')
+    if isinstance(value, list):
+        return [str(single_value) for single_value in value]
+
+    return [str(value)]
+
+
+def compile_clause(clause):
+    tag = clause['tag']
+    condition = clause.get('condition', 'equal')
+    values = clause_values(clause)
+
+    if condition in ('equal', 'in'):
+        allowed = frozenset(values)
+        return lambda tags: tag_value(tags, tag) in allowed
+    if condition in ('not_equal', 'not_in'):
+        denied = frozenset(values)
+        return lambda tags: tag_value(tags, tag) not in denied
+    if condition == 'contains':
+        return lambda tags: any(value in (tag_value(tags, tag) or '') for value in values)
+    if condition == 'not_contains':
+        return lambda tags: not any(value in (tag_value(tags, tag) or '') for value in values)
+    if condition == 'starts_with':
+        prefixes = tuple(values)
+        return lambda tags: (tag_value(tags, tag) or '').startswith(prefixes)
+    if condition == 'ends_with':
+        suffixes = tuple(values)
+        return lambda tags: (tag_value(tags, tag) or '').endswith(suffixes)
+    if condition in ('regex', 'not_regex'):
+        try:
+            pattern = re.compile('|'.join(f"(?:{value})" for value in values))
+        except re.error as err:
+            raise ValueError(f"Regex of tag {tag} is not valid - {err}")
+        if condition == 'regex':
+            return lambda tags: pattern.search(tag_value(tags, tag) or '') is not None
+        return lambda tags: pattern.search(tag_value(tags, tag) or '') is None
+
+    raise ValueError(f"Condition {condition} of tag {tag} is not supported")
+
+
+def compile_filter(filter_config):
+    """
+    Compile list of {tag, condition, value} clauses into predicate over event tags.
+    Equal clauses of the same tag are OR-ed, as an event has a single value per tag; all other clauses are AND-ed
+    """
+    equal_values = {}
+    predicates = []
+    for clause in filter_config:
+        if not isinstance(clause, dict) or 'tag' not in clause:
+            raise ValueError(f"Clause is not valid - {clause}")
+        if clause.get('condition', 'equal') in ('equal', 'in'):
+            equal_values.setdefault(clause['tag'], []).extend(clause_values(clause))
+        else:
+            predicates.append(compile_clause(clause))
+
+    for tag, values in equal_values.items():
+        predicates.insert(0, compile_clause({'tag': tag, 'condition': 'in', 'value': values}))
+
+    if not predicates:
+        return lambda tags: True
+    if len(predicates) == 1:
+        return predicates[0]
+
+    return lambda tags: all(predicate(tags) for predicate in predicates)
+
+
+def equal_index_keys(filter_config):
+    """
+    Return (tag, value) keys of the most selective equal group of the filter. Every event matched by the filter
+    has one of these keys, so the filter is a candidate only for events which have one of them.
+    Empty list means the filter has no equal clauses and must be checked against every event
+    """
+    equal_values = {}
+    for clause in filter_config:
+        if clause.get('condition', 'equal') in ('equal', 'in'):
+            equal_values.setdefault(clause['tag'], set()).update(clause_values(clause))
+
+    if not equal_values:
+        return []
+
+    tag, values = min(equal_values.items(), key=lambda item: len(item[1]))
+    return [(tag, value) for value in values]
+
+
+class CompiledFilter(object):
+    __slots__ = ('filter_id', 'filter_status', 'created_by', 'last_update_ts', 'raw_config', 'predicate', 'index_keys')
+
+    def __init__(self, filter_id, filter_status, created_by, last_update_ts, raw_config):
+        self.filter_id = filter_id
+        self.filter_status = filter_status
+        self.created_by = created_by
+        self.last_update_ts = last_update_ts
+        self.raw_config = raw_config
+        self.index_keys = []
+        try:
+            filter_config = json.loads(raw_config)
+            self.predicate = compile_filter(filter_config)
+            self.index_keys = equal_index_keys(filter_config)
+        except (ValueError, KeyError, TypeError, AttributeError) as err:
+            logger.warning(msg=f"Filter {filter_id} can't be compiled and matches nothing - {err}")
+            self.predicate = None
+
+    def visible_to(self, username):
+        return self.filter_status != 'private' or self.created_by == username
+
+    def matches(self, tags):
+        return self.predicate is not None and self.predicate(tags)
+
+
+class FilterIndex(object):
+    """
+    Immutable snapshot of compiled filters. Inverted index maps (tag, value) of equal clauses to filter ids,
+    so an event is fully evaluated only against filters indexed by one of its tags plus filters without equal clauses.
+    Visibility is precomputed as public ids and private ids per creator, so it is checked per candidate.
+    change_id is the position in filters changes log up to which the index is built
+    """
+    __slots__ = ('version', 'change_id', 'filters', 'index', 'unindexed', 'public_ids', 'private_ids')
+
+    def __init__(self, version=None, filters=None, change_id=None):
+        self.version = version
+        self.change_id = change_id
+        self.filters = filters or {}
+        index = {}
+        unindexed = set()
+        public_ids = set()
+        private_ids = {}
+        for compiled in self.filters.values():
+            if compiled.filter_status == 'private':
+                private_ids.setdefault(compiled.created_by, set()).add(compiled.filter_id)
+            else:
+                public_ids.add(compiled.filter_id)
+
+            if not compiled.predicate:
+                continue
+            if not compiled.index_keys:
+                unindexed.add(compiled.filter_id)
+            for key in compiled.index_keys:
+                index.setdefault(key, set()).add(compiled.filter_id)
+
+        self.index = {key: frozenset(filter_ids) for key, filter_ids in index.items()}
+        self.unindexed = frozenset(unindexed)
+        self.public_ids = frozenset(public_ids)
+        self.private_ids = {username: frozenset(filter_ids) for username, filter_ids in private_ids.items()}
+
+    def updated(self, version, change_id, changed):
+        """
+        Return new index with {filter_id: CompiledFilter, None if deleted} applied.
+        Only index entries of changed filters are copied, all other entries are shared with this index
+        """
+        filters = dict(self.filters)
+        unindexed = set(self.unindexed)
+        public_ids = set(self.public_ids)
+        index = {}
+        private_ids = {}
+
+        def place(compiled, add):
+            if compiled.filter_status == 'private':
+                if compiled.created_by not in private_ids:
+                    private_ids[compiled.created_by] = set(self.private_ids.get(compiled.created_by, ()))
+                filter_ids = [private_ids[compiled.created_by]]
+            else:
+                filter_ids = [public_ids]
+
+            if compiled.predicate:
+                if not compiled.index_keys:
+                    filter_ids.append(unindexed)
+                for key in compiled.index_keys:
+                    if key not in index:
+                        index[key] = set(self.index.get(key, ()))
+                    filter_ids.append(index[key])
+
+            for ids in filter_ids:
+                if add:
+                    ids.add(compiled.filter_id)
+                else:
+                    ids.discard(compiled.filter_id)
+
+        for filter_id, compiled in changed.items():
+            previous = filters.pop(filter_id, None)
+            if previous is not None:
+                place(previous, add=False)
+            if compiled is not None:
+                place(compiled, add=True)
+                filters[filter_id] = compiled
+
+        snapshot = copy.copy(self)
+        snapshot.version = version
+        snapshot.change_id = change_id
+        snapshot.filters = filters
+        snapshot.unindexed = frozenset(unindexed)
+        snapshot.public_ids = frozenset(public_ids)
+        snapshot.index = dict(self.index)
+        for key, filter_ids in index.items():
+            if filter_ids:
+                snapshot.index[key] = frozenset(filter_ids)
+            else:
+                snapshot.index.pop(key, None)
+        snapshot.private_ids = dict(self.private_ids)
+        for username, filter_ids in private_ids.items():
+            if filter_ids:
+                snapshot.private_ids[username] = frozenset(filter_ids)
+            else:
+                snapshot.private_ids.pop(username, None)
+
+        return snapshot
+
+    def candidates(self, tags):
+        candidates = set(self.unindexed)
+        for tag, value in tags.items():
+            filter_ids = self.index.get((tag, value if isinstance(value, str) else str(value)))
+            if filter_ids:
+                candidates.update(filter_ids)
+
+        return candidates
+
+    def visible_to(self, filter_id, username):
+        return filter_id in self.public_ids or filter_id in self.private_ids.get(username, ())
+
+
+class FilterEngine(object):
+    """
+    Compiled predicates of all filters keyed by filter_id.
+    When filters catalog version changes, only filters changes since the last sync are read from the changes log
+    and applied to a copy-on-write FilterIndex, which is swapped in, so matching reads the current index without
+    a lock. All filters are re-read from DB only on the first sync and when the log was trimmed past the index
+    """
+
+    def __init__(self, page_size=settings.CATALOG_CHANGES_PAGE_SIZE):
+        self.page_size = page_size
+        self.snapshot = FilterIndex()
+        self._sync_lock = threading.Lock()
+
+    def sync(self):
+        version = CatalogVersion.get_version(FILTERS_CATALOG)
+        if version == self.snapshot.version:
+            return
+
+        with self._sync_lock:
+            snapshot = self.snapshot
+            if version == snapshot.version:
+                return
+
+            if snapshot.change_id is None or snapshot.change_id < CatalogChange.trimmed_change_id():
+                self.snapshot = self.rebuild(snapshot, version)
+            else:
+                self.snapshot = self.apply_changes(snapshot, version)
+
+    @staticmethod
+    def rebuild(snapshot, version):
+        """
+        Build index of all filters. Changes after the settled change_id taken before the read are replayed
+        by the next syncs, they are idempotent
+        """
+        change_id = settled_change_id()
+        compiled_filters = snapshot.filters
+        filters = {}
+        for row in FilterConfig.get_match_info():
+            compiled = compiled_filters.get(row.filter_id)
+            # Filters of the current snapshot are never modified, a changed filter is compiled again
+            if compiled is None or (compiled.raw_config, compiled.filter_status, compiled.created_by) != (
+                    row.filter_config, row.filter_status, row.created_by):
+                compiled = CompiledFilter(
+                    row.filter_id, row.filter_status, row.created_by, row.last_update_ts, row.filter_config
+                )
+            filters[row.filter_id] = compiled
+
+        logger.info(msg=f"Filter index has been rebuilt. Filters: {len(filters)}")
+
+        return FilterIndex(version, filters, change_id)
+
+    @staticmethod
+    def compile_change(change):
+        payload = json.loads(change.payload)
+        filter_id = int(payload['filter_id'])
+        if change.operation == 'delete':
+            return filter_id, None
+
+        compiled = CompiledFilter(
+            filter_id, payload['filter_status'], change.owner, change.create_ts, json.dumps(payload['filter_config'])
+        )
+        return filter_id, compiled
+
+    def apply_changes(self, snapshot, version):
+        """
+        Apply settled filters changes after the index position. While newer changes are not settled yet,
+        version is not remembered, so the next sync applies them
+        """
+        until = settled_change_id()
+        position = snapshot.change_id
+        changed = {}
+        while True:
+            changes = CatalogChange.changes_between(
+                FILTERS_CATALOG, position, until, self.page_size, include_private=True
+            )
+            for change in changes:
+                filter_id, compiled = self.compile_change(change)
+                changed[filter_id] = compiled
+            if len(changes) < self.page_size:
+                break
+            position = changes[-1].change_id
+
+        if CatalogChange.last_change_id(catalog=FILTERS_CATALOG) > until:
+            version = None
+
+        return snapshot.updated(version, max(snapshot.change_id, until), changed)
+
+    def match_events(self, events, username, filter_ids=None):
+        """
+        Return list of matched filter ids for every event
+        """
+        self.sync()
+        snapshot = self.snapshot
+        filters = snapshot.filters
+        requested_ids = None if filter_ids is None else frozenset(filter_ids)
+
+        result = []
+        for event in events:
+            tags = event_tags(event)
+            matched = []
+            for filter_id in sorted(snapshot.candidates(tags)):
+                if requested_ids is not None and filter_id not in requested_ids:
+                    continue
+                if snapshot.visible_to(filter_id, username) and filters[filter_id].matches(tags):
+                    matched.append(str(filter_id))
+            result.append(matched)
+
+        return result
+
+
+filter_engine = FilterEngine()
@@ -0,0 +1,350 @@
+import collections
+import hashlib
+import math
+import threading
+import time
+from microservice_template_core.tools.logger import get_logger
+import ujson as json
+import harp_filters.settings as settings
+from harp_filters.metrics.service_monitoring import Prom
+from harp_filters.logic.source_snapshots import SourceSnapshotFlush, updated_since
+from harp_filters.models.filter_label_cardinality import FilterLabelCardinality
+
+logger = get_logger()
+
+POWERS = [2.0 ** -rank for rank in range(65)]
+
+
+def value_hash(label_value, blake2b=hashlib.blake2b, from_bytes=int.from_bytes):
+    """
+    64-bit hash of label value, stable between processes so registers of all consumers can be merged
+    """
+    if type(label_value) is str:
+        encoded = label_value.encode('utf-8')
+    else:
+        encoded = json.dumps(label_value, sort_keys=True).encode('utf-8')
+
+    return from_bytes(blake2b(encoded, digest_size=8).digest(), 'big')
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog of 2 ** precision one-byte registers, standard error is 1.04 / sqrt(2 ** precision).
+    Sum of 2 ** -register and number of zero registers are updated on every register change,
+    so estimate doesn't scan registers
+    """
+    __slots__ = ('precision', 'registers', 'inverse_sum', 'zeros')
+
+    def __init__(self, precision, registers=None):
+        self.precision = precision
+        self.registers = bytearray(1 << precision) if registers is None else bytearray(registers)
+        self.recount()
+
+    def recount(self):
+        self.inverse_sum = sum(POWERS[rank] for rank in self.registers)
+        self.zeros = self.registers.count(0)
+
+    def add_hashes(self, hashes):
+        """
+        Add 64-bit hashes and return True if registers changed
+        """
+        rest_bits = 64 - self.precision
+        rest_mask = (1 << rest_bits) - 1
+        registers = self.registers
+        changed = False
+        for hash_value in hashes:
+            index = hash_value >> rest_bits
+            rank = rest_bits - (hash_value & rest_mask).bit_length() + 1
+            old_rank = registers[index]
+            if rank > old_rank:
+                registers[index] = rank
+                self.inverse_sum += POWERS[rank] - POWERS[old_rank]
+                if not old_rank:
+                    self.zeros -= 1
+                changed = True
+
+        return changed
+
+    def merge(self, registers):
+        self.registers = bytearray(map(max, self.registers, registers))
+        self.recount()
+
+    def estimate(self):
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / self.inverse_sum
+
+        zeros = self.zeros
+        if estimate <= 2.5 * size and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = size * math.log(size / zeros)
+
+        return estimate
+
+
+class WindowedHyperLogLog(object):
+    """
+    HyperLogLog of values seen in the last windows rotations. Every window has its own sketch, allocated on
+    the first value, and merged sketch of all windows is updated on every add and rebuilt on rotation
+    """
+    __slots__ = ('precision', 'windows', 'merged')
+
+    def __init__(self, precision, windows, registers=None):
+        self.precision = precision
+        self.windows = collections.deque([None] * windows, maxlen=windows)
+        self.merged = HyperLogLog(precision, registers)
+        if registers is not None:
+            self.windows[-1] = HyperLogLog(precision, registers)
+
+    def add_hashes(self, hashes):
+        """
+        Add 64-bit hashes to the current window and return True if merged registers changed
+        """
+        if self.windows[-1] is None:
+            self.windows[-1] = HyperLogLog(self.precision)
+        self.windows[-1].add_hashes(hashes)
+
+        return self.merged.add_hashes(hashes)
+
+    def rotate(self):
+        """
+        Drop the oldest window and start a new one. Return False if no window has values any more
+        """
+        self.windows.append(None)
+        merged = HyperLogLog(self.precision)
+        for sketch in self.windows:
+            if sketch is not None:
+                merged.merge(sketch.registers)
+        self.merged = merged
+
+        return any(sketch is not None for sketch in self.windows)
+
+    @property
+    def registers(self):
+        return self.merged.registers
+
+    def estimate(self):
+        return self.merged.estimate()
+
+
+def label_policy(label_name, cardinality, limit=settings.LABELS_CARDINALITY_LIMIT):
+    """
+    Return allow, aggregate, drop or sample
+    """
+    if label_name in settings.LABELS_CARDINALITY_ALLOW:
+        return 'allow'
+    if limit and cardinality > limit:
+        return settings.LABELS_CARDINALITY_ACTION
+
+    return 'aggregate'
+
+
+class LabelCardinality(object):
+    """
+    Windowed HyperLogLog cardinality estimates of up to max_labels labels, fed with unique label values of consumed
+    batches. Values of a label above limit are not aggregated (drop) or only values with hash in sample_rate fraction
+    are aggregated (sample), so the label keeps about sample_rate of its values. Labels of the allow-list
+    are always aggregated. Policy of a label follows the higher of the process estimate and the estimate merged over
+    all consumers on the last flush, the same the API reports
+    """
+
+    def __init__(self, precision=settings.LABELS_CARDINALITY_PRECISION, max_labels=settings.LABELS_CARDINALITY_MAX_LABELS,
+                 limit=settings.LABELS_CARDINALITY_LIMIT, action=settings.LABELS_CARDINALITY_ACTION,
+                 sample_rate=settings.LABELS_CARDINALITY_SAMPLE_RATE, windows=settings.LABELS_CARDINALITY_WINDOWS,
+                 window_seconds=settings.LABELS_CARDINALITY_WINDOW_SECONDS):
+        self.precision = precision
+        self.max_labels = max_labels
+        self.limit = limit
+        self.action = action
+        self.sample_threshold = int(sample_rate * 2 ** 64)
+        self.windows = windows
+        self.window_seconds = window_seconds
+        self.rotate_at = time.monotonic() + window_seconds
+        self.sketches = {}
+        self.estimates = {}
+        # Estimates merged over all consumers on the last flush
+        self.shared_estimates = {}
+        self.limited = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.precision > 0 and self.max_labels > 0
+
+    def update_policy(self, label_name):
+        """
+        Re-evaluate policy of the label. Call with the lock held
+        """
+        estimate = max(self.estimates.get(label_name, 0), self.shared_estimates.get(label_name, 0))
+        Prom.LABEL_CARDINALITY.labels(label=label_name).set(estimate)
+
+        limited = label_policy(label_name, estimate, self.limit) in ('drop', 'sample')
+        if limited and label_name not in self.limited:
+            self.limited.add(label_name)
+            logger.warning(
+                msg=f"Label {label_name} has about {int(estimate)} values, above limit {self.limit}. "
+                    f"New values are aggregated with policy: {self.action}"
+            )
+        elif not limited and label_name in self.limited:
+            self.limited.discard(label_name)
+            logger.info(
+                msg=f"Label {label_name} has about {int(estimate)} values, below limit {self.limit}. "
+                    f"New values are aggregated again"
+            )
+
+    def update_estimate(self, label_name):
+        """
+        Recompute estimate of the label and its policy. Call with the lock held
+        """
+        self.estimates[label_name] = self.sketches[label_name].estimate()
+        self.update_policy(label_name)
+
+    def rotate(self):
+        """
+        Start new window of all sketches, labels without values in the remaining windows are forgotten.
+        Call with the lock held
+        """
+        for label_name, sketch in list(self.sketches.items()):
+            if sketch.rotate():
+                self.update_estimate(label_name)
+                continue
+            del self.sketches[label_name]
+            self.estimates.pop(label_name, None)
+            self.update_policy(label_name)
+
+        self.rotate_at = time.monotonic() + self.window_seconds
+
+    def apply_shared(self, shared_estimates):
+        """
+        Replace estimates merged over all consumers ({label_name: cardinality}) and re-evaluate policies
+        """
+        with self._lock:
+            label_names = set(self.shared_estimates) | set(shared_estimates) | self.limited
+            self.shared_estimates = shared_estimates
+            for label_name in label_names:
+                self.update_policy(label_name)
+
+    def select(self, labels):
+        """
+        Count unique values of labels ({label_name: [label_values]}) and return labels without values skipped by policy
+        """
+        if not self.enabled:
+            return labels
+
+        selected = {}
+        with self._lock:
+            if time.monotonic() >= self.rotate_at:
+                self.rotate()
+
+            for label_name, label_values in labels.items():
+                sketch = self.sketches.get(label_name)
+                if sketch is None and len(self.sketches) < self.max_labels:
+                    sketch = self.sketches[label_name] = WindowedHyperLogLog(self.precision, self.windows)
+
+                hashes = None
+                if sketch is not None:
+                    hashes = [value_hash(label_value) for label_value in label_values]
+                    if sketch.add_hashes(hashes):
+                        self.update_estimate(label_name)
+
+                if label_name not in self.limited:
+                    selected[label_name] = label_values
+                    continue
+
+                kept_values = []
+                if self.action == 'sample':
+                    if hashes is None:
+                        hashes = [value_hash(label_value) for label_value in label_values]
+                    kept_values = [
+                        label_value for label_value, hash_value in zip(label_values, hashes)
+                        if hash_value < self.sample_threshold
+                    ]
+                if kept_values:
+                    selected[label_name] = kept_values
+                Prom.LABELS_CARDINALITY_SKIPPED.labels(label=label_name).inc(len(label_values) - len(kept_values))
+
+        return selected
+
+    def select_event(self, data):
+        """
+        Same as select for labels of one event ({label_name: label_value})
+        """
+        if not self.enabled:
+            return data
+
+        selected = self.select({label_name: [label_value] for label_name, label_value in data.items()})
+        return {label_name: label_values[0] for label_name, label_values in selected.items()}
+
+    def load(self, label_registers):
+        """
+        Restore sketches from registers written by this process before restart. They are restored as the current
+        window, so values seen before restart are forgotten after the windows rotations
+        """
+        with self._lock:
+            for label_name, registers in label_registers.items():
+                if len(registers) != 1 << self.precision or len(self.sketches) >= self.max_labels:
+                    continue
+                self.sketches[label_name] = WindowedHyperLogLog(self.precision, self.windows, registers)
+                self.update_estimate(label_name)
+
+    def label_registers(self):
+        with self._lock:
+            return {label_name: bytes(sketch.registers) for label_name, sketch in self.sketches.items()}
+
+
+label_cardinality = LabelCardinality()
+
+
+def merged_cardinality(label_name=None):
+    """
+    Return [{label_name, cardinality, policy}] estimated from registers of all consumers, highest cardinality first
+    """
+    sketches = {}
+    for row_label_name, registers in FilterLabelCardinality.iter_registers(
+        updated_since(settings.LABELS_CARDINALITY_FLUSH_SECONDS), label_name
+    ):
+        sketch = sketches.get(row_label_name)
+        if sketch is None:
+            sketches[row_label_name] = HyperLogLog(int(math.log2(len(registers))), registers)
+        elif len(sketch.registers) == len(registers):
+            sketch.merge(registers)
+
+    result = []
+    for row_label_name, sketch in sketches.items():
+        estimate = sketch.estimate()
+        result.append({
+            'label_name': row_label_name,
+            'cardinality': int(round(estimate)),
+            'policy': label_policy(row_label_name, estimate)
+        })
+
+    return sorted(result, key=lambda item: item['cardinality'], reverse=True)
+
+
+class LabelCardinalityFlush(SourceSnapshotFlush):
+    """
+    Periodic write of process registers to filter_label_cardinality under the process source name.
+    Estimates merged over all consumers are read back, so all consumers and the API apply the same policy
+    """
+    name = 'Label cardinality'
+    model = FilterLabelCardinality
+
+    def __init__(self, source, interval_seconds=settings.LABELS_CARDINALITY_FLUSH_SECONDS):
+        super().__init__(source, interval_seconds)
+
+    @property
+    def enabled(self):
+        return label_cardinality.enabled and super().enabled
+
+    def load(self):
+        label_cardinality.load(FilterLabelCardinality.source_registers(self.source))
+        logger.info(msg=f"Label cardinality estimates have been loaded. Labels: {len(label_cardinality.sketches)}")
+
+    def write(self):
+        FilterLabelCardinality.replace_source(self.source, label_cardinality.label_registers())
+
+    def flush(self):
+        super().flush()
+        label_cardinality.apply_shared({
+            item['label_name']: item['cardinality'] for item in merged_cardinality()
+        })
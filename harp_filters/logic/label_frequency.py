@@ -0,0 +1,168 @@
+import heapq
+import itertools
+import threading
+import time
+from microservice_template_core.tools.logger import get_logger
+import harp_filters.settings as settings
+from harp_filters.logic.labels_cache import value_key
+from harp_filters.logic.source_snapshots import SourceSnapshotFlush
+from harp_filters.models.filter_label_stats import FilterLabelStats
+
+logger = get_logger()
+
+# Counters are rescaled once the weight of a new event reaches this value
+MAX_WEIGHT = 2 ** 20
+# Tie breaker of heap entries, value keys of different types are not comparable
+SEQUENCE = itertools.count()
+
+
+class SpaceSaving(object):
+    """
+    Space-Saving sketch of one label: capacity counters of the most frequent values.
+    A new value replaces the smallest counter and inherits its count as error, so any value
+    with frequency above total / capacity is always kept. The smallest counter is found with a lazy heap:
+    counts only grow, so an outdated heap entry is pushed back with the current count when popped
+    """
+    __slots__ = ('capacity', 'counters', 'heap')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # value_key -> [count, error, label_value]
+        self.counters = {}
+        # (count, sequence, value_key), count may be outdated
+        self.heap = []
+
+    def pop_min(self):
+        while True:
+            count, _, key = heapq.heappop(self.heap)
+            counter = self.counters[key]
+            if counter[0] == count:
+                del self.counters[key]
+                return count
+            heapq.heappush(self.heap, (counter[0], next(SEQUENCE), key))
+
+    def add(self, key, label_value, weight):
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+            return
+
+        min_count = self.pop_min() if len(self.counters) >= self.capacity else 0.0
+        self.counters[key] = [min_count + weight, min_count, label_value]
+        heapq.heappush(self.heap, (min_count + weight, next(SEQUENCE), key))
+
+    def scale(self, factor):
+        for counter in self.counters.values():
+            counter[0] *= factor
+            counter[1] *= factor
+        self.heap = [(counter[0], next(SEQUENCE), key) for key, counter in self.counters.items()]
+        heapq.heapify(self.heap)
+
+    def top(self, limit):
+        return sorted(self.counters.values(), key=lambda counter: counter[0], reverse=True)[:limit]
+
+
+class LabelFrequency(object):
+    """
+    Space-Saving sketches of up to max_labels labels fed with every sample_every-th consumed event,
+    so memory is fixed regardless of value cardinality. Sampled event counts as sample_every events.
+    Frequencies decay with half_life_seconds: instead of decaying all counters, every new event is added
+    with weight 2 ** (age / half_life) and counters are divided by the weight on read
+    """
+
+    def __init__(self, capacity=settings.LABELS_FREQUENCY_CAPACITY, max_labels=settings.LABELS_FREQUENCY_MAX_LABELS,
+                 half_life_seconds=settings.LABELS_FREQUENCY_HALF_LIFE_SECONDS,
+                 sample_every=settings.LABELS_FREQUENCY_SAMPLE_EVERY):
+        self.capacity = capacity
+        self.max_labels = max_labels
+        self.half_life_seconds = half_life_seconds
+        self.sample_every = max(sample_every, 1)
+        # Index of the next sampled event in the next list of events
+        self.sample_offset = 0
+        self.sketches = {}
+        self.base_ts = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.capacity > 0 and self.max_labels > 0
+
+    def weight(self, now):
+        """
+        Weight of an event at now. Call with the lock held
+        """
+        if self.half_life_seconds <= 0:
+            return 1.0
+
+        weight = 2 ** ((now - self.base_ts) / self.half_life_seconds)
+        if weight >= MAX_WEIGHT:
+            for sketch in self.sketches.values():
+                sketch.scale(1 / weight)
+            self.base_ts = now
+            weight = 1.0
+
+        return weight
+
+    def record_events(self, events):
+        if not self.enabled or not events:
+            return
+
+        sketches = self.sketches
+        with self._lock:
+            if self.sample_offset >= len(events):
+                self.sample_offset -= len(events)
+                return
+
+            sampled = events[self.sample_offset::self.sample_every]
+            self.sample_offset = (self.sample_offset - len(events)) % self.sample_every
+            weight = self.weight(time.time()) * self.sample_every
+            for data in sampled:
+                for label_name, label_value in data.items():
+                    sketch = sketches.get(label_name)
+                    if sketch is None:
+                        if len(sketches) >= self.max_labels:
+                            continue
+                        sketch = sketches[label_name] = SpaceSaving(self.capacity)
+                    key = label_value if type(label_value) is str else value_key(label_value)
+                    # Increment of a tracked value is inlined, it is the most frequent case
+                    counter = sketch.counters.get(key)
+                    if counter is not None:
+                        counter[0] += weight
+                    else:
+                        sketch.add(key, label_value, weight)
+
+    def top(self, limit):
+        """
+        Return {label_name: [(label_value, frequency, error)]} of up to limit most frequent values per label
+        """
+        with self._lock:
+            weight = self.weight(time.time())
+            return {
+                label_name: [
+                    (label_value, count / weight, error / weight) for count, error, label_value in sketch.top(limit)
+                ]
+                for label_name, sketch in self.sketches.items()
+            }
+
+
+label_frequency = LabelFrequency()
+
+
+class LabelFrequencyFlush(SourceSnapshotFlush):
+    """
+    Periodic write of top values of the process sketches to filter_label_stats under the process source name
+    """
+    name = 'Label frequency'
+    model = FilterLabelStats
+
+    def __init__(self, source, interval_seconds=settings.LABELS_FREQUENCY_FLUSH_SECONDS,
+                 top_k=settings.LABELS_FREQUENCY_TOP_K):
+        super().__init__(source, interval_seconds)
+        self.top_k = top_k
+
+    @property
+    def enabled(self):
+        return label_frequency.enabled and super().enabled
+
+    def write(self):
+        FilterLabelStats.replace_source(self.source, label_frequency.top(self.top_k))
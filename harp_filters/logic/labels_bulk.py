@@ -0,0 +1,76 @@
+import ujson as json
+import harp_filters.settings as settings
+from harp_filters.models.filter_labels import FilterLabels
+from harp_filters.logic.labels_cache import value_key
+
+
+def parse_import_line(line, line_num):
+    """
+    Return (label_name, label_values) of NDJSON line {"label_name": "...", "label_values": [...]}
+    """
+    try:
+        item = json.loads(line)
+    except ValueError as err:
+        raise ValueError(f"Line {line_num} is not valid JSON - {err}")
+
+    if not isinstance(item, dict) or not isinstance(item.get('label_name'), str) or not item['label_name']:
+        raise ValueError(f"Line {line_num} should be an object with non-empty label_name")
+    if not isinstance(item.get('label_values', []), list):
+        raise ValueError(f"Line {line_num}: label_values should be a list")
+
+    return item['label_name'], item.get('label_values', [])
+
+
+class LabelsImport(object):
+    """
+    Merge NDJSON stream of labels into existing values. Lines are read one by one and
+    values are written with one commit per chunk_size values, so the stream is never fully loaded.
+    Chunks committed before an invalid line or a DB error are kept. Labels without values are created empty
+    """
+
+    def __init__(self, chunk_size=settings.LABELS_BULK_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.lines = 0
+        self.values = 0
+        self.chunks = 0
+        self.label_names = set()
+        self._chunk = {}
+        self._chunk_values = 0
+
+    def stats(self):
+        return {'lines': self.lines, 'labels': len(self.label_names), 'values': self.values, 'chunks': self.chunks}
+
+    def add(self, label_name, label_values):
+        self.label_names.add(label_name)
+        chunk_values = self._chunk.setdefault(label_name, {})
+        for label_value in label_values:
+            chunk_values[value_key(label_value)] = label_value
+            self._chunk_values += 1
+            self.values += 1
+            if self._chunk_values >= self.chunk_size:
+                self.flush()
+                chunk_values = self._chunk.setdefault(label_name, {})
+
+    def flush(self):
+        if not self._chunk:
+            return
+
+        labels = {label_name: list(label_values.values()) for label_name, label_values in self._chunk.items()}
+        self._chunk = {}
+        self._chunk_values = 0
+        if not FilterLabels.import_labels(labels):
+            raise RuntimeError(f"Chunk ending at line {self.lines} can't be written to DB")
+        self.chunks += 1
+
+    def run(self, lines):
+        for line in lines:
+            self.lines += 1
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            self.add(*parse_import_line(line, self.lines))
+
+        self.flush()
+
+        return self.stats()
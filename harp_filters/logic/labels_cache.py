@@ -0,0 +1,161 @@
+import threading
+from collections import OrderedDict
+import ujson as json
+import harp_filters.settings as settings
+from harp_filters.metrics.service_monitoring import Prom
+
+
+def value_key(label_value):
+    """
+    Return hashable representation of label value. Dicts and lists are serialized with sorted keys
+    """
+    if isinstance(label_value, (dict, list)):
+        return '__json__', json.dumps(label_value, sort_keys=True)
+
+    return label_value
+
+
+class LabelsCache(object):
+    """
+    Process-local LRU cache of (label_name, label_value) pairs which are already stored in DB
+    """
+
+    def __init__(self, max_size=settings.LABELS_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._pairs = OrderedDict()
+        self._labels = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def __len__(self):
+        return len(self._pairs)
+
+    def is_full(self):
+        return len(self._pairs) >= self.max_size
+
+    def contains(self, label_name, label_value):
+        if not self.enabled:
+            return False
+
+        pair = (label_name, value_key(label_value))
+        with self._lock:
+            if pair in self._pairs:
+                self._pairs.move_to_end(pair)
+                self.hits += 1
+                Prom.LABELS_CACHE_HITS.inc()
+                return True
+
+            self.misses += 1
+            Prom.LABELS_CACHE_MISSES.inc()
+            return False
+
+    def add(self, label_name, label_value):
+        self.add_key(label_name, value_key(label_value))
+
+    def add_key(self, label_name, key):
+        if not self.enabled:
+            return
+
+        pair = (label_name, key)
+        with self._lock:
+            if pair in self._pairs:
+                self._pairs.move_to_end(pair)
+                return
+
+            self._pairs[pair] = None
+            self._labels.setdefault(label_name, set()).add(pair[1])
+
+            while len(self._pairs) > self.max_size:
+                self._evict()
+
+            Prom.LABELS_CACHE_SIZE.set(len(self._pairs))
+
+    def add_keys(self, label_name, keys):
+        """
+        Add value keys of one label under one lock while the cache has free space. Return number of added keys
+        """
+        if not self.enabled:
+            return 0
+
+        added = 0
+        with self._lock:
+            label_keys = self._labels.setdefault(label_name, set())
+            for key in keys:
+                if len(self._pairs) >= self.max_size:
+                    break
+                self._pairs[(label_name, key)] = None
+                label_keys.add(key)
+                added += 1
+            if not label_keys:
+                del self._labels[label_name]
+
+            Prom.LABELS_CACHE_SIZE.set(len(self._pairs))
+
+        return added
+
+    def add_values(self, label_name, label_values):
+        for label_value in label_values:
+            self.add(label_name, label_value)
+
+    def discard(self, label_name, label_value):
+        pair = (label_name, value_key(label_value))
+        with self._lock:
+            if self._pairs.pop(pair, False) is not False:
+                label_keys = self._labels.get(label_name)
+                if label_keys is not None:
+                    label_keys.discard(pair[1])
+                    if not label_keys:
+                        del self._labels[label_name]
+
+            Prom.LABELS_CACHE_SIZE.set(len(self._pairs))
+
+    def invalidate_label(self, label_name):
+        with self._lock:
+            for key in self._labels.pop(label_name, ()):
+                self._pairs.pop((label_name, key), None)
+
+            Prom.LABELS_CACHE_SIZE.set(len(self._pairs))
+
+    def clear(self):
+        with self._lock:
+            self._pairs.clear()
+            self._labels.clear()
+
+            Prom.LABELS_CACHE_SIZE.set(0)
+
+    def label_keys(self):
+        """
+        Return copy of cached value keys as {label_name: [value_keys]}
+        """
+        with self._lock:
+            return {label_name: list(keys) for label_name, keys in self._labels.items()}
+
+    def stats(self):
+        return {
+            'size': len(self._pairs),
+            'max_size': self.max_size,
+            'labels': len(self._labels),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def _evict(self):
+        (label_name, key), _ = self._pairs.popitem(last=False)
+        label_keys = self._labels.get(label_name)
+        if label_keys is not None:
+            label_keys.discard(key)
+            if not label_keys:
+                del self._labels[label_name]
+
+        self.evictions += 1
+        Prom.LABELS_CACHE_EVICTIONS.inc()
+
+
+labels_cache = LabelsCache()
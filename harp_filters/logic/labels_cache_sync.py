@@ -0,0 +1,79 @@
+import threading
+import time
+import traceback
+from microservice_template_core import db
+from microservice_template_core.tools.logger import get_logger
+import harp_filters.settings as settings
+from harp_filters.logic.labels_cache import labels_cache
+from harp_filters.logic.catalog_changes import settled_change_id
+from harp_filters.models.catalog_change import CatalogChange
+from harp_filters.models.catalog_version import LABELS_CATALOG
+
+logger = get_logger()
+
+
+class LabelsCacheSync(object):
+    """
+    Follows labels catalog changes of other processes - API edits, compaction in another consumer worker, import -
+    and drops deleted or replaced values from known-labels cache, so they are written again once seen in events
+    """
+
+    def __init__(self, interval_seconds=settings.LABELS_CACHE_SYNC_SECONDS, page_size=settings.CATALOG_CHANGES_PAGE_SIZE):
+        self.interval_seconds = interval_seconds
+        self.page_size = page_size
+        self.position = 0
+
+    @staticmethod
+    def apply(change):
+        payload = change.dict()
+        if change.operation == 'delete':
+            labels_cache.invalidate_label(payload['label_name'])
+        elif change.operation == 'update':
+            labels_cache.invalidate_label(payload['old_label_name'])
+            labels_cache.invalidate_label(payload['label_name'])
+        elif change.operation == 'remove_values':
+            for label_value in payload['label_values']:
+                labels_cache.discard(payload['label_name'], label_value)
+
+    def sync(self):
+        if self.position < CatalogChange.trimmed_change_id():
+            # Changes since the last sync were trimmed, values removed by them are unknown
+            logger.warning(msg=f"Labels changes after {self.position} were trimmed, known-labels cache is cleared")
+            labels_cache.clear()
+            self.position = CatalogChange.trimmed_change_id()
+
+        until = settled_change_id()
+        while True:
+            changes = CatalogChange.changes_between(LABELS_CATALOG, self.position, until, self.page_size)
+            for change in changes:
+                self.apply(change)
+            if len(changes) < self.page_size:
+                break
+            self.position = changes[-1].change_id
+
+        self.position = max(self.position, until)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                self.sync()
+            except Exception as exc:
+                logger.error(
+                    msg=f"Known-labels cache sync exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                    extra={'tags': {}}
+                )
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+    def start(self):
+        """
+        Remember the current position before the cache is loaded, so changes committed during the load are applied
+        """
+        if not labels_cache.enabled or self.interval_seconds <= 0:
+            return
+
+        self.position = settled_change_id()
+        cache_sync = threading.Thread(name='Known-labels cache sync', target=self.run, daemon=True)
+        cache_sync.start()
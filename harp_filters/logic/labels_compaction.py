@@ -0,0 +1,141 @@
+import datetime
+import threading
+import time
+import traceback
+from microservice_template_core import db
+from microservice_template_core.tools.logger import get_logger
+import ujson as json
+import harp_filters.settings as settings
+from harp_filters.logic.labels_cache import labels_cache
+from harp_filters.logic.typeahead_index import typeahead_index
+from harp_filters.metrics.service_monitoring import Prom
+from harp_filters.models.filter_labels import FilterLabels
+from harp_filters.models.filter_label_values import FilterLabelValues
+from harp_filters.models.catalog_version import CatalogVersion, LABELS_CATALOG
+from harp_filters.models.catalog_change import CatalogChange
+
+logger = get_logger()
+
+
+class LabelsCompaction(object):
+    """
+    Background removal of label values which were not seen for LABELS_VALUE_TTL_SECONDS and of the least recently
+    seen values of labels above their cap. Values are removed in chunks of LABELS_COMPACTION_CHUNK_SIZE with
+    a separate short transaction per chunk, so neither consumer nor API wait for the whole compaction
+    """
+
+    def __init__(self, interval_seconds=settings.LABELS_COMPACTION_INTERVAL_SECONDS,
+                 chunk_size=settings.LABELS_COMPACTION_CHUNK_SIZE, pause_seconds=settings.LABELS_COMPACTION_PAUSE_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.chunk_size = chunk_size
+        self.pause_seconds = pause_seconds
+
+    @staticmethod
+    def value_cap(label_name):
+        return settings.LABELS_VALUE_CAPS.get(label_name, settings.LABELS_MAX_VALUES_PER_LABEL)
+
+    @staticmethod
+    def min_cap():
+        caps = [cap for cap in [settings.LABELS_MAX_VALUES_PER_LABEL, *settings.LABELS_VALUE_CAPS.values()] if cap]
+        return min(caps) if caps else None
+
+    @staticmethod
+    def forget_values(label_name, label_values):
+        for label_value in label_values:
+            labels_cache.discard(label_name, label_value)
+            typeahead_index.remove(label_name, label_value)
+
+        Prom.LABELS_VALUES_REMOVED.inc(len(label_values))
+
+    def remove_rows(self, rows):
+        removed_labels = {}
+        for row in rows:
+            removed_labels.setdefault(row.label_name, []).append(json.loads(row.label_value))
+
+        FilterLabelValues.delete_values([row.value_id for row in rows])
+        CatalogChange.record_label_values('remove_values', removed_labels)
+        db.session.commit()
+        CatalogVersion.bump_later(LABELS_CATALOG)
+
+        for label_name, label_values in removed_labels.items():
+            self.forget_values(label_name, label_values)
+
+        time.sleep(self.pause_seconds)
+
+    def expire_values(self):
+        last_seen_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=settings.LABELS_VALUE_TTL_SECONDS)
+        removed = 0
+        while True:
+            rows = FilterLabelValues.stale_values(last_seen_before, limit=self.chunk_size)
+            if rows:
+                self.remove_rows(rows)
+                removed += len(rows)
+            if len(rows) < self.chunk_size:
+                break
+
+        logger.info(msg=f"Labels compaction removed {removed} values not seen since {last_seen_before}")
+
+    def cap_values(self):
+        for label_name, count in FilterLabelValues.label_counts(min_count=self.min_cap()):
+            cap = self.value_cap(label_name)
+            if not cap or count <= cap:
+                continue
+
+            excess = count - cap
+            while excess > 0:
+                rows = FilterLabelValues.least_recent_values(label_name, limit=min(excess, self.chunk_size))
+                if not rows:
+                    break
+                self.remove_rows(rows)
+                excess -= len(rows)
+
+            logger.info(msg=f"Labels compaction capped label {label_name} to {cap} values. Values before: {count}")
+
+    def cap_blob_values(self):
+        for _, label_name in FilterLabels.iter_label_names():
+            cap = self.value_cap(label_name)
+            if not cap:
+                continue
+
+            removed_values = FilterLabels.trim_blob_values(label_name, cap)
+            if removed_values:
+                db.session.commit()
+                CatalogVersion.bump_later(LABELS_CATALOG)
+                self.forget_values(label_name, removed_values)
+                logger.info(msg=f"Labels compaction capped label {label_name} to {cap} values. Removed: {len(removed_values)}")
+                time.sleep(self.pause_seconds)
+
+    def compact(self):
+        if settings.LABELS_STORAGE_MODE == 'normalized':
+            if settings.LABELS_VALUE_TTL_SECONDS:
+                self.expire_values()
+            if self.min_cap():
+                self.cap_values()
+        elif self.min_cap():
+            self.cap_blob_values()
+
+        if settings.CATALOG_CHANGES_RETENTION_SECONDS:
+            CatalogChange.trim(
+                CatalogChange.db_now() - datetime.timedelta(seconds=settings.CATALOG_CHANGES_RETENTION_SECONDS)
+            )
+
+    def run(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                self.compact()
+            except Exception as exc:
+                logger.critical(
+                    msg=f"Labels compaction exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                    extra={'tags': {}}
+                )
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+    def start(self):
+        if self.interval_seconds <= 0:
+            return
+
+        compaction = threading.Thread(name='Labels compaction', target=self.run, daemon=True)
+        compaction.start()
@@ -1,9 +1,24 @@
 from microservice_template_core.settings import ServiceConfig
 from microservice_template_core.tools.kafka_confluent_consumer import KafkaConsumeMessages
+from confluent_kafka import TIMESTAMP_NOT_AVAILABLE
 import harp_filters.settings as settings
 from microservice_template_core.tools.logger import get_logger
-import ujson as json
+import socket
+import time
+import msgspec
+from harp_filters.metrics.service_monitoring import Prom
 from harp_filters.models.filter_labels import FilterLabels
+from harp_filters.logic.log_sampler import event_log_sampler
+from harp_filters.logic.notification_decoder import notification_decoder, dead_letter
+from harp_filters.logic.labels_cache import value_key
+from harp_filters.logic.consumer_pipeline import ConsumerPipeline
+from harp_filters.logic.write_behind import WriteBehind
+from harp_filters.logic.labels_compaction import LabelsCompaction
+from harp_filters.logic.labels_snapshot import LabelsSnapshot
+from harp_filters.logic.labels_cache_sync import LabelsCacheSync
+from harp_filters.logic.label_frequency import label_frequency, LabelFrequencyFlush
+from harp_filters.logic.label_cardinality import label_cardinality, LabelCardinalityFlush
+from harp_filters.logic.recent_events import recent_events, RecentEventsFlush
 
 logger = get_logger()
 
@@ -12,39 +27,192 @@ class ConsumeMessages(object):
     def __init__(self):
         pass
 
-    def start_consumer(self, consumer_num=ServiceConfig.SERVICE_NAME):
+    def owns_label(self, label_name):
+        return True
+
+    def runs_compaction(self):
+        return True
+
+    def snapshot_path(self):
+        return settings.LABELS_SNAPSHOT_PATH
+
+    def stats_source(self):
+        return socket.gethostname()
+
+    def init_consumer(self):
+        LabelsCacheSync().start()
+        labels_snapshot = LabelsSnapshot(path=self.snapshot_path())
+        if not labels_snapshot.load(owns_label=self.owns_label):
+            FilterLabels.warm_up_cache(owns_label=self.owns_label)
+        labels_snapshot.start()
+        LabelFrequencyFlush(source=self.stats_source()).start()
+        LabelCardinalityFlush(source=self.stats_source()).start()
+        RecentEventsFlush(source=self.stats_source()).start()
+        if self.runs_compaction():
+            LabelsCompaction().start()
+
+        if settings.CONSUMER_MODE == 'write_behind':
+            return WriteBehind.create_consumer()
+
+        return KafkaConsumeMessages(kafka_topic=settings.NOTIFICATIONS_DECORATED_TOPIC).start_consumer()
+
+    @staticmethod
+    def parse_message(msg, consumer_num):
         """
-        Start metrics consumer
+        Decode Kafka message and return labels of the event or None if message should be skipped
         """
-        consumer = KafkaConsumeMessages(kafka_topic=settings.NOTIFICATIONS_DECORATED_TOPIC).start_consumer()
+        if msg is None:
+            return None
+        if msg.error():
+            logger.error(msg=f"Consumer error: {msg.error()}")
+            return None
 
-        while True:
-            msg = consumer.poll(5.0)
+        if not msg.value():
+            dead_letter.route(msg, reason='empty', error='Empty message')
+            return None
 
-            if msg is None:
-                continue
-            if msg.error():
-                logger.error(msg=f"Consumer error: {msg.error()}")
-                continue
+        try:
+            notification = notification_decoder.decode(msg.value())
+        except msgspec.ValidationError as err:
+            dead_letter.route(msg, reason='invalid_schema', error=err)
+            return None
+        except msgspec.DecodeError as err:
+            dead_letter.route(msg, reason='invalid_json', error=err)
+            return None
 
-            parsed_json = json.loads(msg.value().decode('utf-8'))
+        if event_log_sampler.allow():
+            with Prom.CONSUMER_STAGE_LATENCY.labels(stage='log').time():
+                logger.info(
+                    msg=f"Get event from Kafka:\nJSON: {msg.value().decode('utf-8', 'replace')}.\nConsumer: {consumer_num}\n"
+                        f"Suppressed events since previous record: {event_log_sampler.pop_suppressed()}",
+                    extra={'tags': {
+                        'event_id': notification.event_id
+                    }}
+                )
 
-            logger.info(
-                msg=f"Get event from Kafka:\nJSON: {parsed_json}.\nConsumer: {consumer_num}",
-                extra={'tags': {
-                    'event_id': parsed_json['event_id']
-                }}
-            )
+        return notification.labels()
+
+    @staticmethod
+    def track_lag(msg):
+        if msg is None or msg.error():
+            return
 
-            main_fields = {
-                'alert_name': parsed_json['alert_name'],
-                'source': parsed_json['source'],
-                'monitoring_system': parsed_json['monitoring_system'],
-            }
+        timestamp_type, timestamp = msg.timestamp()
+        if timestamp_type != TIMESTAMP_NOT_AVAILABLE:
+            Prom.CONSUMER_LAG.set(max(time.time() - timestamp / 1000, 0))
 
-            data = {**main_fields, **parsed_json['additional_fields']}
+    def aggregate_event(self, data):
+        FilterLabels.aggr_label(data=data)
+
+    def aggregate_labels(self, labels):
+        FilterLabels.aggr_labels_bulk(labels)
+
+    def write_labels(self, labels):
+        """
+        Write labels synchronously in this process and return False if the commit failed
+        """
+        return FilterLabels.aggr_labels_bulk(labels)
+
+    @staticmethod
+    def select_labels(labels):
+        """
+        Return unique labels of events ({label_name: [label_values]}) without values skipped by cardinality policy
+        """
+        return label_cardinality.select(labels)
+
+    def process_message(self, msg, consumer_num):
+        with Prom.CONSUMER_STAGE_LATENCY.labels(stage='decode').time():
+            data = self.parse_message(msg, consumer_num)
+        if data is not None:
+            Prom.CONSUMER_EVENTS.inc()
+            self.track_lag(msg)
+            label_frequency.record_events([data])
+            recent_events.record_events([data])
+            data = label_cardinality.select_event(data)
+            if data:
+                self.aggregate_event(data)
+
+    def decode_batch(self, messages, consumer_num):
+        """
+        Decode messages of the batch. Metrics are updated once per batch to keep them off the per-message path
+        """
+        Prom.CONSUMER_BATCH_SIZE.set(len(messages))
+        events = []
+        with Prom.CONSUMER_STAGE_LATENCY.labels(stage='decode').time():
+            for msg in messages:
+                data = self.parse_message(msg, consumer_num)
+                if data is not None:
+                    events.append(data)
 
-            FilterLabels.aggr_label(data=data)
+        Prom.CONSUMER_EVENTS.inc(len(events))
+        if messages:
+            self.track_lag(messages[-1])
+        label_frequency.record_events(events)
+        recent_events.record_events(events)
+
+        return events
+
+    @staticmethod
+    def merge_events(events, batch_labels=None):
+        """
+        Merge labels of events into {label_name: {value_key: label_value}}
+        """
+        batch_labels = {} if batch_labels is None else batch_labels
+        for data in events:
+            for label_name, label_value in data.items():
+                batch_labels.setdefault(label_name, {})[value_key(label_value)] = label_value
+
+        return batch_labels
+
+    @staticmethod
+    def unique_labels(batch_labels):
+        return {label_name: list(label_values.values()) for label_name, label_values in batch_labels.items()}
+
+    def process_batch(self, messages, consumer_num):
+        """
+        Merge labels of all messages in the batch and write new values with one DB commit
+        """
+        batch_labels = self.merge_events(self.decode_batch(messages, consumer_num))
+
+        labels = self.select_labels(self.unique_labels(batch_labels))
+        if labels:
+            self.aggregate_labels(labels)
+
+    def start_consumer(self, consumer_num=ServiceConfig.SERVICE_NAME):
+        """
+        Start metrics consumer
+        """
+        consumer = self.init_consumer()
+
+        if settings.CONSUMER_MODE == 'pipeline':
+            logger.info(
+                msg=f"Start consumer in pipeline mode. Batch size: {settings.CONSUMER_BATCH_SIZE}, "
+                    f"linger: {settings.CONSUMER_BATCH_LINGER_MS} ms, "
+                    f"queue size: {settings.CONSUMER_PIPELINE_QUEUE_SIZE}. Consumer: {consumer_num}"
+            )
+            ConsumerPipeline(worker=self, consumer=consumer, consumer_num=consumer_num).run()
+        elif settings.CONSUMER_MODE == 'write_behind':
+            logger.info(
+                msg=f"Start consumer in write-behind mode. Max dirty values: {settings.WRITE_BEHIND_MAX_DIRTY}, "
+                    f"flush interval: {settings.WRITE_BEHIND_FLUSH_MS} ms. Consumer: {consumer_num}"
+            )
+            WriteBehind(worker=self, consumer=consumer, consumer_num=consumer_num).run()
+        elif settings.CONSUMER_MODE == 'batch':
+            logger.info(
+                msg=f"Start consumer in batch mode. Batch size: {settings.CONSUMER_BATCH_SIZE}, "
+                    f"linger: {settings.CONSUMER_BATCH_LINGER_MS} ms. Consumer: {consumer_num}"
+            )
+            while True:
+                messages = consumer.consume(
+                    num_messages=settings.CONSUMER_BATCH_SIZE,
+                    timeout=settings.CONSUMER_BATCH_LINGER_MS / 1000
+                )
+                if messages:
+                    self.process_batch(messages, consumer_num)
+        else:
+            while True:
+                msg = consumer.poll(5.0)
+                self.process_message(msg, consumer_num)
 
     def main(self):
         self.start_consumer()
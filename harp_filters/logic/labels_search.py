@@ -0,0 +1,112 @@
+import base64
+import binascii
+import ujson as json
+from harp_filters.models.filter_labels import FilterLabels, normalized_storage
+
+MATCH_MODES = ('prefix', 'substring')
+
+
+def encode_cursor(label_name, position):
+    return base64.urlsafe_b64encode(json.dumps([label_name, position]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        label_name, position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError(f"Cursor is not valid - {cursor}")
+
+    valid_position = position is None or isinstance(position, int) or (isinstance(position, list) and len(position) == 1)
+    if not isinstance(label_name, str) or not valid_position:
+        raise ValueError(f"Cursor is not valid - {cursor}")
+
+    return label_name, position
+
+
+def value_matches(label_value, value_search, match):
+    label_value = str(label_value).lower()
+    if match == 'substring':
+        return value_search in label_value
+
+    return label_value.startswith(value_search)
+
+
+class LabelsSearch(object):
+    """
+    One page of labels catalog, ordered by label name and value position.
+    Iteration yields labels with their matching values and loads rows in chunks, so memory does not depend
+    on catalog size. Once `limit` values are returned next_cursor points to the rest of the catalog.
+    In normalized storage value search is a single keyset query over all labels with the value pre-filtered in DB,
+    so a page of a rare value doesn't read the whole catalog
+    """
+
+    def __init__(self, label_search=None, value_search=None, match='prefix', cursor=None, limit=1000):
+        if match not in MATCH_MODES:
+            raise ValueError(f"Match should be one of {MATCH_MODES}")
+        if limit <= 0:
+            raise ValueError("Limit should be positive")
+
+        self.label_search = label_search
+        self.value_search = value_search.lower() if value_search else None
+        self.match = match
+        self.cursor = decode_cursor(cursor) if cursor else None
+        self.limit = limit
+        self.next_cursor = None
+
+    def __iter__(self):
+        if self.value_search and normalized_storage():
+            return self.iter_matching_values()
+
+        return self.iter_labels()
+
+    def iter_labels(self):
+        from_label, position = self.cursor if self.cursor else (None, None)
+        left = self.limit
+
+        for label_id, label_name in FilterLabels.iter_label_names(
+                label_search=self.label_search, match=self.match, from_label=from_label
+        ):
+            label_values = []
+            label_position = position if label_name == from_label else None
+
+            for value_position, label_value in FilterLabels.iter_values_after(label_name, position=label_position):
+                if left == 0:
+                    self.next_cursor = encode_cursor(label_name, label_position)
+                    break
+                label_position = value_position
+                if self.value_search and not value_matches(label_value, self.value_search, self.match):
+                    continue
+                label_values.append(label_value)
+                left -= 1
+
+            if label_values or (not self.value_search and label_position is None and not self.next_cursor):
+                yield {'label_id': label_id, 'label_name': label_name, 'label_values': label_values}
+
+            if self.next_cursor:
+                return
+
+    def iter_matching_values(self):
+        from_label, position = self.cursor if self.cursor else (None, None)
+        left = self.limit
+        item = None
+        last_position = None
+
+        for label_id, label_name, value_id, label_value in FilterLabels.iter_matching_values(
+                self.value_search, match=self.match, label_search=self.label_search,
+                from_label=from_label, position=position
+        ):
+            if left == 0:
+                self.next_cursor = encode_cursor(*last_position)
+                break
+            if not value_matches(label_value, self.value_search, self.match):
+                continue
+            if item is None or item['label_name'] != label_name:
+                if item:
+                    yield item
+                item = {'label_id': label_id, 'label_name': label_name, 'label_values': []}
+            item['label_values'].append(label_value)
+            last_position = (label_name, value_id)
+            left -= 1
+
+        if item:
+            yield item
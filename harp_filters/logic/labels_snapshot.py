@@ -0,0 +1,171 @@
+import datetime
+import mmap
+import os
+import threading
+import time
+import traceback
+from microservice_template_core import db
+from microservice_template_core.tools.logger import get_logger
+import ujson as json
+import harp_filters.settings as settings
+from harp_filters.logic.labels_cache import labels_cache, value_key
+from harp_filters.logic.labels_cache_sync import LabelsCacheSync
+from harp_filters.logic.catalog_changes import settled_change_id
+from harp_filters.models.filter_labels import FilterLabels, normalized_storage
+from harp_filters.models.filter_label_values import FilterLabelValues
+from harp_filters.models.catalog_version import CatalogVersion, LABELS_CATALOG
+from harp_filters.models.catalog_change import CatalogChange
+
+logger = get_logger()
+
+SNAPSHOT_FORMAT = 2
+# Rows are stamped before commit, so rows committed right after the snapshot may have an older timestamp
+SNAPSHOT_TS_MARGIN = datetime.timedelta(minutes=1)
+KEYS_PER_LINE = 1000
+
+
+class LabelsSnapshot(object):
+    """
+    Periodic dump of known-labels cache to a local file, so restarted consumer doesn't rebuild it from DB.
+    First line is a header with labels catalog version, settled change_id, max value_id and time of the snapshot,
+    every next line is [label_name, [value_keys]]. On load the file is memory-mapped and only the delta is read
+    from DB: labels changes since the snapshot are replayed, labels deleted since the snapshot are dropped,
+    labels updated since the snapshot are reloaded and in normalized storage values with a newer value_id are added.
+    Snapshot older than trimmed labels changes is discarded
+    """
+
+    def __init__(self, path=settings.LABELS_SNAPSHOT_PATH, interval_seconds=settings.LABELS_SNAPSHOT_INTERVAL_SECONDS):
+        self.path = path
+        self.interval_seconds = interval_seconds
+
+    @property
+    def enabled(self):
+        return bool(self.path) and labels_cache.enabled
+
+    def write(self):
+        header = {
+            'format': SNAPSHOT_FORMAT,
+            'storage': settings.LABELS_STORAGE_MODE,
+            'version': CatalogVersion.get_version(LABELS_CATALOG),
+            'change_id': settled_change_id(),
+            'max_value_id': FilterLabelValues.max_value_id() if normalized_storage() else 0,
+            'snapshot_ts': datetime.datetime.utcnow().isoformat()
+        }
+        # Header is taken before the cache, so everything cached later is either in the snapshot or in the delta
+        label_keys = labels_cache.label_keys()
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as snapshot_file:
+            snapshot_file.write(json.dumps(header) + '\n')
+            for label_name, keys in label_keys.items():
+                for start in range(0, len(keys), KEYS_PER_LINE):
+                    snapshot_file.write(json.dumps([label_name, keys[start:start + KEYS_PER_LINE]]) + '\n')
+        os.replace(tmp_path, self.path)
+
+        logger.info(msg=f"Labels snapshot has been written to {self.path}. Labels: {len(label_keys)}")
+
+    @staticmethod
+    def read_lines(path):
+        with open(path, 'rb') as snapshot_file:
+            with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as snapshot_map:
+                for line in iter(snapshot_map.readline, b''):
+                    yield json.loads(line)
+
+    def load(self, owns_label=None):
+        """
+        Fill known-labels cache from the snapshot and reconcile it with DB. Return False if the snapshot can't be used
+        """
+        if not self.enabled or not os.path.exists(self.path):
+            return False
+
+        started = time.monotonic()
+        try:
+            lines = self.read_lines(self.path)
+            header = next(lines)
+            if header.get('format') != SNAPSHOT_FORMAT or header.get('storage') != settings.LABELS_STORAGE_MODE:
+                logger.warning(msg=f"Labels snapshot {self.path} doesn't match current storage and is ignored")
+                return False
+            if header['change_id'] < CatalogChange.trimmed_change_id():
+                logger.warning(
+                    msg=f"Labels changes after snapshot {self.path} were trimmed, snapshot is ignored"
+                )
+                return False
+
+            label_names = set()
+            for label_name, keys in lines:
+                if owns_label and not owns_label(label_name):
+                    continue
+                label_names.add(label_name)
+                labels_cache.add_keys(label_name, [tuple(key) if isinstance(key, list) else key for key in keys])
+
+            self.reconcile(header, label_names, owns_label=owns_label)
+        except Exception as exc:
+            logger.error(
+                msg=f"Labels snapshot {self.path} can't be loaded \nException: {str(exc)} \nTraceback: {traceback.format_exc()}"
+            )
+            labels_cache.clear()
+            return False
+
+        logger.info(
+            msg=f"Known-labels cache has been loaded from snapshot in {time.monotonic() - started:.2f} s. "
+                f"Stats - {labels_cache.stats()}"
+        )
+        return True
+
+    @staticmethod
+    def replay_changes(since, page_size=settings.CATALOG_CHANGES_PAGE_SIZE):
+        """
+        Apply labels changes after since - values removed by compaction or API edits - to the loaded cache
+        """
+        until = CatalogChange.last_change_id()
+        while True:
+            changes = CatalogChange.changes_between(LABELS_CATALOG, since, until, page_size)
+            for change in changes:
+                LabelsCacheSync.apply(change)
+            if len(changes) < page_size:
+                break
+            since = changes[-1].change_id
+
+    def reconcile(self, header, label_names, owns_label=None):
+        self.replay_changes(header['change_id'])
+        if CatalogVersion.get_version(LABELS_CATALOG) == header['version']:
+            return
+
+        for label_name in label_names - FilterLabels.label_names():
+            labels_cache.invalidate_label(label_name)
+
+        since = datetime.datetime.fromisoformat(header['snapshot_ts']) - SNAPSHOT_TS_MARGIN
+        for label_name in FilterLabels.changed_label_names(since):
+            if owns_label and not owns_label(label_name):
+                continue
+            labels_cache.invalidate_label(label_name)
+            labels_cache.add_keys(
+                label_name, [value_key(label_value) for _, label_value in FilterLabels.iter_values_after(label_name)]
+            )
+
+        if normalized_storage():
+            for label_name, label_value in FilterLabelValues.iter_values_after_id(header['max_value_id']):
+                if labels_cache.is_full():
+                    return
+                if owns_label and not owns_label(label_name):
+                    continue
+                labels_cache.add(label_name, label_value)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                self.write()
+            except Exception as exc:
+                logger.error(
+                    msg=f"Labels snapshot exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}"
+                )
+            finally:
+                db.session.remove()
+
+    def start(self):
+        if not self.enabled or self.interval_seconds <= 0:
+            return
+
+        snapshot = threading.Thread(name='Labels snapshot', target=self.run, daemon=True)
+        snapshot.start()
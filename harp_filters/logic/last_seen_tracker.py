@@ -0,0 +1,49 @@
+import threading
+import time
+import harp_filters.settings as settings
+from harp_filters.logic.labels_cache import value_key
+
+
+class LastSeenTracker(object):
+    """
+    Collects label values seen by consumer since the last flush. Every value is flushed once per interval
+    no matter how many events carried it, so cached values keep their last-seen timestamp up to date
+    without a DB round-trip per event
+    """
+
+    def __init__(self, flush_seconds=settings.LABELS_LAST_SEEN_FLUSH_SECONDS, max_pending=settings.LABELS_LAST_SEEN_MAX_PENDING):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.flushed_ts = time.monotonic()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.flush_seconds > 0
+
+    def record_values(self, labels):
+        with self._lock:
+            for label_name, label_values in labels.items():
+                for label_value in label_values:
+                    self._pending[(label_name, value_key(label_value))] = label_value
+
+    def due(self):
+        return len(self._pending) >= self.max_pending or time.monotonic() - self.flushed_ts >= self.flush_seconds
+
+    def pop_pending(self):
+        """
+        Return pending values as {label_name: [label_values]} and start new interval
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self.flushed_ts = time.monotonic()
+
+        labels = {}
+        for (label_name, _), label_value in pending.items():
+            labels.setdefault(label_name, []).append(label_value)
+
+        return labels
+
+
+last_seen_tracker = LastSeenTracker()
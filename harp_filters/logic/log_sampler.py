@@ -0,0 +1,54 @@
+import threading
+import time
+import harp_filters.settings as settings
+from harp_filters.metrics.service_monitoring import Prom
+
+
+class LogSampler(object):
+    """
+    Rate limit of hot-path log records. At most per_second records are allowed in every second,
+    the rest are only counted, so per-event logs neither format payloads nor block on the log handler.
+    0 disables records completely
+    """
+
+    def __init__(self, per_second=settings.CONSUMER_EVENT_LOG_PER_SECOND):
+        self.per_second = per_second
+        self.window = None
+        self.allowed = 0
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if self.per_second <= 0:
+            return False
+
+        window = int(time.monotonic())
+        if window == self.window and self.allowed >= self.per_second:
+            # Hot path without lock, the suppressed count is approximate under concurrency
+            self.suppressed += 1
+            return False
+
+        with self._lock:
+            if window != self.window:
+                self.window = window
+                self.allowed = 0
+
+            if self.allowed < self.per_second:
+                self.allowed += 1
+                return True
+
+            self.suppressed += 1
+            return False
+
+    def pop_suppressed(self):
+        """
+        Return number of records suppressed since the previous call
+        """
+        with self._lock:
+            suppressed, self.suppressed = self.suppressed, 0
+
+        Prom.CONSUMER_LOG_SUPPRESSED.inc(suppressed)
+        return suppressed
+
+
+event_log_sampler = LogSampler()
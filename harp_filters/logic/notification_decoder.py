@@ -0,0 +1,103 @@
+from typing import Any, Dict, Optional
+import msgspec
+from confluent_kafka import Producer
+from microservice_template_core.settings import KafkaConfig
+from microservice_template_core.tools.logger import get_logger
+import harp_filters.settings as settings
+from harp_filters.metrics.service_monitoring import Prom
+from harp_filters.logic.log_sampler import LogSampler
+
+logger = get_logger()
+
+
+class DecoratedNotification(msgspec.Struct):
+    """
+    Fields of decorated notification needed for labels aggregation. All other fields of the payload,
+    including the notification body, are skipped by the decoder without building Python objects.
+    Main fields must be present but, as before the typed decoder, may hold any JSON value
+    """
+    alert_name: Any
+    source: Any
+    monitoring_system: Any
+    additional_fields: Optional[Dict[str, Any]] = None
+    event_id: Any = None
+
+    def labels(self):
+        main_fields = {
+            'alert_name': self.alert_name,
+            'source': self.source,
+            'monitoring_system': self.monitoring_system,
+        }
+
+        return {**main_fields, **(self.additional_fields or {})}
+
+
+notification_decoder = msgspec.json.Decoder(DecoratedNotification)
+
+
+class DeadLetter(object):
+    """
+    Invalid messages are counted by reason and, if CONSUMER_DEAD_LETTER_TOPIC is set, produced there unchanged
+    with the error and the original position in headers
+    """
+
+    def __init__(self, topic=settings.CONSUMER_DEAD_LETTER_TOPIC):
+        self.topic = topic
+        self.log_sampler = LogSampler(per_second=1)
+        self._producer = None
+
+    @property
+    def producer(self):
+        if self._producer is None:
+            self._producer = Producer({'bootstrap.servers': KafkaConfig.KAFKA_SERVERS})
+
+        return self._producer
+
+    def route(self, msg, reason, error):
+        Prom.CONSUMER_INVALID_MESSAGES.labels(reason=reason).inc()
+
+        if self.log_sampler.allow():
+            logger.warning(
+                msg=f"Invalid message is skipped. Reason: {reason}. Error: {error}\n"
+                    f"Suppressed invalid messages since previous record: {self.log_sampler.pop_suppressed()}"
+            )
+
+        if not self.topic:
+            return
+
+        try:
+            self.producer.produce(
+                self.topic,
+                value=msg.value(),
+                key=msg.key(),
+                headers=[
+                    ('error', str(error)),
+                    ('source_topic', msg.topic()),
+                    ('source_partition', str(msg.partition())),
+                    ('source_offset', str(msg.offset()))
+                ]
+            )
+        except BufferError:
+            # Local producer queue is full, the message is lost for the dead-letter topic but the consumer goes on
+            Prom.CONSUMER_DEAD_LETTER_DROPPED.inc()
+        self.producer.poll(0)
+
+    def flush(self, timeout=settings.CONSUMER_DEAD_LETTER_FLUSH_SECONDS):
+        """
+        Wait up to timeout seconds until routed messages are delivered, before offsets of their source messages
+        are committed. Return number of messages still undelivered
+        """
+        if self._producer is None:
+            return 0
+
+        undelivered = self._producer.flush(timeout)
+        if undelivered:
+            logger.error(
+                msg=f"Dead-letter messages are not delivered to {self.topic} in {timeout} s. Undelivered: {undelivered}",
+                extra={'tags': {}}
+            )
+
+        return undelivered
+
+
+dead_letter = DeadLetter()
@@ -0,0 +1,218 @@
+import collections
+import os
+import threading
+import time
+import traceback
+import uuid
+import zlib
+import msgspec
+from microservice_template_core import db
+from microservice_template_core.tools.logger import get_logger
+import harp_filters.settings as settings
+from harp_filters.metrics.service_monitoring import Prom
+from harp_filters.metrics.instrumentation import tag_api_queries
+from harp_filters.logic.filter_engine import compile_filter
+from harp_filters.logic.source_snapshots import SourceSnapshotFlush, updated_since
+from harp_filters.models.filter_recent_events import FilterRecentEvents
+
+logger = get_logger()
+
+
+class RecentEvents(object):
+    """
+    Ring buffer of labels of the most recent consumed events, bounded by number of events and by bytes.
+    Events are kept JSON-encoded, so size of the buffer is exact and a snapshot is a join of stored bytes
+    """
+
+    def __init__(self, max_events=settings.RECENT_EVENTS_MAX_EVENTS, max_bytes=settings.RECENT_EVENTS_MAX_BYTES,
+                 sample_every=settings.RECENT_EVENTS_SAMPLE_EVERY):
+        self.max_bytes = max_bytes
+        self.sample_every = max(sample_every, 1)
+        # Index of the next sampled event in the next list of events
+        self.sample_offset = 0
+        self.events = collections.deque(maxlen=max(max_events, 0))
+        self.size = 0
+        # Number of events ever added, changes whenever the buffer changes
+        self.sequence = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.events.maxlen > 0 and self.max_bytes > 0
+
+    def record_events(self, events, encode=msgspec.json.encode):
+        if not self.enabled or not events:
+            return
+
+        with self._lock:
+            if self.sample_offset >= len(events):
+                self.sample_offset -= len(events)
+                return
+
+            sampled = events[self.sample_offset::self.sample_every]
+            self.sample_offset = (self.sample_offset - len(events)) % self.sample_every
+            buffer = self.events
+            for data in sampled:
+                encoded = encode(data)
+                if len(encoded) > self.max_bytes:
+                    continue
+                if len(buffer) == buffer.maxlen:
+                    self.size -= len(buffer[0])
+                buffer.append(encoded)
+                self.size += len(encoded)
+                self.sequence += 1
+                while self.size > self.max_bytes:
+                    self.size -= len(buffer.popleft())
+
+    def snapshot(self, since_sequence=None):
+        """
+        Return (sequence, number of events, JSON list of events oldest first) or None if the buffer
+        has not changed since since_sequence
+        """
+        with self._lock:
+            if self.sequence == since_sequence:
+                return None
+            sequence, events = self.sequence, list(self.events)
+
+        return sequence, len(events), b'[' + b','.join(events) + b']'
+
+
+recent_events = RecentEvents()
+
+
+class RecentEventsFlush(SourceSnapshotFlush):
+    """
+    Periodic write of the process buffer to filter_recent_events under the process source name,
+    so API processes can preview filters against events of all consumers. Unchanged buffer is not written again,
+    only update_ts of its row is refreshed
+    """
+    name = 'Recent events'
+    model = FilterRecentEvents
+
+    def __init__(self, source, interval_seconds=settings.RECENT_EVENTS_FLUSH_SECONDS):
+        super().__init__(source, interval_seconds)
+        # Version of a snapshot is unique across restarts of the process
+        self.version_prefix = uuid.uuid4().hex[:12]
+        self.flushed_sequence = None
+        # Sequence of the snapshot written by the current flush, remembered once it's committed
+        self.written_sequence = None
+
+    @property
+    def enabled(self):
+        return recent_events.enabled and super().enabled
+
+    def write(self):
+        snapshot = recent_events.snapshot(since_sequence=self.flushed_sequence)
+        if snapshot is None and FilterRecentEvents.touch_source(self.source):
+            self.written_sequence = self.flushed_sequence
+            return
+
+        sequence, events_count, events = snapshot or recent_events.snapshot()
+        Prom.RECENT_EVENTS_BYTES.set(len(events))
+        FilterRecentEvents.replace_source(
+            self.source, f"{self.version_prefix}:{sequence}", events_count, zlib.compress(events, 1)
+        )
+        self.written_sequence = sequence
+
+    def flush(self):
+        super().flush()
+        self.flushed_sequence = self.written_sequence
+
+
+class RecentEventsView(object):
+    """
+    Decoded snapshots of all consumers in API process. A background thread, started by the first preview
+    in the process, checks snapshots every refresh interval, reads and decodes only snapshots with a new version
+    and swaps in the events. Preview never reads or decodes snapshots
+    """
+
+    def __init__(self, refresh_seconds=settings.RECENT_EVENTS_FLUSH_SECONDS, max_ms=settings.FILTER_PREVIEW_MAX_MS):
+        self.refresh_seconds = refresh_seconds
+        self.max_ms = max_ms
+        # source -> (version, [events]), used by the refresh thread only
+        self.snapshots = {}
+        # (number of sources, events of all sources), replaced on refresh and never modified, so it's read without lock
+        self.view = (0, [])
+        self.loaded = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        versions = FilterRecentEvents.source_versions(
+            updated_since(settings.RECENT_EVENTS_FLUSH_SECONDS)
+        )
+        changed = [
+            source for source, version in versions.items() if self.snapshots.get(source, (None,))[0] != version
+        ]
+        snapshots = {source: snapshot for source, snapshot in self.snapshots.items() if source in versions}
+        for source, (version, events) in FilterRecentEvents.source_events(changed).items():
+            snapshots[source] = (version, msgspec.json.decode(zlib.decompress(events)))
+
+        if changed or len(snapshots) != len(self.snapshots):
+            self.snapshots = snapshots
+            self.view = (len(snapshots), [data for _, events in snapshots.values() for data in events])
+        self.loaded.set()
+
+    def run(self):
+        tag_api_queries()
+        while True:
+            try:
+                self.refresh()
+            except Exception as exc:
+                logger.error(
+                    msg=f"Recent events refresh exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                    extra={'tags': {}}
+                )
+                db.session.rollback()
+            finally:
+                db.session.remove()
+            time.sleep(self.refresh_seconds)
+
+    def start(self):
+        with self._lock:
+            # Thread is started lazily in every process, API workers are forked without it
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self.loaded.clear()
+                threading.Thread(name='Recent events refresh', target=self.run, daemon=True).start()
+
+    def preview(self, filter_config, samples=settings.FILTER_PREVIEW_SAMPLES):
+        """
+        Evaluate draft filter_config against recent events of all consumers and return number of matched events
+        and up to samples of them, the newest events of a consumer first. Scan stops after max_ms
+        with truncated set, as user regexes may be slow
+        """
+        if not isinstance(filter_config, list):
+            raise ValueError('filter_config should be a list of clauses')
+        predicate = compile_filter(filter_config)
+
+        deadline = time.monotonic() + self.max_ms / 1000
+        self.start()
+        # The first preview in the process waits for the first refresh within the time bound
+        self.loaded.wait(self.max_ms / 1000)
+        sources, events = self.view
+        matched = 0
+        scanned = 0
+        truncated = False
+        matched_events = []
+        for data in reversed(events):
+            if time.monotonic() > deadline:
+                truncated = True
+                break
+            scanned += 1
+            if predicate(data):
+                matched += 1
+                if len(matched_events) < samples:
+                    matched_events.append(data)
+
+        return {
+            'matched': matched,
+            'scanned': scanned,
+            'total': len(events),
+            'truncated': truncated,
+            'sources': sources,
+            'samples': matched_events
+        }
+
+
+recent_events_view = RecentEventsView()
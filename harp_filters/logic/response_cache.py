@@ -0,0 +1,71 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import request, Response
+import ujson as json
+import harp_filters.settings as settings
+from harp_filters.metrics.service_monitoring import Prom
+from harp_filters.models.catalog_version import CatalogVersion
+
+
+class ResponseCache(object):
+    """
+    LRU cache of serialized catalog responses keyed by ETag. ETag is built from the catalog version stored in DB,
+    so a write on any replica changes the ETag on all of them and stale entries are never served
+    """
+
+    def __init__(self, max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_etag(catalog, version, scope=None):
+        etag = f"{catalog}-{version}"
+        if scope is not None:
+            etag += '-' + hashlib.sha1(str(scope).encode('utf-8')).hexdigest()[:16]
+
+        return etag
+
+    def get(self, etag):
+        with self._lock:
+            body = self._responses.get(etag)
+            if body is not None:
+                self._responses.move_to_end(etag)
+
+            return body
+
+    def put(self, etag, body):
+        with self._lock:
+            self._responses[etag] = body
+            self._responses.move_to_end(etag)
+            while len(self._responses) > self.max_entries:
+                self._responses.popitem(last=False)
+
+    def respond(self, catalog, build, scope=None):
+        """
+        Return 304 if client has the current version, otherwise cached or freshly built JSON response.
+        Version is read before the data, so a body is never cached under a newer version than its data
+        """
+        etag = self.make_etag(catalog, CatalogVersion.get_version(catalog), scope=scope)
+
+        if request.if_none_match.contains(etag):
+            Prom.RESPONSE_CACHE_REQUESTS.labels(catalog=catalog, result='not_modified').inc()
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        body = self.get(etag)
+        if body is None:
+            Prom.RESPONSE_CACHE_REQUESTS.labels(catalog=catalog, result='miss').inc()
+            body = json.dumps(build())
+            self.put(etag, body)
+        else:
+            Prom.RESPONSE_CACHE_REQUESTS.labels(catalog=catalog, result='hit').inc()
+
+        response = Response(body, status=200, mimetype='application/json')
+        response.set_etag(etag)
+        return response
+
+
+response_cache = ResponseCache()
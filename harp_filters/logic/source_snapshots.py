@@ -0,0 +1,74 @@
+import abc
+import datetime
+import threading
+import time
+import traceback
+from microservice_template_core import db
+from microservice_template_core.tools.logger import get_logger
+
+logger = get_logger()
+
+# Rows of a source are ignored and removed when it missed this many flushes
+STALE_FLUSHES = 3
+
+
+def updated_since(flush_seconds):
+    """
+    Return the oldest update_ts of rows of a source which is still flushing every flush_seconds
+    """
+    return datetime.datetime.utcnow() - datetime.timedelta(seconds=flush_seconds * STALE_FLUSHES)
+
+
+class SourceSnapshotFlush(abc.ABC):
+    """
+    Periodic write of process state to a SourceSnapshot model under the process source name.
+    Subclasses set name and model and implement write; every flush also removes rows of stale sources
+    """
+    name = None
+    model = None
+
+    def __init__(self, source, interval_seconds):
+        self.source = source
+        self.interval_seconds = interval_seconds
+
+    @property
+    def enabled(self):
+        return self.interval_seconds > 0
+
+    def load(self):
+        """
+        Restore process state written before restart, called once before the first flush
+        """
+
+    @abc.abstractmethod
+    def write(self):
+        """
+        Write process state to the model, commit is left to flush
+        """
+
+    def flush(self):
+        self.write()
+        self.model.delete_stale(updated_since(self.interval_seconds))
+        db.session.commit()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                self.flush()
+            except Exception as exc:
+                logger.error(
+                    msg=f"{self.name} flush exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                    extra={'tags': {}}
+                )
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+    def start(self):
+        if not self.enabled:
+            return
+
+        self.load()
+        snapshot_flush = threading.Thread(name=f"{self.name} flush", target=self.run, daemon=True)
+        snapshot_flush.start()
@@ -1,47 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
 from flask import request
 from flask_jwt_extended import decode_token
 from flask_jwt_extended.jwt_manager import ExpiredSignatureError, InvalidTokenError
 from microservice_template_core.tools.logger import get_logger
+import harp_filters.settings as settings
+from harp_filters.metrics.service_monitoring import Prom
 
 logger = get_logger()
 
+invalid_msg = {
+    'message': 'Invalid token. Registration and / or authentication required',
+    'authenticated': False
+}
+
+expired_msg = {
+    'message': 'Expired token. Re authentication required',
+    'authenticated': False
+}
+
+absent_token = {
+    'message': 'AuthToken is not present in header of request',
+    'authenticated': False
+}
+
+
+class TokenCache(object):
+    """
+    Bounded LRU cache of verified token -> claims. Entry is valid until the token `exp`,
+    but not longer than ttl_seconds. Expired token is never served from cache,
+    it is decoded again and rejected by the JWT library
+    """
+
+    def __init__(self, max_size=settings.TOKEN_CACHE_MAX_SIZE, ttl_seconds=settings.TOKEN_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, auth_token):
+        if self.max_size <= 0:
+            return None
+
+        with self._lock:
+            entry = self._tokens.get(auth_token)
+            if entry is not None:
+                claims, expire_ts = entry
+                if expire_ts > time.time():
+                    self._tokens.move_to_end(auth_token)
+                    Prom.TOKEN_CACHE_REQUESTS.labels(result='hit').inc()
+                    return claims
+                del self._tokens[auth_token]
+
+        Prom.TOKEN_CACHE_REQUESTS.labels(result='miss').inc()
+        return None
+
+    def put(self, auth_token, claims):
+        if self.max_size <= 0:
+            return
+
+        expire_ts = time.time() + self.ttl_seconds
+        if 'exp' in claims:
+            expire_ts = min(expire_ts, claims['exp'])
+
+        with self._lock:
+            self._tokens[auth_token] = (claims, expire_ts)
+            self._tokens.move_to_end(auth_token)
+            while len(self._tokens) > self.max_size:
+                self._tokens.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
 
-def get_user_id_by_token(auth_token):
-    invalid_msg = {
-        'message': 'Invalid token. Registration and / or authentication required',
-        'authenticated': False
-    }
 
-    expired_msg = {
-        'message': 'Expired token. Re authentication required',
-        'authenticated': False
-    }
+token_cache = TokenCache()
 
-    absent_token = {
-        'message': 'AuthToken is not present in header of request',
-        'authenticated': False
-    }
 
+def verify_token(auth_token):
+    """
+    Return (claims, None) for valid token or (None, error response)
+    """
     if auth_token is None:
-        return absent_token, 401
+        return None, (absent_token, 401)
+
+    claims = token_cache.get(auth_token)
+    if claims is not None:
+        return claims, None
+
     try:
         data = decode_token(auth_token, allow_expired=False)
         if data:
-            return data['sub']
+            token_cache.put(auth_token, data)
+            return data, None
         else:
             # You can also redirect the user to the login page.
             logger.error(
                 msg=f"User auth was failed\nMessage: {invalid_msg}\nHeader: {request.headers}"
             )
-            return invalid_msg, 401
+            return None, (invalid_msg, 401)
 
     except ExpiredSignatureError as err:
         logger.error(
             msg=f"User auth was failed\nMessage: {expired_msg}\nHeader: {request.headers}\nError: {err}"
         )
-        return expired_msg, 401
+        return None, (expired_msg, 401)
     except (InvalidTokenError, Exception) as err:
         logger.error(
             msg=f"User auth was failed\nMessage: {invalid_msg}\nHeader: {request.headers}\nError: {err}"
         )
-        return invalid_msg, 401
+        return None, (invalid_msg, 401)
+
+
+def request_token(browser=False):
+    """
+    Return token of the request from AuthToken header. Browser clients which can't set headers, like EventSource,
+    may send it as AuthToken cookie or auth_token query parameter when browser is set
+    """
+    auth_token = request.headers.get('AuthToken')
+    if auth_token is None and browser:
+        auth_token = request.cookies.get('AuthToken', request.args.get('auth_token'))
+
+    return auth_token
+
+
+def token_required(browser=False):
+    """
+    Same as token_required of the service template, but verified tokens are served from token_cache
+    """
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            claims, error = verify_token(request_token(browser=browser))
+            if error:
+                return error
+
+            return fn(*args, **kwargs)
+        return decorator
+    return wrapper
+
+
+def get_user_id_by_token(auth_token):
+    claims, error = verify_token(auth_token)
+    if error:
+        return error
+
+    return claims['sub']
@@ -0,0 +1,184 @@
+import bisect
+import threading
+import time
+import traceback
+from microservice_template_core import db
+from microservice_template_core.tools.logger import get_logger
+import ujson as json
+import harp_filters.settings as settings
+from harp_filters.metrics.instrumentation import tag_api_queries
+from harp_filters.logic.catalog_changes import settled_change_id
+from harp_filters.models.catalog_change import CatalogChange
+from harp_filters.models.catalog_version import LABELS_CATALOG
+
+logger = get_logger()
+
+
+class TypeaheadIndex(object):
+    """
+    In-memory index of label values for prefix lookups. Every label keeps a sorted list of
+    (lowercase str of value, JSON of value, value), so lookup is a binary search followed by a scan of `limit` items
+    and values are returned with their original type. Index is built in background on first lookup, updated
+    in place by writes in this process and follows labels catalog changes of other processes every
+    TYPEAHEAD_SYNC_SECONDS. It is built again only when the changes it needs were trimmed
+    """
+
+    def __init__(self, sync_seconds=settings.TYPEAHEAD_SYNC_SECONDS, page_size=settings.CATALOG_CHANGES_PAGE_SIZE):
+        self.sync_seconds = sync_seconds
+        self.page_size = page_size
+        self.built_ts = None
+        self.position = 0
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def built(self):
+        return self.built_ts is not None
+
+    @staticmethod
+    def _item(label_value):
+        return str(label_value).lower(), json.dumps(label_value, sort_keys=True), label_value
+
+    @classmethod
+    def _items(cls, label_values):
+        items = {}
+        for label_value in label_values:
+            item = cls._item(label_value)
+            items[item[1]] = item
+
+        return sorted(items.values())
+
+    @staticmethod
+    def _insert(items, item):
+        position = bisect.bisect_left(items, item)
+        if position == len(items) or items[position] != item:
+            items.insert(position, item)
+
+    def add(self, label_name, label_value):
+        if not self.built:
+            return
+
+        with self._lock:
+            self._insert(self._labels.setdefault(label_name, []), self._item(label_value))
+
+    def add_values(self, label_name, label_values):
+        for label_value in label_values:
+            self.add(label_name, label_value)
+
+    def replace_label(self, old_label_name, label_name, label_values):
+        if not self.built:
+            return
+
+        items = self._items(label_values)
+        with self._lock:
+            self._labels.pop(old_label_name, None)
+            self._labels[label_name] = items
+
+    def remove(self, label_name, label_value):
+        item = self._item(label_value)
+        with self._lock:
+            items = self._labels.get(label_name, [])
+            position = bisect.bisect_left(items, item)
+            if position < len(items) and items[position] == item:
+                del items[position]
+
+    def remove_label(self, label_name):
+        with self._lock:
+            self._labels.pop(label_name, None)
+
+    def search(self, label_name, prefix='', limit=settings.TYPEAHEAD_DEFAULT_LIMIT):
+        prefix = prefix.lower()
+        items = self._labels.get(label_name, [])
+        result = []
+
+        with self._lock:
+            position = bisect.bisect_left(items, (prefix,))
+            while position < len(items) and len(result) < limit:
+                lower_value, _, label_value = items[position]
+                if not lower_value.startswith(prefix):
+                    break
+                result.append(label_value)
+                position += 1
+
+        return result
+
+    def build(self, load_values):
+        """
+        Build new index from load_values() iterator of (label_name, label_value) and swap it in.
+        Changes after the settled change_id taken before the load are applied by the next syncs
+        """
+        position = settled_change_id()
+        labels = {}
+        for label_name, label_value in load_values():
+            labels.setdefault(label_name, []).append(label_value)
+
+        labels = {label_name: self._items(label_values) for label_name, label_values in labels.items()}
+        with self._lock:
+            self._labels = labels
+            self.position = position
+            self.built_ts = time.time()
+
+        logger.info(msg=f"Typeahead index has been built. Labels: {len(labels)}")
+
+    def apply(self, change):
+        payload = change.dict()
+        if change.operation in ('create', 'add_values'):
+            self.add_values(payload['label_name'], payload['label_values'])
+        elif change.operation == 'remove_values':
+            for label_value in payload['label_values']:
+                self.remove(payload['label_name'], label_value)
+        elif change.operation == 'update':
+            self.replace_label(payload['old_label_name'], payload['label_name'], payload['label_values'])
+        elif change.operation == 'delete':
+            self.remove_label(payload['label_name'])
+
+    def sync(self, load_values):
+        if not self.built or self.position < CatalogChange.trimmed_change_id():
+            self.build(load_values)
+            return
+
+        until = settled_change_id()
+        while True:
+            changes = CatalogChange.changes_between(LABELS_CATALOG, self.position, until, self.page_size)
+            for change in changes:
+                self.apply(change)
+            if len(changes) < self.page_size:
+                break
+            self.position = changes[-1].change_id
+
+        self.position = max(self.position, until)
+
+    def run(self, load_values):
+        tag_api_queries()
+        while True:
+            try:
+                self.sync(load_values)
+            except Exception as exc:
+                logger.error(
+                    msg=f"Typeahead index sync exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                    extra={'tags': {}}
+                )
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+            time.sleep(self.sync_seconds)
+
+    def ensure_started(self, load_values):
+        """
+        Start background build and sync of the index on first use. Return True once the index is built
+        """
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        name='Typeahead index', target=self.run, args=(load_values,), daemon=True
+                    )
+                    self._thread.start()
+
+        return self.built
+
+
+typeahead_index = TypeaheadIndex()
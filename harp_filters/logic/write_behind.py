@@ -0,0 +1,122 @@
+import time
+from confluent_kafka import Consumer, KafkaException, TopicPartition
+from microservice_template_core.settings import ServiceConfig, KafkaConfig
+from microservice_template_core.tools.logger import get_logger
+import harp_filters.settings as settings
+from harp_filters.metrics.service_monitoring import Prom
+from harp_filters.logic.notification_decoder import dead_letter
+
+logger = get_logger()
+
+
+class WriteBehind(object):
+    """
+    Labels of consumed events are merged into a dirty set which is written with one transaction once it has
+    WRITE_BEHIND_MAX_DIRTY values or is WRITE_BEHIND_FLUSH_MS old. Kafka offsets are committed only after
+    a successful flush, so a crash replays events which were not written yet (at-least-once aggregation).
+    Failed flush is retried without consuming new messages
+    """
+
+    def __init__(self, worker, consumer, consumer_num, max_dirty=settings.WRITE_BEHIND_MAX_DIRTY,
+                 flush_ms=settings.WRITE_BEHIND_FLUSH_MS):
+        self.worker = worker
+        self.consumer = consumer
+        self.consumer_num = consumer_num
+        self.max_dirty = max_dirty
+        self.flush_ms = flush_ms
+        self.dirty = {}
+        self.offsets = {}
+        self.dirty_ts = None
+
+    @staticmethod
+    def create_consumer():
+        """
+        Consumer with the same servers, group and offset reset as the service template consumer and auto commit
+        disabled. Subscription is left to run()
+        """
+        return Consumer({
+            'bootstrap.servers': KafkaConfig.KAFKA_SERVERS,
+            'group.id': ServiceConfig.SERVICE_NAME,
+            'auto.offset.reset': 'latest',
+            'enable.auto.commit': False
+        })
+
+    def dirty_size(self):
+        return sum(len(label_values) for label_values in self.dirty.values())
+
+    def add_messages(self, messages):
+        events = self.worker.decode_batch(messages, self.consumer_num)
+        self.worker.merge_events(events, self.dirty)
+
+        for msg in messages:
+            if not msg.error():
+                self.offsets[(msg.topic(), msg.partition())] = msg.offset() + 1
+
+        if self.dirty_ts is None and self.offsets:
+            self.dirty_ts = time.monotonic()
+
+        Prom.WRITE_BEHIND_DIRTY.set(self.dirty_size())
+
+    def due(self):
+        if self.dirty_ts is None:
+            return False
+
+        return self.dirty_size() >= self.max_dirty or (time.monotonic() - self.dirty_ts) * 1000 >= self.flush_ms
+
+    def commit_offsets(self):
+        offsets = [TopicPartition(topic, partition, offset) for (topic, partition), offset in self.offsets.items()]
+        try:
+            self.consumer.commit(offsets=offsets, asynchronous=False)
+        except KafkaException as exc:
+            # Labels are already written, uncommitted events are replayed and merged again
+            logger.error(msg=f"Can't commit Kafka offsets {offsets} \nException: {str(exc)}")
+
+    def flush(self):
+        """
+        Write dirty labels with one transaction and commit offsets of merged events. Return False if write failed
+        """
+        if self.dirty_ts is None:
+            return True
+
+        labels = self.worker.select_labels(self.worker.unique_labels(self.dirty))
+        if labels and not self.worker.write_labels(labels):
+            Prom.WRITE_BEHIND_FLUSHES.labels(result='failure').inc()
+            return False
+
+        dead_letter.flush()
+        self.commit_offsets()
+        Prom.WRITE_BEHIND_FLUSHES.labels(result='success').inc()
+
+        self.dirty = {}
+        self.offsets = {}
+        self.dirty_ts = None
+        Prom.WRITE_BEHIND_DIRTY.set(0)
+
+        return True
+
+    def on_revoke(self, consumer, partitions):
+        """
+        Flush before partitions move to another consumer. If flush fails offsets of revoked partitions are dropped,
+        as they can't be committed by this consumer anymore, and their events are replayed by the new owner
+        """
+        if self.flush():
+            return
+
+        for partition in partitions:
+            self.offsets.pop((partition.topic, partition.partition), None)
+
+    def run(self):
+        self.consumer.subscribe([settings.NOTIFICATIONS_DECORATED_TOPIC], on_revoke=self.on_revoke)
+
+        while True:
+            messages = self.consumer.consume(
+                num_messages=settings.CONSUMER_BATCH_SIZE,
+                timeout=min(settings.CONSUMER_BATCH_LINGER_MS, self.flush_ms) / 1000
+            )
+            if messages:
+                self.add_messages(messages)
+
+            if self.due():
+                while not self.flush():
+                    logger.warning(msg=f"Write-behind flush failed, retry in {settings.WRITE_BEHIND_RETRY_SECONDS} s")
+                    time.sleep(settings.WRITE_BEHIND_RETRY_SECONDS)
@@ -0,0 +1,50 @@
+"""
+Entry point of harp-filters. The app is imported only after the run mode is known, because API mode with gevent
+workers has to monkey-patch the standard library before the preloaded app creates its locks and threads, and
+prometheus_client picks where metric values are kept when it is imported
+"""
+import argparse
+import glob
+import os
+import harp_filters.settings as settings
+
+RUN_MODES = ('api', 'consumer', 'combined')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Harp Filters service')
+    parser.add_argument(
+        '--mode', choices=RUN_MODES, default=settings.RUN_MODE,
+        help='api - API only, consumer - Kafka consumer only, combined - both in one process'
+    )
+    return parser.parse_args()
+
+
+def prepare_multiprocess_metrics(mode):
+    """
+    Keep metrics of gunicorn or consumer pool workers in shared files, so every scrape reports all workers
+    """
+    workers = settings.API_WORKERS if mode == 'api' else settings.CONSUMER_WORKERS
+    if workers <= 1 or not settings.PROMETHEUS_MULTIPROC_DIR:
+        return
+
+    os.makedirs(settings.PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    # Files of the previous run would be summed with the new ones
+    for path in glob.glob(os.path.join(settings.PROMETHEUS_MULTIPROC_DIR, '*.db')):
+        os.remove(path)
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = settings.PROMETHEUS_MULTIPROC_DIR
+
+
+def main():
+    mode = parse_args().mode
+    prepare_multiprocess_metrics(mode)
+    if mode == 'api' and settings.API_WORKER_CLASS == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    from harp_filters.app import run
+    run(mode)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import functools
+import os
+import threading
+import time
+from flask import request
+from prometheus_client import CollectorRegistry, REGISTRY, make_wsgi_app, multiprocess
+from sqlalchemy import event
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from harp_filters.metrics.service_monitoring import Prom
+
+
+class QueryComponent(threading.local):
+    """
+    Component label of DB queries: run mode of the process, unless the thread sets its own.
+    In combined mode API requests and API background threads set 'api'
+    """
+    process = 'consumer'
+    thread = None
+
+    @property
+    def name(self):
+        return self.thread or self.process
+
+
+query_component = QueryComponent()
+
+
+def count_db_query(*args, **kwargs):
+    Prom.DB_QUERIES.labels(component=query_component.name).inc()
+
+
+def tag_api_queries():
+    query_component.thread = 'api'
+
+
+def track_db_queries(engine):
+    """
+    Count every statement sent to DB. Queries per event is
+    rate(db_queries_total{component="consumer"}) / rate(consumer_events_total)
+    """
+    if not event.contains(engine, 'before_cursor_execute', count_db_query):
+        event.listen(engine, 'before_cursor_execute', count_db_query)
+
+
+def endpoint_latency(func):
+    """
+    Namespace decorator which observes latency of every resource method by URL rule and HTTP method
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            Prom.API_REQUEST_LATENCY.labels(endpoint=request.url_rule.rule, method=request.method).observe(
+                time.perf_counter() - started
+            )
+
+    return wrapper
+
+
+def multiprocess_metrics():
+    return bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+
+def metrics_registry():
+    """
+    Return registry reporting metrics of all worker processes in multiprocess mode, default registry otherwise
+    """
+    if not multiprocess_metrics():
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def serve_metrics(app):
+    """
+    Serve /metrics of the Flask app from metrics_registry instead of the per-process endpoint of service template
+    """
+    if multiprocess_metrics():
+        app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {'/metrics': make_wsgi_app(metrics_registry())})
+
+
+def mark_process_dead(pid):
+    # Live gauges of the exited worker are not reported anymore
+    if multiprocess_metrics():
+        multiprocess.mark_process_dead(pid)
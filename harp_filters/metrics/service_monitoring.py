@@ -2,4 +2,58 @@ from microservice_template_core.tools.prometheus_metrics import Gauge, Counter,
 
 
 class Prom:
+    # In multiprocess mode gauges report one series per live worker process, open streams are summed
     LABELS_AGGREGATOR = Summary('labels_aggregator_latency_seconds', 'Time spent processing labels aggregator')
+    LABELS_CACHE_HITS = Counter('labels_cache_hits_total', 'Label values found in known-labels cache')
+    LABELS_CACHE_MISSES = Counter('labels_cache_misses_total', 'Label values missed in known-labels cache')
+    LABELS_CACHE_EVICTIONS = Counter('labels_cache_evictions_total', 'Label values evicted from known-labels cache')
+    LABELS_CACHE_SIZE = Gauge(
+        'labels_cache_size', 'Number of label values stored in known-labels cache', multiprocess_mode='liveall'
+    )
+    CONSUMER_PIPELINE_QUEUE_DEPTH = Gauge(
+        'consumer_pipeline_queue_depth', 'Number of batches waiting for consumer pipeline stage', ['stage'],
+        multiprocess_mode='liveall'
+    )
+    LABELS_VALUES_REMOVED = Counter('labels_values_removed_total', 'Label values removed by compaction')
+    RESPONSE_CACHE_REQUESTS = Counter(
+        'response_cache_requests_total', 'Requests of cached catalog responses', ['catalog', 'result']
+    )
+    CONSUMER_STAGE_LATENCY = Histogram(
+        'consumer_stage_latency_seconds', 'Time spent in consumer hot-path stage', ['stage']
+    )
+    CONSUMER_EVENTS = Counter('consumer_events_total', 'Events decoded by consumer')
+    CONSUMER_LAG = Gauge(
+        'consumer_lag_seconds', 'Age of the last consumed Kafka message', multiprocess_mode='liveall'
+    )
+    CONSUMER_BATCH_SIZE = Gauge(
+        'consumer_batch_size', 'Number of messages in the last consumed batch', multiprocess_mode='liveall'
+    )
+    CONSUMER_LOG_SUPPRESSED = Counter('consumer_log_suppressed_total', 'Per-event log records dropped by rate limit')
+    LABELS_NEW_VALUES = Counter('labels_new_values_total', 'Label values discovered and written to DB')
+    DB_QUERIES = Counter('db_queries_total', 'DB round-trips', ['component'])
+    API_REQUEST_LATENCY = Histogram(
+        'api_request_latency_seconds', 'Latency of API endpoints', ['endpoint', 'method']
+    )
+    TOKEN_CACHE_REQUESTS = Counter('token_cache_requests_total', 'Lookups of verified tokens cache', ['result'])
+    WRITE_BEHIND_DIRTY = Gauge(
+        'write_behind_dirty_values', 'Label values waiting for write-behind flush', multiprocess_mode='liveall'
+    )
+    WRITE_BEHIND_FLUSHES = Counter('write_behind_flushes_total', 'Write-behind flushes', ['result'])
+    CONSUMER_INVALID_MESSAGES = Counter('consumer_invalid_messages_total', 'Skipped invalid Kafka messages', ['reason'])
+    CONSUMER_DEAD_LETTER_DROPPED = Counter(
+        'consumer_dead_letter_dropped_total', 'Invalid messages not routed to dead-letter topic, producer queue was full'
+    )
+    CATALOG_STREAM_CLIENTS = Gauge(
+        'catalog_stream_clients', 'Open catalog changes streams', multiprocess_mode='livesum'
+    )
+    CATALOG_STREAM_RESYNCS = Counter('catalog_stream_resyncs_total', 'Catalog stream clients told to reload catalogs')
+    LABEL_CARDINALITY = Gauge(
+        'label_cardinality', 'Estimated number of distinct values of the label', ['label'],
+        multiprocess_mode='liveall'
+    )
+    LABELS_CARDINALITY_SKIPPED = Counter(
+        'labels_cardinality_skipped_total', 'Values of high-cardinality labels not aggregated by policy', ['label']
+    )
+    RECENT_EVENTS_BYTES = Gauge(
+        'recent_events_bytes', 'Size of the last snapshot of recent events buffer', multiprocess_mode='liveall'
+    )
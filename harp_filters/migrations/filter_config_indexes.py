@@ -0,0 +1,32 @@
+from microservice_template_core import Core, db
+from microservice_template_core.settings import DbConfig
+from microservice_template_core.tools.logger import get_logger
+from sqlalchemy import inspect
+from harp_filters.models.filter_config import FilterConfig
+
+logger = get_logger()
+
+
+def migrate():
+    """
+    Create indexes of filter_config which are missing in tables created by previous versions.
+    db.create_all() creates indexes only together with a new table
+    """
+    exist_indexes = {index['name'] for index in inspect(db.engine).get_indexes(FilterConfig.__tablename__)}
+
+    for index in FilterConfig.__table__.indexes:
+        if index.name in exist_indexes:
+            logger.info(msg=f"Index {index.name} already exist")
+            continue
+        index.create(bind=db.engine)
+        logger.info(msg=f"Index {index.name} has been created")
+
+
+def main():
+    DbConfig.USE_DB = True
+    Core()
+    migrate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import datetime
+from microservice_template_core import Core, db
+from microservice_template_core.settings import DbConfig
+from microservice_template_core.tools.logger import get_logger
+import ujson as json
+from harp_filters.models.filter_labels import FilterLabels
+from harp_filters.models.filter_label_values import FilterLabelValues
+
+logger = get_logger()
+
+CHUNK_SIZE = 1000
+
+
+def label_names():
+    return [row.label_name for row in FilterLabels.query.with_entities(FilterLabels.label_name).all()]
+
+
+def migrate(chunk_size=CHUNK_SIZE):
+    """
+    Copy values from filter_labels.label_values JSON blobs to filter_label_values rows.
+    Migration is idempotent - already copied values are skipped by the unique index
+    """
+    names = label_names()
+
+    for label_name in names:
+        single_label = FilterLabels.query.filter_by(label_name=label_name).one()
+        label_values = json.loads(single_label.label_values)
+
+        for start in range(0, len(label_values), chunk_size):
+            FilterLabelValues.add_values({label_name: label_values[start:start + chunk_size]})
+            db.session.commit()
+
+        logger.info(msg=f"Label - {label_name} has been migrated. Values: {len(label_values)}")
+
+    logger.info(msg=f"Labels migration has been finished. Labels: {len(names)}")
+
+
+def reverse_migrate():
+    """
+    Replace filter_labels.label_values JSON blobs with values of filter_label_values rows. Normalized storage
+    never updates blobs, so this must run after API and consumers are stopped and before storage mode
+    is switched back to blob, otherwise values added or removed since the migration are lost
+    """
+    names = label_names()
+
+    for label_name in names:
+        label_values = FilterLabelValues.get_values(label_name)
+        FilterLabels.query.filter_by(label_name=label_name).update(
+            {'label_values': json.dumps(label_values), 'last_update_ts': datetime.datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        logger.info(msg=f"Label - {label_name} has been migrated back. Values: {len(label_values)}")
+
+    logger.info(msg=f"Labels reverse migration has been finished. Labels: {len(names)}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Migrate label values between blob and normalized storage')
+    parser.add_argument(
+        '--reverse', action='store_true',
+        help='write values of normalized storage back to blobs before switching to blob storage'
+    )
+    return parser.parse_args()
+
+
+def main():
+    reverse = parse_args().reverse
+    DbConfig.USE_DB = True
+    Core()
+    if reverse:
+        reverse_migrate()
+    else:
+        migrate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+from microservice_template_core import db
+from microservice_template_core.tools.logger import get_logger
+import ujson as json
+from harp_filters.models.catalog_version import CatalogVersion, FILTERS_CATALOG, LABELS_CATALOG
+
+logger = get_logger()
+
+# Version of this pseudo catalog is the last change_id removed by trim
+CHANGES_TRIMMED = 'changes_trimmed'
+
+
+class CatalogChange(db.Model):
+    """
+    Change log of labels and filters catalogs. change_id is a sequence shared by both catalogs.
+    Every write path records its changes in the same transaction as the catalog version bump
+    """
+    __tablename__ = 'catalog_changes'
+    __table_args__ = (
+        db.Index('ix_catalog_changes_catalog', 'catalog', 'change_id'),
+        db.Index('ix_catalog_changes_create_ts', 'create_ts'),
+    )
+
+    change_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    catalog = db.Column(db.VARCHAR(64), nullable=False, unique=False)
+    operation = db.Column(db.VARCHAR(32), nullable=False, unique=False)
+    # Username for changes of private filters, NULL for changes visible to everyone
+    owner = db.Column(db.VARCHAR(254), nullable=True, unique=False)
+    payload = db.Column(db.Text(4294000000), nullable=False, unique=False)
+    # Set by DB clock, so the settle window doesn't depend on clocks of writer and reader hosts
+    create_ts = db.Column(db.TIMESTAMP, server_default=db.func.now(), nullable=False)
+
+    def __repr__(self):
+        return f"{self.change_id}_{self.catalog}_{self.operation}"
+
+    def dict(self):
+        return {
+            'change_id': self.change_id,
+            'operation': self.operation,
+            **json.loads(self.payload)
+        }
+
+    @classmethod
+    def record(cls, catalog, operation, payload, owner=None):
+        """
+        Add change to the log. Commit is left to the caller
+        """
+        cls.record_many(catalog, [(operation, payload, owner)])
+
+    @classmethod
+    def record_many(cls, catalog, changes):
+        """
+        Add several (operation, payload, owner) changes with one statement. Commit is left to the caller
+        """
+        if not changes:
+            return
+
+        db.session.execute(
+            cls.__table__.insert(),
+            [
+                {'catalog': catalog, 'operation': operation, 'owner': owner, 'payload': json.dumps(payload)}
+                for operation, payload, owner in changes
+            ]
+        )
+
+    @classmethod
+    def record_label_values(cls, operation, labels):
+        """
+        Add one change per label of {label_name: [label_values]}. Commit is left to the caller
+        """
+        cls.record_many(
+            LABELS_CATALOG,
+            [
+                (operation, {'label_name': label_name, 'label_values': label_values}, None)
+                for label_name, label_values in labels.items() if label_values
+            ]
+        )
+
+    @classmethod
+    def record_filter(cls, operation, filter_obj):
+        """
+        Add change of the filter. Changes of private filter are visible only to its creator
+        """
+        owner = filter_obj.created_by if filter_obj.filter_status == 'private' else None
+        if operation == 'delete':
+            payload = {'filter_id': str(filter_obj.filter_id)}
+        else:
+            payload = {
+                'filter_id': str(filter_obj.filter_id),
+                'filter_name': filter_obj.filter_name,
+                'filter_status': filter_obj.filter_status,
+                'filter_config': json.loads(filter_obj.filter_config)
+            }
+
+        cls.record(FILTERS_CATALOG, operation, payload, owner=owner)
+
+    @staticmethod
+    def db_now():
+        return db.session.query(db.func.now()).scalar()
+
+    @classmethod
+    def last_change_id(cls, created_before=None, catalog=None):
+        query = db.session.query(db.func.max(cls.change_id))
+        if catalog is not None:
+            query = query.filter(cls.catalog == catalog)
+        if created_before is not None:
+            query = query.filter(cls.create_ts <= created_before)
+
+        return query.scalar() or 0
+
+    @classmethod
+    def changes_between(cls, catalog, since, until, limit, username=None, include_private=False):
+        """
+        Return changes of the catalog with since < change_id <= until ordered by change_id.
+        Private filter changes are returned only to their owner, or to everyone with include_private
+        """
+        query = cls.query.filter(cls.catalog == catalog, cls.change_id > since, cls.change_id <= until)
+        if catalog == FILTERS_CATALOG and not include_private:
+            query = query.filter(db.or_(cls.owner.is_(None), cls.owner == username))
+
+        return query.order_by(cls.change_id).limit(limit).all()
+
+    @classmethod
+    def changes_after(cls, since, until, limit):
+        """
+        Return changes of both catalogs with since < change_id <= until ordered by change_id, private ones included
+        """
+        return cls.query.filter(cls.change_id > since, cls.change_id <= until).order_by(cls.change_id).limit(limit).all()
+
+    @classmethod
+    def trimmed_change_id(cls):
+        return CatalogVersion.get_version(CHANGES_TRIMMED)
+
+    @classmethod
+    def trim(cls, created_before):
+        """
+        Remove changes created before the timestamp and remember the last removed change_id,
+        so clients asking for older changes are told to resync
+        """
+        last_trimmed = db.session.query(db.func.max(cls.change_id)).filter(cls.create_ts < created_before).scalar()
+        # The newest change is never removed, so DB never reuses change ids of an emptied table
+        last_trimmed = min(last_trimmed or 0, cls.last_change_id() - 1)
+        if last_trimmed <= cls.trimmed_change_id():
+            return 0
+
+        removed = cls.query.filter(cls.change_id <= last_trimmed).delete(synchronize_session=False)
+        CatalogVersion.set_version(CHANGES_TRIMMED, last_trimmed)
+        db.session.commit()
+
+        logger.info(msg=f"Catalog changes created before {created_before} have been removed. Removed: {removed}")
+
+        return removed
@@ -0,0 +1,127 @@
+from microservice_template_core import db
+import datetime
+import os
+import threading
+import time
+import traceback
+from microservice_template_core.tools.logger import get_logger
+import harp_filters.settings as settings
+from harp_filters.models.upsert import insert_ignore_rows
+from harp_filters.metrics.instrumentation import query_component
+
+logger = get_logger()
+
+LABELS_CATALOG = 'labels'
+FILTERS_CATALOG = 'filters'
+
+
+class CatalogVersion(db.Model):
+    """
+    Version counter of labels and filters catalogs. Every write path bumps it in the same transaction,
+    so all API replicas see the same version for the same data
+    """
+    __tablename__ = 'catalog_versions'
+
+    catalog = db.Column(db.VARCHAR(64), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    last_update_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"{self.catalog}_{self.version}"
+
+    @classmethod
+    def bump(cls, catalog):
+        """
+        Increment catalog version. Commit is left to the caller
+        """
+        now = datetime.datetime.utcnow()
+        updated = cls.query.filter_by(catalog=catalog).update(
+            {'version': cls.version + 1, 'last_update_ts': now},
+            synchronize_session=False
+        )
+        if not updated:
+            insert_ignore_rows(cls, [{'catalog': catalog, 'version': 1, 'last_update_ts': now}])
+
+    @classmethod
+    def bump_later(cls, catalog):
+        """
+        Bump catalog version after a committed write, from a separate short transaction of this process.
+        Consumer writes use it, so concurrent writers don't serialize on the version row lock until their commit
+        """
+        pending_bumps.add(catalog)
+
+    @classmethod
+    def get_version(cls, catalog):
+        row = cls.query.with_entities(cls.version).filter_by(catalog=catalog).one_or_none()
+
+        return row.version if row else 0
+
+    @classmethod
+    def set_version(cls, catalog, version):
+        """
+        Set catalog version to the value. Commit is left to the caller
+        """
+        now = datetime.datetime.utcnow()
+        updated = cls.query.filter_by(catalog=catalog).update(
+            {'version': version, 'last_update_ts': now},
+            synchronize_session=False
+        )
+        if not updated:
+            insert_ignore_rows(cls, [{'catalog': catalog, 'version': version, 'last_update_ts': now}])
+
+
+class PendingBumps(object):
+    """
+    Catalogs changed by committed writes of this process. Their versions are bumped by a background thread
+    every interval_ms with one transaction, no matter how many writes changed them meanwhile
+    """
+
+    def __init__(self, interval_ms=settings.CATALOG_VERSION_BUMP_MS):
+        self.interval_ms = interval_ms
+        self.catalogs = set()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def add(self, catalog):
+        with self._lock:
+            self.catalogs.add(catalog)
+            # Thread is started lazily in every process, consumer workers are forked without it
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                # Bumps are counted as queries of the component which started the thread
+                threading.Thread(
+                    name='Catalog versions bump', target=self.run, args=(query_component.name,), daemon=True
+                ).start()
+
+    def flush(self):
+        with self._lock:
+            catalogs, self.catalogs = self.catalogs, set()
+
+        try:
+            for catalog in sorted(catalogs):
+                CatalogVersion.bump(catalog)
+            db.session.commit()
+        except Exception:
+            with self._lock:
+                self.catalogs.update(catalogs)
+            raise
+
+    def run(self, component=None):
+        query_component.thread = component
+        while True:
+            time.sleep(self.interval_ms / 1000)
+            if not self.catalogs:
+                continue
+            try:
+                self.flush()
+            except Exception as exc:
+                logger.error(
+                    msg=f"Catalog versions bump exception \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                    extra={'tags': {}}
+                )
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+pending_bumps = PendingBumps()
@@ -4,12 +4,18 @@ from microservice_template_core import db
 import datetime
 from microservice_template_core.tools.logger import get_logger
 from marshmallow import Schema, fields
+from harp_filters.models.catalog_version import CatalogVersion, FILTERS_CATALOG
+from harp_filters.models.catalog_change import CatalogChange
 
 logger = get_logger()
 
 
 class FilterConfig(db.Model):
     __tablename__ = 'filter_config'
+    __table_args__ = (
+        db.Index('ix_filter_config_filter_status', 'filter_status'),
+        db.Index('ix_filter_config_created_by', 'created_by'),
+    )
 
     filter_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     filter_name = db.Column(db.VARCHAR(254), nullable=False, unique=True)
@@ -18,8 +24,8 @@ class FilterConfig(db.Model):
     grouping = db.Column(db.Text(4294000000), nullable=False, unique=False)
     filter_status = db.Column(db.VARCHAR(254), nullable=False, unique=False)
     created_by = db.Column(db.VARCHAR(254), nullable=False, unique=False)
-    create_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow(), nullable=False)
-    last_update_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow(), nullable=False)
+    create_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow, nullable=False)
+    last_update_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow, nullable=False)
 
     def __repr__(self):
         return f"{self.filter_id}_{self.filter_name}"
@@ -50,6 +56,20 @@ class FilterConfig(db.Model):
             filter_status=data['filter_status'],
             created_by=data['created_by']
         )
+        try:
+            # Flush assigns filter_id, so the change is recorded in the same transaction as the filter
+            db.session.add(new_obj)
+            db.session.flush()
+            CatalogVersion.bump(FILTERS_CATALOG)
+            CatalogChange.record_filter('create', new_obj)
+        except Exception as exc:
+            logger.critical(
+                msg=f"Can't commit changes to DB \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                extra={'tags': {}}
+            )
+            db.session.rollback()
+            return None
+
         new_obj = new_obj.save()
         return new_obj
 
@@ -67,7 +87,16 @@ class FilterConfig(db.Model):
         if 'grouping' in data:
             data['grouping'] = json.dumps(data['grouping'])
 
+        data['last_update_ts'] = datetime.datetime.utcnow()
+
+        was_visible_to_all = self.filter_status != 'private'
         self.query.filter_by(filter_id=filter_id).update(data)
+        CatalogVersion.bump(FILTERS_CATALOG)
+        db.session.refresh(self)
+        if was_visible_to_all and self.filter_status == 'private':
+            # Other users have to drop the filter which became private
+            CatalogChange.record(FILTERS_CATALOG, 'delete', {'filter_id': str(filter_id)})
+        CatalogChange.record_filter('update', self)
 
         db.session.commit()
 
@@ -82,20 +111,32 @@ class FilterConfig(db.Model):
             'created_by': self.created_by,
         }
 
+    @classmethod
+    def visible_to(cls, username):
+        """
+        Filter condition of filters visible to the user - public filters and own private filters
+        """
+        return db.or_(cls.filter_status != 'private', cls.created_by == username)
+
+    @classmethod
+    def get_match_info(cls):
+        return cls.query.with_entities(
+            cls.filter_id, cls.filter_status, cls.created_by, cls.last_update_ts, cls.filter_config
+        ).all()
+
     @classmethod
     def get_all_filters(cls, username):
         global_search_select = []
         global_filter_dict = {}
 
-        get_all_filters = cls.query.filter_by().all()
+        get_all_filters = cls.query.with_entities(
+            cls.filter_id, cls.filter_name, cls.filter_status, cls.filter_config
+        ).filter(cls.visible_to(username)).all()
 
         for single_event in get_all_filters:
-            if single_event.filter_status == 'private' and single_event.created_by != username:
-                continue
-            else:
-                global_search_select.append(
-                    {'id': str(single_event.filter_id), 'value': single_event.filter_name, 'filter_status': single_event.filter_status}
-                )
+            global_search_select.append(
+                {'id': str(single_event.filter_id), 'value': single_event.filter_name, 'filter_status': single_event.filter_status}
+            )
 
             global_filter_dict[str(single_event.filter_id)] = json.loads(single_event.filter_config)
 
@@ -117,6 +158,8 @@ class FilterConfig(db.Model):
 
     def delete_obj(self):
         db.session.delete(self)
+        CatalogVersion.bump(FILTERS_CATALOG)
+        CatalogChange.record_filter('delete', self)
         db.session.commit()
 
 
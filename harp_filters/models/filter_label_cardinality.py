@@ -0,0 +1,53 @@
+from microservice_template_core import db
+import datetime
+from microservice_template_core.tools.logger import get_logger
+from harp_filters.models.source_snapshot import SourceSnapshot
+
+logger = get_logger()
+
+
+class FilterLabelCardinality(SourceSnapshot, db.Model):
+    """
+    HyperLogLog registers of label values seen by every consumer process (source).
+    Registers of all sources are merged on read to estimate the number of distinct values of the label
+    """
+    __tablename__ = 'filter_label_cardinality'
+    __table_args__ = (
+        db.UniqueConstraint('source', 'label_name', name='uq_filter_label_cardinality_source_label'),
+        db.Index('ix_filter_label_cardinality_label_name', 'label_name'),
+    )
+
+    cardinality_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    source = db.Column(db.VARCHAR(254), nullable=False, unique=False)
+    label_name = db.Column(db.VARCHAR(254), nullable=False, unique=False)
+    registers = db.Column(db.LargeBinary, nullable=False, unique=False)
+    update_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"{self.source}_{self.label_name}"
+
+    @classmethod
+    def replace_source(cls, source, label_registers):
+        """
+        Replace rows of the source with {label_name: registers}. Commit is left to the caller
+        """
+        cls.replace_source_rows(source, [
+            {'label_name': label_name, 'registers': bytes(registers)} for label_name, registers in label_registers.items()
+        ])
+
+    @classmethod
+    def source_registers(cls, source):
+        rows = cls.query.with_entities(cls.label_name, cls.registers).filter_by(source=source).all()
+        return {row.label_name: row.registers for row in rows}
+
+    @classmethod
+    def iter_registers(cls, updated_since, label_name=None):
+        """
+        Yield (label_name, registers) of all fresh sources
+        """
+        query = cls.query.with_entities(cls.label_name, cls.registers).filter(cls.update_ts >= updated_since)
+        if label_name is not None:
+            query = query.filter(cls.label_name == label_name)
+
+        for row in query.yield_per(100):
+            yield row.label_name, row.registers
@@ -0,0 +1,68 @@
+from microservice_template_core import db
+import datetime
+from microservice_template_core.tools.logger import get_logger
+import ujson as json
+from harp_filters.models.filter_label_values import FilterLabelValues
+from harp_filters.models.source_snapshot import SourceSnapshot
+
+logger = get_logger()
+
+
+class FilterLabelStats(SourceSnapshot, db.Model):
+    """
+    Most frequent values of labels by decayed number of events. Every consumer process replaces
+    its own rows (source) on every flush, so frequencies of all consumers are summed on read
+    """
+    __tablename__ = 'filter_label_stats'
+    __table_args__ = (
+        db.Index('ix_filter_label_stats_label_name', 'label_name'),
+        db.Index('ix_filter_label_stats_source', 'source'),
+    )
+
+    stat_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    source = db.Column(db.VARCHAR(254), nullable=False, unique=False)
+    label_name = db.Column(db.VARCHAR(254), nullable=False, unique=False)
+    label_value = db.Column(db.Text(4294000000), nullable=False, unique=False)
+    frequency = db.Column(db.Float, nullable=False, unique=False)
+    error = db.Column(db.Float, nullable=False, unique=False)
+    update_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"{self.source}_{self.label_name}"
+
+    @classmethod
+    def replace_source(cls, source, labels):
+        """
+        Replace rows of the source with {label_name: [(label_value, frequency, error)]}. Commit is left to the caller
+        """
+        cls.replace_source_rows(source, [
+            {
+                'label_name': label_name,
+                'label_value': FilterLabelValues.encode_value(label_value)[0],
+                'frequency': frequency,
+                'error': error
+            }
+            for label_name, label_values in labels.items() for label_value, frequency, error in label_values
+        ])
+
+    @classmethod
+    def top_values(cls, label_name, updated_since, limit):
+        """
+        Return up to limit values of the label ordered by frequency summed over sources
+        """
+        rows = cls.query.with_entities(cls.label_value, cls.frequency, cls.error).filter(
+            cls.label_name == label_name, cls.update_ts >= updated_since
+        ).all()
+
+        totals = {}
+        for row in rows:
+            total = totals.setdefault(row.label_value, [0.0, 0.0])
+            total[0] += row.frequency
+            total[1] += row.error
+
+        top = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+
+        return [
+            {'label_value': json.loads(label_value), 'frequency': round(frequency, 3), 'error': round(error, 3)}
+            for label_value, (frequency, error) in top
+        ]
@@ -0,0 +1,203 @@
+import hashlib
+from microservice_template_core import db
+import datetime
+from microservice_template_core.tools.logger import get_logger
+import ujson as json
+from harp_filters.models.upsert import insert_ignore_rows
+
+logger = get_logger()
+
+
+class FilterLabelValues(db.Model):
+    """
+    Normalized storage of label values - one row per (label_name, label_value)
+    """
+    __tablename__ = 'filter_label_values'
+    __table_args__ = (
+        db.UniqueConstraint('label_name', 'value_hash', name='uq_filter_label_values_label_value'),
+    )
+
+    value_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    label_name = db.Column(db.VARCHAR(254), nullable=False, unique=False)
+    value_hash = db.Column(db.CHAR(40), nullable=False, unique=False)
+    label_value = db.Column(db.Text(4294000000), nullable=False, unique=False)
+    create_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow, nullable=False)
+    last_seen_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"{self.value_id}_{self.label_name}"
+
+    @staticmethod
+    def encode_value(label_value):
+        encoded_value = json.dumps(label_value, sort_keys=True)
+        return encoded_value, hashlib.sha1(encoded_value.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def value_rows(cls, label_name, label_values, now=None):
+        now = now or datetime.datetime.utcnow()
+        rows = []
+        for label_value in label_values:
+            encoded_value, value_hash = cls.encode_value(label_value)
+            rows.append({
+                'label_name': label_name,
+                'value_hash': value_hash,
+                'label_value': encoded_value,
+                'create_ts': now,
+                'last_seen_ts': now
+            })
+
+        return rows
+
+    @classmethod
+    def add_values(cls, labels):
+        """
+        Idempotently insert values of several labels ({label_name: [label_values]}). Commit is left to the caller
+        """
+        now = datetime.datetime.utcnow()
+        rows = []
+        for label_name, label_values in labels.items():
+            rows.extend(cls.value_rows(label_name, label_values, now=now))
+
+        insert_ignore_rows(cls, rows)
+
+    @classmethod
+    def missing_values(cls, labels):
+        """
+        Return {label_name: [label_values]} of values of several labels which are not stored
+        """
+        keys = {
+            (label_name, cls.encode_value(label_value)[1]): (label_name, label_value)
+            for label_name, label_values in labels.items() for label_value in label_values
+        }
+        if not keys:
+            return {}
+
+        stored = cls.query.with_entities(cls.label_name, cls.value_hash).filter(
+            db.tuple_(cls.label_name, cls.value_hash).in_(list(keys))
+        ).all()
+        for row in stored:
+            keys.pop((row.label_name, row.value_hash), None)
+
+        missing = {}
+        for label_name, label_value in keys.values():
+            missing.setdefault(label_name, []).append(label_value)
+
+        return missing
+
+    @classmethod
+    def touch_values(cls, labels):
+        """
+        Set last_seen_ts of values of several labels ({label_name: [label_values]}) to now with one statement.
+        Values removed in the meantime are not inserted back here: consumers drop them from known-labels cache,
+        so they are written by the regular write path once seen again. Commit is left to the caller
+        """
+        keys = [
+            (label_name, cls.encode_value(label_value)[1])
+            for label_name, label_values in labels.items() for label_value in label_values
+        ]
+        if not keys:
+            return 0
+
+        return db.session.execute(
+            cls.__table__.update().where(db.tuple_(cls.label_name, cls.value_hash).in_(keys)).values(
+                last_seen_ts=datetime.datetime.utcnow()
+            )
+        ).rowcount
+
+    @classmethod
+    def stale_values(cls, last_seen_before, limit):
+        return cls.query.with_entities(cls.value_id, cls.label_name, cls.label_value).filter(
+            cls.last_seen_ts < last_seen_before
+        ).order_by(cls.last_seen_ts).limit(limit).all()
+
+    @classmethod
+    def least_recent_values(cls, label_name, limit):
+        return cls.query.with_entities(cls.value_id, cls.label_name, cls.label_value).filter_by(
+            label_name=label_name
+        ).order_by(cls.last_seen_ts, cls.value_id).limit(limit).all()
+
+    @classmethod
+    def label_counts(cls, min_count):
+        count = db.func.count(cls.value_id)
+        return cls.query.with_entities(cls.label_name, count).group_by(cls.label_name).having(count > min_count).all()
+
+    @classmethod
+    def delete_values(cls, value_ids):
+        """
+        Delete values by ids. Commit is left to the caller
+        """
+        cls.query.filter(cls.value_id.in_(value_ids)).delete(synchronize_session=False)
+
+    @classmethod
+    def get_values(cls, label_name):
+        rows = cls.query.with_entities(cls.label_value).filter_by(label_name=label_name).order_by(cls.value_id).all()
+
+        return [json.loads(row.label_value) for row in rows]
+
+    @classmethod
+    def get_all_values(cls):
+        all_values = {}
+        rows = cls.query.with_entities(cls.label_name, cls.label_value).order_by(cls.value_id).yield_per(1000)
+        for row in rows:
+            all_values.setdefault(row.label_name, []).append(json.loads(row.label_value))
+
+        return all_values
+
+    @classmethod
+    def iter_values(cls):
+        rows = cls.query.with_entities(cls.label_name, cls.label_value).order_by(cls.value_id).yield_per(1000)
+        for row in rows:
+            yield row.label_name, json.loads(row.label_value)
+
+    @classmethod
+    def max_value_id(cls):
+        return cls.query.with_entities(db.func.max(cls.value_id)).scalar() or 0
+
+    @classmethod
+    def iter_values_after_id(cls, after_value_id=0, chunk_size=1000):
+        """
+        Yield (label_name, label_value) of values added after value_id, loading chunk_size rows per query
+        """
+        while True:
+            rows = cls.query.with_entities(cls.value_id, cls.label_name, cls.label_value).filter(
+                cls.value_id > after_value_id
+            ).order_by(cls.value_id).limit(chunk_size).all()
+
+            for row in rows:
+                yield row.label_name, json.loads(row.label_value)
+
+            if len(rows) < chunk_size:
+                return
+            after_value_id = rows[-1].value_id
+
+    @classmethod
+    def delete_label(cls, label_name):
+        """
+        Delete all values of the label. Commit is left to the caller
+        """
+        cls.query.filter_by(label_name=label_name).delete(synchronize_session=False)
+
+    @classmethod
+    def replace_values(cls, old_label_name, label_name, label_values):
+        """
+        Replace all values of the label. Commit is left to the caller
+        """
+        cls.delete_label(old_label_name)
+        cls.add_values({label_name: label_values})
+
+    @classmethod
+    def iter_label_values(cls, label_name, after_value_id=0, chunk_size=1000):
+        """
+        Yield (value_id, label_value) of the label ordered by value_id, loading chunk_size rows per query
+        """
+        while True:
+            rows = cls.query.with_entities(cls.value_id, cls.label_value).filter(
+                cls.label_name == label_name, cls.value_id > after_value_id
+            ).order_by(cls.value_id).limit(chunk_size).all()
+
+            for row in rows:
+                yield row.value_id, json.loads(row.label_value)
+
+            if len(rows) < chunk_size:
+                return
+            after_value_id = rows[-1].value_id
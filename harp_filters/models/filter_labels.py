@@ -5,27 +5,53 @@ from microservice_template_core.tools.logger import get_logger
 from marshmallow import Schema, fields
 import ujson as json
 from harp_filters.metrics.service_monitoring import Prom
+from harp_filters.logic.labels_cache import labels_cache, value_key
+from harp_filters.logic.typeahead_index import typeahead_index
+from harp_filters.logic.last_seen_tracker import last_seen_tracker
+from harp_filters.models.upsert import upsert_rows, insert_ignore_rows
+from harp_filters.models.filter_label_values import FilterLabelValues
+from harp_filters.models.catalog_version import CatalogVersion, LABELS_CATALOG
+from harp_filters.models.catalog_change import CatalogChange
+import harp_filters.settings as settings
 
 logger = get_logger()
 
 
+def normalized_storage():
+    return settings.LABELS_STORAGE_MODE == 'normalized'
+
+
+def like_pattern(search, match='prefix'):
+    escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    if match == 'substring':
+        return f"%{escaped}%"
+
+    return f"{escaped}%"
+
+
 class FilterLabels(db.Model):
     __tablename__ = 'filter_labels'
 
     label_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     label_name = db.Column(db.VARCHAR(254), nullable=False, unique=True)
     label_values = db.Column(db.Text(4294000000), nullable=False, unique=False)
-    create_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow(), nullable=False)
-    last_update_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow(), nullable=False)
+    create_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow, nullable=False)
+    last_update_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow, nullable=False)
 
     def __repr__(self):
         return f"{self.label_id}_{self.label_name}"
 
+    def values(self):
+        if normalized_storage():
+            return FilterLabelValues.get_values(self.label_name)
+
+        return json.loads(self.label_values)
+
     def dict(self):
         return {
             'label_id': self.label_id,
             'label_name': self.label_name,
-            'label_values': json.loads(self.label_values),
+            'label_values': self.values(),
             'create_ts': self.create_ts,
             'last_update_ts': self.last_update_ts
         }
@@ -35,55 +61,508 @@ class FilterLabels(db.Model):
         exist_name = cls.query.filter_by(label_name=data['label_name']).one_or_none()
         if exist_name:
             raise ValueError(f"Label Name: {data['label_name']} already exist")
+        if normalized_storage():
+            FilterLabelValues.add_values({data['label_name']: data['label_values']})
+            label_values = []
+        else:
+            label_values = data['label_values']
         new_obj = FilterLabels(
             label_name=data['label_name'],
-            label_values=json.dumps(data['label_values'])
+            label_values=json.dumps(label_values)
+        )
+        CatalogVersion.bump(LABELS_CATALOG)
+        CatalogChange.record(
+            LABELS_CATALOG, 'create', {'label_name': data['label_name'], 'label_values': data['label_values']}
         )
         new_obj = new_obj.save()
+        if new_obj:
+            labels_cache.add_values(data['label_name'], data['label_values'])
+            typeahead_index.add_values(data['label_name'], data['label_values'])
         return new_obj
 
     @classmethod
     @Prom.LABELS_AGGREGATOR.time()
     def aggr_label(cls, data):
+        if normalized_storage():
+            cls.merge_labels({label_name: [label_value] for label_name, label_value in data.items()})
+            return
+
         for label_name, label_value in data.items():
-            exist_name = cls.query.filter_by(label_name=label_name).one_or_none()
+            with Prom.CONSUMER_STAGE_LATENCY.labels(stage='lookup').time():
+                if labels_cache.contains(label_name, label_value):
+                    continue
+                # Row is locked until commit, so concurrent read-modify-writes of the blob don't lose values
+                exist_name = cls.query.filter_by(label_name=label_name).with_for_update().one_or_none()
             if exist_name:
                 exist_value = json.loads(exist_name.label_values)
-                if label_value not in exist_value:
+                if label_value in exist_value:
+                    # Release the row lock
+                    db.session.commit()
+                else:
                     logger.info(msg=f"Update value for existing label - {label_name}. Value - {label_value}")
                     exist_value.append(label_value)
-                    cls.query.filter_by(label_name=label_name).update({'label_values': json.dumps(exist_value)})
-                    db.session.commit()
+                    with Prom.CONSUMER_STAGE_LATENCY.labels(stage='write').time():
+                        cls.query.filter_by(label_name=label_name).update(
+                            {'label_values': json.dumps(exist_value), 'last_update_ts': datetime.datetime.utcnow()}
+                        )
+                        CatalogChange.record_label_values('add_values', {label_name: [label_value]})
+                    with Prom.CONSUMER_STAGE_LATENCY.labels(stage='commit').time():
+                        db.session.commit()
+                    CatalogVersion.bump_later(LABELS_CATALOG)
+                    Prom.LABELS_NEW_VALUES.inc()
+                    typeahead_index.add(label_name, label_value)
+                labels_cache.add(label_name, label_value)
             else:
                 logger.info(msg=f"Add new label - {label_name} with value - {label_value}")
                 new_obj = FilterLabels(
                     label_name=label_name,
                     label_values=json.dumps([label_value])
                 )
-                new_obj.save()
+                CatalogChange.record_label_values('add_values', {label_name: [label_value]})
+                with Prom.CONSUMER_STAGE_LATENCY.labels(stage='commit').time():
+                    saved = new_obj.save()
+                if saved:
+                    CatalogVersion.bump_later(LABELS_CATALOG)
+                    Prom.LABELS_NEW_VALUES.inc()
+                    labels_cache.add(label_name, label_value)
+                    typeahead_index.add(label_name, label_value)
+
+    @classmethod
+    @Prom.LABELS_AGGREGATOR.time()
+    def aggr_labels_bulk(cls, labels):
+        """
+        Merge values of several labels ({label_name: [label_values]}) into DB with one multi-row upsert and one commit
+        """
+        return cls.merge_labels(labels)
+
+    @classmethod
+    def merge_labels(cls, labels):
+        """
+        Write values missed in known-labels cache with one commit. Return False if the commit failed.
+        Last-seen timestamps are tracked after the write, so a flush never races values being inserted
+        """
+        new_labels = {}
+        with Prom.CONSUMER_STAGE_LATENCY.labels(stage='lookup').time():
+            for label_name, label_values in labels.items():
+                missed_values = [
+                    label_value for label_value in label_values if not labels_cache.contains(label_name, label_value)
+                ]
+                if missed_values:
+                    new_labels[label_name] = missed_values
+
+        if new_labels:
+            try:
+                with Prom.CONSUMER_STAGE_LATENCY.labels(stage='write').time():
+                    if normalized_storage():
+                        added_labels = cls.write_normalized_values(new_labels)
+                    else:
+                        added_labels = cls.write_blob_values(new_labels)
+                    CatalogChange.record_label_values('add_values', added_labels)
+                with Prom.CONSUMER_STAGE_LATENCY.labels(stage='commit').time():
+                    db.session.commit()
+            except Exception as exc:
+                logger.critical(
+                    msg=f"Can't commit changes to DB \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                    extra={'tags': {}}
+                )
+                db.session.rollback()
+                return False
+
+            if added_labels:
+                CatalogVersion.bump_later(LABELS_CATALOG)
+            Prom.LABELS_NEW_VALUES.inc(sum(len(label_values) for label_values in added_labels.values()))
+            for label_name, label_values in new_labels.items():
+                labels_cache.add_values(label_name, label_values)
+                typeahead_index.add_values(label_name, label_values)
+
+        cls.track_last_seen(labels)
+
+        return True
+
+    @classmethod
+    def import_labels(cls, labels):
+        """
+        Merge imported values ({label_name: [label_values]}) with one commit, labels without values are created empty.
+        Unlike merge_labels, stored values are checked in DB, not in known-labels cache, and consumer metrics
+        and last-seen timestamps are left alone. Return False if the commit failed
+        """
+        try:
+            exist_names = {
+                row.label_name for row in cls.query.with_entities(cls.label_name).filter(cls.label_name.in_(list(labels)))
+            }
+            if normalized_storage():
+                added_labels = cls.write_normalized_values(labels)
+            else:
+                added_labels = cls.write_blob_values(labels)
+
+            changes = []
+            for label_name in labels:
+                if label_name not in exist_names:
+                    changes.append(('create', {'label_name': label_name, 'label_values': added_labels.get(label_name, [])}, None))
+                elif added_labels.get(label_name):
+                    changes.append(('add_values', {'label_name': label_name, 'label_values': added_labels[label_name]}, None))
+            if changes:
+                CatalogVersion.bump(LABELS_CATALOG)
+                CatalogChange.record_many(LABELS_CATALOG, changes)
+            db.session.commit()
+        except Exception as exc:
+            logger.critical(
+                msg=f"Can't commit changes to DB \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                extra={'tags': {}}
+            )
+            db.session.rollback()
+            return False
+
+        for label_name, label_values in added_labels.items():
+            typeahead_index.add_values(label_name, label_values)
+
+        return True
+
+    @classmethod
+    def track_last_seen(cls, labels):
+        if not normalized_storage() or not last_seen_tracker.enabled:
+            return
+
+        last_seen_tracker.record_values(labels)
+        if last_seen_tracker.due():
+            cls.flush_last_seen()
+
+    @classmethod
+    def flush_last_seen(cls, chunk_size=settings.LABELS_LAST_SEEN_CHUNK_SIZE):
+        """
+        Write last-seen timestamps of values collected since the previous flush, one statement and commit
+        per chunk_size values
+        """
+        labels = last_seen_tracker.pop_pending()
+        pending = [(label_name, label_value) for label_name, label_values in labels.items() for label_value in label_values]
+        for position in range(0, len(pending), chunk_size):
+            chunk = {}
+            for label_name, label_value in pending[position:position + chunk_size]:
+                chunk.setdefault(label_name, []).append(label_value)
+            cls.touch_values(chunk)
+
+    @classmethod
+    def touch_values(cls, labels):
+        try:
+            FilterLabelValues.touch_values(labels)
+            db.session.commit()
+        except Exception as exc:
+            logger.critical(
+                msg=f"Can't commit changes to DB \nException: {str(exc)} \nTraceback: {traceback.format_exc()}",
+                extra={'tags': {}}
+            )
+            db.session.rollback()
+
+    @classmethod
+    def trim_blob_values(cls, label_name, cap):
+        """
+        Keep only the last cap values of the label stored in blob mode and return removed values.
+        Row stays locked until the caller commits, so values appended by consumer meanwhile are not lost.
+        Catalog version is left to the caller to bump after commit
+        """
+        single_label = cls.query.with_entities(cls.label_values).filter_by(
+            label_name=label_name
+        ).with_for_update().one_or_none()
+        if not single_label:
+            return []
+
+        label_values = json.loads(single_label.label_values)
+        if len(label_values) <= cap:
+            return []
+
+        cls.query.filter_by(label_name=label_name).update(
+            {'label_values': json.dumps(label_values[-cap:]), 'last_update_ts': datetime.datetime.utcnow()},
+            synchronize_session=False
+        )
+        CatalogChange.record_label_values('remove_values', {label_name: label_values[:-cap]})
+
+        return label_values[:-cap]
+
+    @classmethod
+    def write_normalized_values(cls, new_labels):
+        """
+        Insert values of the labels and return {label_name: [label_values]} of values which were not stored yet
+        """
+        now = datetime.datetime.utcnow()
+        insert_ignore_rows(
+            cls,
+            [
+                {'label_name': label_name, 'label_values': '[]', 'create_ts': now, 'last_update_ts': now}
+                for label_name in new_labels
+            ]
+        )
+        added_labels = FilterLabelValues.missing_values(new_labels)
+        if added_labels:
+            logger.info(msg=f"Store values for labels - {added_labels}")
+            FilterLabelValues.add_values(added_labels)
+
+        return added_labels
+
+    @classmethod
+    def write_blob_values(cls, new_labels):
+        """
+        Append values to blobs of the labels and return {label_name: [label_values]} of appended values.
+        Missing labels are inserted empty first, then all rows are locked in label_name order until commit,
+        so concurrent writers of the same label neither lose values nor deadlock
+        """
+        now = datetime.datetime.utcnow()
+        insert_ignore_rows(
+            cls,
+            [
+                {'label_name': label_name, 'label_values': '[]', 'create_ts': now, 'last_update_ts': now}
+                for label_name in new_labels
+            ]
+        )
+        exist_labels = cls.query.with_entities(cls.label_name, cls.label_values).filter(
+            cls.label_name.in_(list(new_labels))
+        ).order_by(cls.label_name).with_for_update().all()
+        exist_values = {single_label.label_name: json.loads(single_label.label_values) for single_label in exist_labels}
+
+        rows = []
+        added_labels = {}
+        for label_name, label_values in new_labels.items():
+            exist_value = exist_values.get(label_name, [])
+            exist_keys = {value_key(single_value) for single_value in exist_value}
+            added_values = [label_value for label_value in label_values if value_key(label_value) not in exist_keys]
+            if not added_values:
+                continue
+            logger.info(msg=f"Update values for label - {label_name}. Values - {added_values}")
+            exist_value.extend(added_values)
+            added_labels[label_name] = added_values
+
+            rows.append({
+                'label_name': label_name,
+                'label_values': json.dumps(exist_value),
+                'create_ts': now,
+                'last_update_ts': now
+            })
+
+        upsert_rows(
+            cls,
+            rows,
+            index_elements=['label_name'],
+            update_columns=['label_values', 'last_update_ts']
+        )
+
+        return added_labels
+
+    @classmethod
+    def warm_up_cache(cls, owns_label=None):
+        """
+        Load known label values from DB into known-labels cache until it is full.
+        owns_label limits warm up to labels handled by current consumer worker
+        """
+        if not labels_cache.enabled:
+            return
+
+        for label_name, label_value in cls.iter_all_values(owns_label=owns_label):
+            if labels_cache.is_full():
+                break
+            labels_cache.add(label_name, label_value)
+
+        logger.info(msg=f"Known-labels cache has been warmed up. Stats - {labels_cache.stats()}")
+
+    @classmethod
+    def iter_all_values(cls, owns_label=None):
+        """
+        Yield (label_name, label_value) of all stored labels
+        """
+        if normalized_storage():
+            for label_name, label_value in FilterLabelValues.iter_values():
+                if owns_label and not owns_label(label_name):
+                    continue
+                yield label_name, label_value
+        else:
+            for single_label in cls.query.yield_per(100):
+                if owns_label and not owns_label(single_label.label_name):
+                    continue
+                for label_value in json.loads(single_label.label_values):
+                    yield single_label.label_name, label_value
+
+    @classmethod
+    def iter_label_names(cls, label_search=None, match='prefix', from_label=None, chunk_size=100):
+        """
+        Yield (label_id, label_name) ordered by label_name starting from from_label, loading chunk_size rows per query
+        """
+        query = cls.query.with_entities(cls.label_id, cls.label_name)
+        if label_search:
+            query = query.filter(cls.label_name.like(like_pattern(label_search, match), escape='\\'))
+
+        condition = None if from_label is None else cls.label_name >= from_label
+        while True:
+            chunk_query = query if condition is None else query.filter(condition)
+            rows = chunk_query.order_by(cls.label_name).limit(chunk_size).all()
+
+            for row in rows:
+                yield row
+
+            if len(rows) < chunk_size:
+                return
+            condition = cls.label_name > rows[-1].label_name
+
+    @classmethod
+    def iter_values_after(cls, label_name, position=None):
+        """
+        Yield (position, label_value) of the label after position.
+        Position is value_id for normalized storage and [label_value] for blob storage. Blob position is the value
+        itself, because compaction removes the oldest values and shifts indexes. If the value is gone, older values
+        are gone as well and the label is read from the start
+        """
+        if normalized_storage():
+            yield from FilterLabelValues.iter_label_values(label_name, after_value_id=position or 0)
+            return
+
+        row = cls.query.with_entities(cls.label_values).filter_by(label_name=label_name).one_or_none()
+        if row is None:
+            return
+
+        label_values = json.loads(row.label_values)
+        start = 0
+        if position is not None:
+            try:
+                start = label_values.index(position[0]) + 1
+            except ValueError:
+                start = 0
+        for label_value in label_values[start:]:
+            yield [label_value], label_value
+
+    @staticmethod
+    def value_like(value_search, match='prefix'):
+        """
+        Condition on JSON-encoded label_value of filter_label_values which is true at least for values
+        whose str() lower-cased matches value_search. None if it can't be expressed, for non-ASCII search
+        """
+        if not value_search.isascii():
+            return None
+
+        encoded_search = json.dumps(value_search)[1:-1].lower()
+        encoded_value = db.func.lower(FilterLabelValues.label_value)
+        if match == 'substring':
+            string_condition = encoded_value.like(like_pattern(encoded_search, match), escape='\\')
+        else:
+            string_condition = encoded_value.like('"' + like_pattern(encoded_search, match), escape='\\')
+
+        # Numbers, booleans, lists and dicts are encoded differently from their str(), they are checked by the caller
+        return db.or_(string_condition, db.not_(FilterLabelValues.label_value.like('"%')))
+
+    @classmethod
+    def iter_matching_values(cls, value_search, match='prefix', label_search=None, from_label=None, position=None,
+                             chunk_size=1000):
+        """
+        Yield (label_id, label_name, value_id, label_value) of normalized storage ordered by label_name and value_id,
+        starting after (from_label, position). Values are pre-filtered in DB by value_like, so the caller still
+        checks every value, but doesn't load values which can't match
+        """
+        query = db.session.query(
+            cls.label_id, cls.label_name, FilterLabelValues.value_id, FilterLabelValues.label_value
+        ).join(FilterLabelValues, FilterLabelValues.label_name == cls.label_name)
+        if label_search:
+            query = query.filter(cls.label_name.like(like_pattern(label_search, match), escape='\\'))
+        value_condition = cls.value_like(value_search, match)
+        if value_condition is not None:
+            query = query.filter(value_condition)
+
+        if from_label is None:
+            condition = None
+        else:
+            condition = db.or_(
+                cls.label_name > from_label,
+                db.and_(cls.label_name == from_label, FilterLabelValues.value_id > (position or 0))
+            )
+        while True:
+            chunk_query = query if condition is None else query.filter(condition)
+            rows = chunk_query.order_by(cls.label_name, FilterLabelValues.value_id).limit(chunk_size).all()
+
+            for row in rows:
+                yield row.label_id, row.label_name, row.value_id, json.loads(row.label_value)
+
+            if len(rows) < chunk_size:
+                return
+            condition = db.or_(
+                cls.label_name > rows[-1].label_name,
+                db.and_(cls.label_name == rows[-1].label_name, FilterLabelValues.value_id > rows[-1].value_id)
+            )
+
+    @classmethod
+    def label_names(cls):
+        return {row.label_name for row in cls.query.with_entities(cls.label_name)}
+
+    @classmethod
+    def changed_label_names(cls, since):
+        """
+        Return names of labels created or updated since the timestamp
+        """
+        rows = cls.query.with_entities(cls.label_name).filter(cls.last_update_ts >= since)
+        return [row.label_name for row in rows]
+
+    @classmethod
+    def iter_export(cls, chunk_size=1000):
+        """
+        Yield {label_name, label_values} of all labels ordered by label name.
+        Values of a big label are split into several items of chunk_size values
+        """
+        for row in cls.iter_label_names():
+            label_values = []
+            exported = False
+            for _, label_value in cls.iter_values_after(row.label_name):
+                label_values.append(label_value)
+                if len(label_values) >= chunk_size:
+                    yield {'label_name': row.label_name, 'label_values': label_values}
+                    label_values = []
+                    exported = True
+
+            if label_values or not exported:
+                yield {'label_name': row.label_name, 'label_values': label_values}
 
     @classmethod
     def obj_exist(cls, label_id):
         return cls.query.filter_by(label_id=label_id).one_or_none()
 
     def update_obj(self, data, label_id):
-        data['label_values'] = json.dumps(data['label_values'])
+        old_label_name = self.label_name
+        label_values = data['label_values']
+        if normalized_storage():
+            FilterLabelValues.replace_values(old_label_name, data.get('label_name', old_label_name), label_values)
+            data['label_values'] = json.dumps([])
+        else:
+            data['label_values'] = json.dumps(label_values)
+        data['last_update_ts'] = datetime.datetime.utcnow()
 
         self.query.filter_by(label_id=label_id).update(data)
+        CatalogVersion.bump(LABELS_CATALOG)
+        CatalogChange.record(
+            LABELS_CATALOG,
+            'update',
+            {'label_name': data.get('label_name', old_label_name), 'old_label_name': old_label_name, 'label_values': label_values}
+        )
 
         db.session.commit()
 
+        labels_cache.invalidate_label(old_label_name)
+        labels_cache.add_values(data.get('label_name', old_label_name), label_values)
+        typeahead_index.replace_label(old_label_name, data.get('label_name', old_label_name), label_values)
+
     def labels_info_dict(self):
         return {
             'label_id': self.label_id,
             'label_name': self.label_name,
-            'label_values': json.loads(self.label_values)
+            'label_values': self.values()
         }
 
     @classmethod
     def get_all_labels(cls):
         get_all_labels = cls.query.filter_by().all()
-        all_labels = [single_event.labels_info_dict() for single_event in get_all_labels]
+        if normalized_storage():
+            all_values = FilterLabelValues.get_all_values()
+            all_labels = [
+                {
+                    'label_id': single_event.label_id,
+                    'label_name': single_event.label_name,
+                    'label_values': all_values.get(single_event.label_name, [])
+                } for single_event in get_all_labels
+            ]
+        else:
+            all_labels = [single_event.labels_info_dict() for single_event in get_all_labels]
 
         return all_labels
 
@@ -102,9 +581,16 @@ class FilterLabels(db.Model):
             db.session.rollback()
 
     def delete_obj(self):
+        if normalized_storage():
+            FilterLabelValues.delete_label(self.label_name)
         db.session.delete(self)
+        CatalogVersion.bump(LABELS_CATALOG)
+        CatalogChange.record(LABELS_CATALOG, 'delete', {'label_name': self.label_name})
         db.session.commit()
 
+        labels_cache.invalidate_label(self.label_name)
+        typeahead_index.remove_label(self.label_name)
+
 
 class FilterLabelsSchema(Schema):
     label_id = fields.Int(dump_only=True)
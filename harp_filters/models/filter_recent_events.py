@@ -0,0 +1,51 @@
+from microservice_template_core import db
+import datetime
+from microservice_template_core.tools.logger import get_logger
+from harp_filters.models.source_snapshot import SourceSnapshot
+
+logger = get_logger()
+
+
+class FilterRecentEvents(SourceSnapshot, db.Model):
+    """
+    Snapshot of recent events buffer of every consumer process (source): zlib-compressed JSON list of event labels,
+    oldest first. Every source replaces its own row on every flush
+    """
+    __tablename__ = 'filter_recent_events'
+
+    snapshot_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    source = db.Column(db.VARCHAR(254), nullable=False, unique=True)
+    # Changes only when events of the source change, update_ts changes on every flush
+    version = db.Column(db.VARCHAR(64), nullable=False, unique=False)
+    events_count = db.Column(db.Integer, nullable=False, unique=False)
+    events = db.Column(db.LargeBinary(4294000000), nullable=False, unique=False)
+    update_ts = db.Column(db.TIMESTAMP, default=datetime.datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"{self.source}"
+
+    @classmethod
+    def replace_source(cls, source, version, events_count, events):
+        """
+        Replace row of the source. Commit is left to the caller
+        """
+        cls.replace_source_rows(source, [{'version': version, 'events_count': events_count, 'events': events}])
+
+    @classmethod
+    def source_versions(cls, updated_since):
+        """
+        Return {source: version} of fresh sources, without reading their events
+        """
+        rows = cls.query.with_entities(cls.source, cls.version).filter(cls.update_ts >= updated_since).all()
+        return {row.source: row.version for row in rows}
+
+    @classmethod
+    def source_events(cls, sources):
+        """
+        Return {source: (version, events)} of the sources
+        """
+        if not sources:
+            return {}
+
+        rows = cls.query.with_entities(cls.source, cls.version, cls.events).filter(cls.source.in_(sources)).all()
+        return {row.source: (row.version, row.events) for row in rows}
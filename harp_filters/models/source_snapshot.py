@@ -0,0 +1,40 @@
+from microservice_template_core import db
+import datetime
+
+
+class SourceSnapshot(object):
+    """
+    Mixin of tables where every consumer process (source) keeps its own rows and replaces them on every flush.
+    Model needs source and update_ts columns
+    """
+
+    @classmethod
+    def replace_source_rows(cls, source, rows):
+        """
+        Replace rows of the source, source and update_ts are set here. Commit is left to the caller
+        """
+        now = datetime.datetime.utcnow()
+        cls.query.filter_by(source=source).delete(synchronize_session=False)
+
+        for row in rows:
+            row['source'] = source
+            row['update_ts'] = now
+        if rows:
+            db.session.execute(cls.__table__.insert(), rows)
+
+    @classmethod
+    def touch_source(cls, source):
+        """
+        Mark unchanged rows of the source fresh. Return False if there are no rows. Commit is left to the caller
+        """
+        updated = cls.query.filter_by(source=source).update(
+            {cls.update_ts: datetime.datetime.utcnow()}, synchronize_session=False
+        )
+        return updated > 0
+
+    @classmethod
+    def delete_stale(cls, updated_before):
+        """
+        Remove rows of sources which stopped flushing. Commit is left to the caller
+        """
+        return cls.query.filter(cls.update_ts < updated_before).delete(synchronize_session=False)
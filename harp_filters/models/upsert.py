@@ -0,0 +1,54 @@
+from microservice_template_core import db
+from sqlalchemy import and_
+from sqlalchemy.dialects import mysql, postgresql
+
+
+def upsert_rows(model, rows, index_elements, update_columns):
+    """
+    Insert rows into model table or update update_columns of rows which already exist by index_elements.
+    Uses single multi-row statement for MySQL / MariaDB and PostgreSQL. Commit is left to the caller
+    """
+    if not rows:
+        return
+
+    table = model.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        stmt = mysql.insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in update_columns})
+        db.session.execute(stmt)
+    elif dialect == 'postgresql':
+        stmt = postgresql.insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: stmt.excluded[column] for column in update_columns}
+        )
+        db.session.execute(stmt)
+    else:
+        for row in rows:
+            where = and_(*[table.c[column] == row[column] for column in index_elements])
+            result = db.session.execute(
+                table.update().where(where).values({column: row[column] for column in update_columns})
+            )
+            if not result.rowcount:
+                db.session.execute(table.insert().values(row))
+
+
+def insert_ignore_rows(model, rows):
+    """
+    Insert rows into model table skipping rows which violate unique constraints and return number of inserted rows.
+    Commit is left to the caller
+    """
+    if not rows:
+        return 0
+
+    table = model.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        stmt = postgresql.insert(table).values(rows).on_conflict_do_nothing()
+    else:
+        stmt = table.insert().values(rows).prefix_with('IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite')
+
+    return db.session.execute(stmt).rowcount
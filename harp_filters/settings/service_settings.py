@@ -2,3 +2,174 @@ import os
 
 NOTIFICATIONS_DECORATED_TOPIC = os.getenv('NOTIFICATIONS_DECORATED_TOPIC', 'dev_collector-notifications-decorated')
 KAFKA_SERVERS = os.getenv('KAFKA_SERVERS', '127.0.0.1:9092')
+
+# Max number of (label_name, label_value) pairs kept in the consumer known-labels cache. 0 disables the cache
+LABELS_CACHE_MAX_SIZE = int(os.getenv('LABELS_CACHE_MAX_SIZE', 1000000))
+# Consumer drops values deleted or replaced by other processes from known-labels cache,
+# reading labels catalog changes every LABELS_CACHE_SYNC_SECONDS. 0 disables the sync
+LABELS_CACHE_SYNC_SECONDS = int(os.getenv('LABELS_CACHE_SYNC_SECONDS', 5))
+
+# Consumer mode: single - process messages one by one, batch - process messages in batches with one DB commit per batch,
+# pipeline - poll, decode, aggregation and DB writes run in separate threads joined by bounded queues,
+# write_behind - labels are written by size or time trigger and Kafka offsets are committed after the write
+CONSUMER_MODE = os.getenv('CONSUMER_MODE', 'single')
+CONSUMER_BATCH_SIZE = int(os.getenv('CONSUMER_BATCH_SIZE', 500))
+CONSUMER_BATCH_LINGER_MS = int(os.getenv('CONSUMER_BATCH_LINGER_MS', 200))
+# Max number of batches waiting in every queue between pipeline stages
+CONSUMER_PIPELINE_QUEUE_SIZE = int(os.getenv('CONSUMER_PIPELINE_QUEUE_SIZE', 20))
+
+# Labels storage mode: blob - all values of label in filter_labels.label_values JSON,
+# normalized - one row per (label_name, label_value) in filter_label_values
+LABELS_STORAGE_MODE = os.getenv('LABELS_STORAGE_MODE', 'blob')
+
+# Number of consumer worker processes. Every label is owned by one worker, so writes to the same label never contend
+CONSUMER_WORKERS = int(os.getenv('CONSUMER_WORKERS', 1))
+# Max number of routed label batches waiting for the owning worker
+CONSUMER_ROUTING_QUEUE_SIZE = int(os.getenv('CONSUMER_ROUTING_QUEUE_SIZE', 1000))
+# First port of per-worker Prometheus endpoints (worker N listens on port + N). 0 disables them,
+# metrics of all workers are reported by the main process anyway
+CONSUMER_WORKER_METRICS_PORT = int(os.getenv('CONSUMER_WORKER_METRICS_PORT', 0))
+
+# Default and max number of label values returned by one page of labels search
+LABELS_SEARCH_PAGE_SIZE = int(os.getenv('LABELS_SEARCH_PAGE_SIZE', 1000))
+LABELS_SEARCH_MAX_PAGE_SIZE = int(os.getenv('LABELS_SEARCH_MAX_PAGE_SIZE', 10000))
+
+# Typeahead index of label values is built in background on first lookup and follows labels catalog changes
+# every TYPEAHEAD_SYNC_SECONDS
+TYPEAHEAD_SYNC_SECONDS = int(os.getenv('TYPEAHEAD_SYNC_SECONDS', 5))
+TYPEAHEAD_DEFAULT_LIMIT = int(os.getenv('TYPEAHEAD_DEFAULT_LIMIT', 20))
+TYPEAHEAD_MAX_LIMIT = int(os.getenv('TYPEAHEAD_MAX_LIMIT', 1000))
+
+# Last-seen timestamps of label values are collected in memory and flushed to DB with this interval (normalized storage).
+# 0 disables last-seen tracking
+LABELS_LAST_SEEN_FLUSH_SECONDS = int(os.getenv('LABELS_LAST_SEEN_FLUSH_SECONDS', 60))
+LABELS_LAST_SEEN_MAX_PENDING = int(os.getenv('LABELS_LAST_SEEN_MAX_PENDING', 100000))
+# Last-seen timestamps are written with one statement and commit per this many values
+LABELS_LAST_SEEN_CHUNK_SIZE = int(os.getenv('LABELS_LAST_SEEN_CHUNK_SIZE', 1000))
+# Values not seen for this time are removed by compaction (normalized storage). 0 disables TTL
+LABELS_VALUE_TTL_SECONDS = int(os.getenv('LABELS_VALUE_TTL_SECONDS', 0))
+# Max values per label, least recently seen values are removed first. 0 - unlimited.
+# LABELS_VALUE_CAPS overrides it per label: "source=10000,alert_name=50000"
+LABELS_MAX_VALUES_PER_LABEL = int(os.getenv('LABELS_MAX_VALUES_PER_LABEL', 0))
+LABELS_VALUE_CAPS = {
+    label_name.strip(): int(cap)
+    for label_name, cap in (item.split('=') for item in os.getenv('LABELS_VALUE_CAPS', '').split(',') if item)
+}
+# Compaction of stale values runs in consumer with this interval and removes values in chunks. 0 disables compaction
+LABELS_COMPACTION_INTERVAL_SECONDS = int(os.getenv('LABELS_COMPACTION_INTERVAL_SECONDS', 3600))
+LABELS_COMPACTION_CHUNK_SIZE = int(os.getenv('LABELS_COMPACTION_CHUNK_SIZE', 1000))
+LABELS_COMPACTION_PAUSE_SECONDS = float(os.getenv('LABELS_COMPACTION_PAUSE_SECONDS', 0.1))
+
+# Frequency sketch of every label keeps LABELS_FREQUENCY_CAPACITY counters, for at most LABELS_FREQUENCY_MAX_LABELS labels.
+# An event counts half after LABELS_FREQUENCY_HALF_LIFE_SECONDS (0 - no decay). Sketches are fed with every
+# LABELS_FREQUENCY_SAMPLE_EVERY-th event. Top LABELS_FREQUENCY_TOP_K values per label are written to DB
+# every LABELS_FREQUENCY_FLUSH_SECONDS. LABELS_FREQUENCY_CAPACITY=0 disables sketches
+LABELS_FREQUENCY_CAPACITY = int(os.getenv('LABELS_FREQUENCY_CAPACITY', 50))
+LABELS_FREQUENCY_MAX_LABELS = int(os.getenv('LABELS_FREQUENCY_MAX_LABELS', 1000))
+LABELS_FREQUENCY_HALF_LIFE_SECONDS = int(os.getenv('LABELS_FREQUENCY_HALF_LIFE_SECONDS', 3600))
+LABELS_FREQUENCY_SAMPLE_EVERY = int(os.getenv('LABELS_FREQUENCY_SAMPLE_EVERY', 10))
+LABELS_FREQUENCY_TOP_K = int(os.getenv('LABELS_FREQUENCY_TOP_K', 20))
+LABELS_FREQUENCY_FLUSH_SECONDS = int(os.getenv('LABELS_FREQUENCY_FLUSH_SECONDS', 60))
+
+# Number of distinct values of every label is estimated by consumer with HyperLogLog of 2 ** LABELS_CARDINALITY_PRECISION
+# registers (max 14), for at most LABELS_CARDINALITY_MAX_LABELS labels. LABELS_CARDINALITY_PRECISION=0 disables estimation
+LABELS_CARDINALITY_PRECISION = min(int(os.getenv('LABELS_CARDINALITY_PRECISION', 12)), 14)
+LABELS_CARDINALITY_MAX_LABELS = int(os.getenv('LABELS_CARDINALITY_MAX_LABELS', 1000))
+# New values of labels with more distinct values than the limit are not aggregated (drop)
+# or only LABELS_CARDINALITY_SAMPLE_RATE of them are aggregated (sample). 0 disables the limit.
+# Labels of LABELS_CARDINALITY_ALLOW are always aggregated
+LABELS_CARDINALITY_LIMIT = int(os.getenv('LABELS_CARDINALITY_LIMIT', 100000))
+LABELS_CARDINALITY_ACTION = os.getenv('LABELS_CARDINALITY_ACTION', 'drop')
+LABELS_CARDINALITY_SAMPLE_RATE = float(os.getenv('LABELS_CARDINALITY_SAMPLE_RATE', 0.01))
+LABELS_CARDINALITY_ALLOW = {
+    label_name.strip()
+    for label_name in os.getenv('LABELS_CARDINALITY_ALLOW', 'alert_name,source,monitoring_system').split(',') if label_name.strip()
+}
+LABELS_CARDINALITY_FLUSH_SECONDS = int(os.getenv('LABELS_CARDINALITY_FLUSH_SECONDS', 60))
+# Estimates count values seen in the last LABELS_CARDINALITY_WINDOWS windows of LABELS_CARDINALITY_WINDOW_SECONDS,
+# so a label whose values stopped growing falls below the limit again and its values are aggregated
+LABELS_CARDINALITY_WINDOW_SECONDS = int(os.getenv('LABELS_CARDINALITY_WINDOW_SECONDS', 21600))
+LABELS_CARDINALITY_WINDOWS = max(int(os.getenv('LABELS_CARDINALITY_WINDOWS', 4)), 1)
+
+# Catalog versions changed by consumer writes are bumped after commit by a background thread with this interval,
+# so consumer transactions don't contend on the version row
+CATALOG_VERSION_BUMP_MS = int(os.getenv('CATALOG_VERSION_BUMP_MS', 200))
+
+# Default and max number of changes returned by one request of catalog changes API
+CATALOG_CHANGES_PAGE_SIZE = int(os.getenv('CATALOG_CHANGES_PAGE_SIZE', 1000))
+CATALOG_CHANGES_MAX_PAGE_SIZE = int(os.getenv('CATALOG_CHANGES_MAX_PAGE_SIZE', 10000))
+# Changes are returned only after this delay, so a transaction committed out of change_id order is not skipped
+CATALOG_CHANGES_SETTLE_SECONDS = int(os.getenv('CATALOG_CHANGES_SETTLE_SECONDS', 2))
+# Changes older than this are removed by labels compaction. 0 keeps all changes
+CATALOG_CHANGES_RETENTION_SECONDS = int(os.getenv('CATALOG_CHANGES_RETENTION_SECONDS', 7 * 24 * 3600))
+
+# Catalog changes stream polls the change log once per API process with this interval while streams are open.
+# A stream with more than CATALOG_STREAM_QUEUE_SIZE undelivered changes is told to reload catalogs
+CATALOG_STREAM_POLL_MS = int(os.getenv('CATALOG_STREAM_POLL_MS', 1000))
+CATALOG_STREAM_QUEUE_SIZE = int(os.getenv('CATALOG_STREAM_QUEUE_SIZE', 1000))
+CATALOG_STREAM_HEARTBEAT_SECONDS = int(os.getenv('CATALOG_STREAM_HEARTBEAT_SECONDS', 15))
+CATALOG_STREAM_MAX_CLIENTS = int(os.getenv('CATALOG_STREAM_MAX_CLIENTS', 1000))
+
+# Max number of serialized /all responses kept by API process. Filters responses are cached per user
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 256))
+
+# Max number of events in one request of filters matching API
+FILTER_MATCH_MAX_EVENTS = int(os.getenv('FILTER_MATCH_MAX_EVENTS', 1000))
+
+# Every consumer process keeps the most recent decorated notifications, at most RECENT_EVENTS_MAX_EVENTS events and
+# RECENT_EVENTS_MAX_BYTES bytes of encoded labels, to preview draft filters. Buffer is fed with every
+# RECENT_EVENTS_SAMPLE_EVERY-th event and written to DB every RECENT_EVENTS_FLUSH_SECONDS. 0 events disables the buffer
+RECENT_EVENTS_MAX_EVENTS = int(os.getenv('RECENT_EVENTS_MAX_EVENTS', 10000))
+RECENT_EVENTS_MAX_BYTES = int(os.getenv('RECENT_EVENTS_MAX_BYTES', 8 * 1024 * 1024))
+RECENT_EVENTS_SAMPLE_EVERY = int(os.getenv('RECENT_EVENTS_SAMPLE_EVERY', 1))
+RECENT_EVENTS_FLUSH_SECONDS = int(os.getenv('RECENT_EVENTS_FLUSH_SECONDS', 10))
+# Default and max number of matched events returned by filter preview API
+FILTER_PREVIEW_SAMPLES = int(os.getenv('FILTER_PREVIEW_SAMPLES', 10))
+FILTER_PREVIEW_MAX_SAMPLES = int(os.getenv('FILTER_PREVIEW_MAX_SAMPLES', 100))
+# Filter preview stops scanning recent events after this time and returns partial counts with truncated flag
+FILTER_PREVIEW_MAX_MS = int(os.getenv('FILTER_PREVIEW_MAX_MS', 500))
+
+# Max number of per-event log records of consumer per second, the rest are dropped and counted. 0 disables them
+CONSUMER_EVENT_LOG_PER_SECOND = int(os.getenv('CONSUMER_EVENT_LOG_PER_SECOND', 1))
+
+# Verified JWT claims are cached by API process until token expiration, but not longer than TOKEN_CACHE_TTL_SECONDS.
+# TOKEN_CACHE_MAX_SIZE=0 disables the cache
+TOKEN_CACHE_MAX_SIZE = int(os.getenv('TOKEN_CACHE_MAX_SIZE', 10000))
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv('TOKEN_CACHE_TTL_SECONDS', 300))
+
+# Number of label values merged per commit by bulk import and exported per NDJSON line
+LABELS_BULK_CHUNK_SIZE = int(os.getenv('LABELS_BULK_CHUNK_SIZE', 1000))
+
+# Known-labels cache is written to this file every LABELS_SNAPSHOT_INTERVAL_SECONDS and loaded on consumer start.
+# Consumer pool workers add their number to the path. Empty path disables snapshots
+LABELS_SNAPSHOT_PATH = os.getenv('LABELS_SNAPSHOT_PATH', '')
+LABELS_SNAPSHOT_INTERVAL_SECONDS = int(os.getenv('LABELS_SNAPSHOT_INTERVAL_SECONDS', 300))
+
+# Write-behind mode flushes labels once this many unique values are waiting or the oldest one waits this long.
+# Failed flush is retried every WRITE_BEHIND_RETRY_SECONDS without consuming new messages
+WRITE_BEHIND_MAX_DIRTY = int(os.getenv('WRITE_BEHIND_MAX_DIRTY', 10000))
+WRITE_BEHIND_FLUSH_MS = int(os.getenv('WRITE_BEHIND_FLUSH_MS', 1000))
+WRITE_BEHIND_RETRY_SECONDS = int(os.getenv('WRITE_BEHIND_RETRY_SECONDS', 5))
+
+# Messages which are not valid JSON or miss fields of decorated notification are produced to this topic unchanged.
+# Empty topic - invalid messages are only counted
+CONSUMER_DEAD_LETTER_TOPIC = os.getenv('CONSUMER_DEAD_LETTER_TOPIC', '')
+# Max wait for delivery of dead-letter messages before offsets are committed, undelivered ones are logged
+CONSUMER_DEAD_LETTER_FLUSH_SECONDS = int(os.getenv('CONSUMER_DEAD_LETTER_FLUSH_SECONDS', 10))
+
+# Run mode: api - API only, consumer - Kafka consumer only, combined - both in one process. Overridden by --mode
+RUN_MODE = os.getenv('RUN_MODE', 'combined')
+# API mode is served by gunicorn with API_WORKERS processes of API_THREADS threads
+API_WORKERS = int(os.getenv('API_WORKERS', 4))
+API_THREADS = int(os.getenv('API_THREADS', 4))
+API_TIMEOUT_SECONDS = int(os.getenv('API_TIMEOUT_SECONDS', 60))
+# gunicorn worker class. gevent serves open catalog streams as greenlets, with gthread every stream holds a thread
+API_WORKER_CLASS = os.getenv('API_WORKER_CLASS', 'gevent')
+# Max simultaneous connections of a gevent worker, open catalog streams included
+API_WORKER_CONNECTIONS = int(os.getenv('API_WORKER_CONNECTIONS', 1000))
+# With sync and gthread workers catalog streams of a worker are capped at API_THREADS - API_STREAM_FREE_THREADS,
+# so open streams never take the threads of other requests
+API_STREAM_FREE_THREADS = int(os.getenv('API_STREAM_FREE_THREADS', 2))
+# Directory of Prometheus metric files shared by API or consumer worker processes, so /metrics of any process
+# reports all of them. Used when API_WORKERS or CONSUMER_WORKERS is above 1 and cleared on start
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', '/tmp/harp-filters-metrics')
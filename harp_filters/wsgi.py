@@ -0,0 +1,8 @@
+"""
+WSGI entry point of API-only deployment for external servers, e.g.
+
+    gunicorn --workers 4 --bind 0.0.0.0:8081 harp_filters.wsgi:app
+"""
+from harp_filters.app import init_flask
+
+app = init_flask().app
@@ -23,7 +23,9 @@ setup(
     tests_require=tests_require,
     entry_points={
         'console_scripts': [
-            f'{SERVICE_NAME} = {SERVICE_NAME_NORMALIZED}.app:main',
+            f'{SERVICE_NAME} = {SERVICE_NAME_NORMALIZED}.main:main',
+            f'{SERVICE_NAME}-migrate-labels = {SERVICE_NAME_NORMALIZED}.migrations.normalize_labels:main',
+            f'{SERVICE_NAME}-migrate-filter-indexes = {SERVICE_NAME_NORMALIZED}.migrations.filter_config_indexes:main',
         ]
     },
     zip_safe=False,
@@ -0,0 +1,15 @@
+import pytest
+from microservice_template_core.settings import DbConfig
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """
+    Flask app bound to a new SQLite DB, tables are created by the service template
+    """
+    DbConfig.SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path_factory.mktemp('db') / 'harp_filters.db'}"
+    from harp_filters.app import init_flask
+
+    app = init_flask().app
+    with app.app_context():
+        yield app
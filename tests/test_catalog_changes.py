@@ -0,0 +1,112 @@
+import datetime
+import pytest
+from microservice_template_core import db
+import harp_filters.settings as settings
+from harp_filters.logic.catalog_changes import settled_change_id, catalog_changes
+from harp_filters.models.catalog_change import CatalogChange, CHANGES_TRIMMED
+from harp_filters.models.catalog_version import CatalogVersion, LABELS_CATALOG, FILTERS_CATALOG
+
+
+@pytest.fixture
+def changes(app):
+    CatalogChange.query.delete(synchronize_session=False)
+    CatalogVersion.set_version(CHANGES_TRIMMED, 0)
+    db.session.commit()
+
+
+def add_change(seconds_ago, catalog=LABELS_CATALOG, label_name='env'):
+    created = CatalogChange.db_now() - datetime.timedelta(seconds=seconds_ago)
+    change = CatalogChange(
+        catalog=catalog, operation='add_values', payload=f'{{"label_name": "{label_name}", "label_values": ["x"]}}',
+        create_ts=created
+    )
+    db.session.add(change)
+    db.session.commit()
+
+    return change.change_id
+
+
+def age_change(change_id, seconds_ago):
+    CatalogChange.query.filter_by(change_id=change_id).update(
+        {'create_ts': CatalogChange.db_now() - datetime.timedelta(seconds=seconds_ago)}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def test_settled_change_id_is_zero_without_changes(changes):
+    assert settled_change_id() == 0
+
+
+def test_settled_change_id_holds_back_changes_inside_window(changes):
+    settled = add_change(seconds_ago=60)
+    fresh = add_change(seconds_ago=0)
+
+    assert settled_change_id(settle_seconds=30) == settled
+    assert settled_change_id(settle_seconds=0) == fresh
+
+
+def test_changes_inside_window_are_returned_once_settled(changes):
+    settled = add_change(seconds_ago=60)
+    fresh = add_change(seconds_ago=0)
+
+    result = catalog_changes(LABELS_CATALOG, since=0)
+    assert [change['change_id'] for change in result['changes']] == [settled]
+    assert result['last_change_id'] == settled
+
+    age_change(fresh, seconds_ago=settings.CATALOG_CHANGES_SETTLE_SECONDS + 1)
+    result = catalog_changes(LABELS_CATALOG, since=result['last_change_id'])
+    assert [change['change_id'] for change in result['changes']] == [fresh]
+    assert result['last_change_id'] == fresh
+
+
+def test_last_change_id_moves_past_changes_of_other_catalog(changes):
+    labels_change = add_change(seconds_ago=60)
+    filters_change = add_change(seconds_ago=60, catalog=FILTERS_CATALOG)
+
+    result = catalog_changes(LABELS_CATALOG, since=labels_change)
+
+    assert result['changes'] == []
+    assert result['last_change_id'] == filters_change
+
+
+def test_page_ends_at_last_returned_change(changes):
+    change_ids = [add_change(seconds_ago=60, label_name=f"label-{i}") for i in range(5)]
+
+    result = catalog_changes(LABELS_CATALOG, since=0, limit=2)
+
+    assert [change['change_id'] for change in result['changes']] == change_ids[:2]
+    assert result['more']
+    assert result['last_change_id'] == change_ids[1]
+
+
+def test_client_behind_trimmed_changes_is_reset(changes):
+    add_change(seconds_ago=3600)
+    kept = add_change(seconds_ago=60)
+    CatalogChange.trim(created_before=datetime.datetime.utcnow() - datetime.timedelta(seconds=600))
+
+    result = catalog_changes(LABELS_CATALOG, since=0)
+    assert result['reset']
+    assert result['changes'] == []
+    assert result['last_change_id'] == kept
+
+    result = catalog_changes(LABELS_CATALOG, since=CatalogChange.trimmed_change_id())
+    assert not result['reset']
+    assert [change['change_id'] for change in result['changes']] == [kept]
+
+
+def test_settled_change_id_is_not_below_trimmed_changes(changes):
+    trimmed = add_change(seconds_ago=3600)
+    CatalogChange.trim(created_before=datetime.datetime.utcnow() - datetime.timedelta(seconds=600))
+    add_change(seconds_ago=0)
+
+    assert settled_change_id(settle_seconds=30) == trimmed
+
+
+def test_newest_change_is_not_trimmed(changes):
+    add_change(seconds_ago=3600)
+    newest = add_change(seconds_ago=3600)
+
+    CatalogChange.trim(created_before=datetime.datetime.utcnow())
+
+    assert CatalogChange.trimmed_change_id() == newest - 1
+    assert add_change(seconds_ago=0) == newest + 1
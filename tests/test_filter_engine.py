@@ -0,0 +1,81 @@
+import datetime
+import pytest
+from harp_filters.logic import filter_engine as filter_engine_module
+from harp_filters.logic.filter_engine import FilterEngine, FilterIndex, CompiledFilter
+from harp_filters.models.catalog_change import CatalogChange
+from harp_filters.models.filter_config import FilterConfig
+
+
+def compiled(filter_id, filter_config, filter_status='public', created_by='alice'):
+    return CompiledFilter(filter_id, filter_status, created_by, None, filter_config)
+
+
+def index_state(snapshot):
+    return snapshot.filters.keys(), snapshot.index, snapshot.unindexed, snapshot.public_ids, snapshot.private_ids
+
+
+def test_updated_index_equals_rebuilt_index():
+    filters = {
+        1: compiled(1, '[{"tag": "dc", "value": "FA0"}]'),
+        2: compiled(2, '[{"tag": "dc", "value": ["FA0", "FA1"]}]', filter_status='private'),
+        3: compiled(3, '[{"tag": "source", "condition": "contains", "value": "db"}]'),
+    }
+    changed = {
+        1: None,
+        2: compiled(2, '[{"tag": "dc", "value": "FA1"}]'),
+        4: compiled(4, '[{"tag": "env", "value": "prod"}]', filter_status='private', created_by='bob'),
+    }
+    snapshot = FilterIndex(1, filters, change_id=10)
+
+    updated = snapshot.updated(2, 11, changed)
+
+    expected = {filter_id: filter_obj for filter_id, filter_obj in {**filters, **changed}.items() if filter_obj}
+    assert index_state(updated) == index_state(FilterIndex(2, expected))
+    assert (updated.version, updated.change_id) == (2, 11)
+    assert snapshot.index[('dc', 'FA0')] == {1, 2}
+
+
+@pytest.fixture
+def engine(app, monkeypatch):
+    # Changes are applied as soon as they are committed, without the settle window
+    monkeypatch.setattr(filter_engine_module, 'settled_change_id', lambda: CatalogChange.last_change_id())
+    engine = FilterEngine(page_size=2)
+    engine.sync()
+
+    return engine
+
+
+def create_filter(name, filter_config, filter_status='public'):
+    return FilterConfig.create_filter({
+        'filter_name': name, 'filter_config': filter_config, 'columns': [], 'grouping': [],
+        'filter_status': filter_status, 'created_by': 'alice'
+    })
+
+
+def test_filter_edits_are_applied_without_rebuild(engine, monkeypatch):
+    monkeypatch.setattr(FilterConfig, 'get_match_info', lambda: pytest.fail('Filters were re-read from DB'))
+    prod = create_filter('engine-prod', [{'tag': 'env', 'value': 'prod'}])
+    mine = create_filter('engine-mine', [{'tag': 'env', 'value': 'prod'}], filter_status='private')
+    stage = create_filter('engine-stage', [{'tag': 'env', 'value': 'stage'}])
+    event = {'env': 'prod'}
+
+    assert engine.match_events([event], 'alice') == [[str(prod.filter_id), str(mine.filter_id)]]
+    assert engine.match_events([event], 'bob') == [[str(prod.filter_id)]]
+
+    stage.update_obj({'filter_config': [{'tag': 'env', 'value': 'prod'}]}, filter_id=stage.filter_id)
+    prod.delete_obj()
+
+    assert engine.match_events([event], 'bob') == [[str(stage.filter_id)]]
+    assert engine.snapshot.version is not None
+
+
+def test_index_is_rebuilt_when_changes_were_trimmed(engine, monkeypatch):
+    dev = create_filter('engine-dev', [{'tag': 'env', 'value': 'dev'}])
+    create_filter('engine-qa', [{'tag': 'env', 'value': 'qa'}])
+    CatalogChange.trim(created_before=datetime.datetime.utcnow() + datetime.timedelta(seconds=1))
+    rebuilds = []
+    get_match_info = FilterConfig.get_match_info
+    monkeypatch.setattr(FilterConfig, 'get_match_info', lambda: rebuilds.append(True) or get_match_info())
+
+    assert engine.match_events([{'env': 'dev'}], 'bob') == [[str(dev.filter_id)]]
+    assert rebuilds
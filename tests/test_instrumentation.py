@@ -0,0 +1,39 @@
+import threading
+from microservice_template_core import db
+from harp_filters.metrics.instrumentation import QueryComponent, tag_api_queries
+from harp_filters.metrics.service_monitoring import Prom
+
+
+def queries(component):
+    return Prom.DB_QUERIES.labels(component=component)._value.get()
+
+
+def run_query(tag=None):
+    def target():
+        if tag:
+            tag()
+        db.session.execute('SELECT 1')
+        db.session.remove()
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+
+
+def test_queries_are_counted_by_process_run_mode(app):
+    api, consumer = queries('api'), queries('consumer')
+    QueryComponent.process = 'api'
+    try:
+        run_query()
+    finally:
+        QueryComponent.process = 'consumer'
+
+    assert (queries('api') - api, queries('consumer') - consumer) == (1, 0)
+
+
+def test_api_thread_of_combined_mode_is_counted_as_api(app):
+    api, consumer = queries('api'), queries('consumer')
+    run_query(tag=tag_api_queries)
+    run_query()
+
+    assert (queries('api') - api, queries('consumer') - consumer) == (1, 1)
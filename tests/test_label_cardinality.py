@@ -0,0 +1,132 @@
+import math
+import pytest
+from harp_filters.logic.label_cardinality import (
+    HyperLogLog, WindowedHyperLogLog, LabelCardinality, POWERS, value_hash
+)
+
+PRECISION = 12
+
+
+def hashes(count, prefix='v'):
+    return [value_hash(f"{prefix}{i}") for i in range(count)]
+
+
+def test_rank_is_leading_zeros_of_rest_bits_plus_one():
+    sketch = HyperLogLog(4)
+    rest_bits = 64 - 4
+
+    sketch.add_hashes([(3 << rest_bits) | (1 << (rest_bits - 1))])
+    sketch.add_hashes([(5 << rest_bits) | 1])
+    sketch.add_hashes([7 << rest_bits])
+
+    assert sketch.registers[3] == 1
+    assert sketch.registers[5] == rest_bits
+    # All rest bits are zero
+    assert sketch.registers[7] == rest_bits + 1
+
+
+def test_register_keeps_max_rank_and_reports_changes():
+    sketch = HyperLogLog(4)
+    rest_bits = 64 - 4
+
+    assert sketch.add_hashes([(2 << rest_bits) | 1])
+    assert not sketch.add_hashes([(2 << rest_bits) | (1 << (rest_bits - 1))])
+    assert sketch.registers[2] == rest_bits
+
+
+def test_incremental_sums_match_recount():
+    sketch = HyperLogLog(PRECISION)
+    sketch.add_hashes(hashes(5000))
+    inverse_sum, zeros = sketch.inverse_sum, sketch.zeros
+
+    sketch.recount()
+
+    assert inverse_sum == pytest.approx(sketch.inverse_sum)
+    assert zeros == sketch.zeros == sum(1 for rank in sketch.registers if rank == 0)
+    assert sketch.inverse_sum == pytest.approx(sum(POWERS[rank] for rank in sketch.registers))
+
+
+def test_empty_sketch_estimates_zero():
+    assert HyperLogLog(PRECISION).estimate() == 0
+
+
+@pytest.mark.parametrize('count', [10, 1000])
+def test_linear_counting_for_small_cardinalities(count):
+    sketch = HyperLogLog(PRECISION)
+    sketch.add_hashes(hashes(count))
+
+    assert sketch.estimate() == pytest.approx(count, rel=0.02, abs=1)
+
+
+@pytest.mark.parametrize('count', [20000, 200000])
+def test_estimate_is_within_error_bound(count):
+    sketch = HyperLogLog(PRECISION)
+    sketch.add_hashes(hashes(count))
+    standard_error = 1.04 / math.sqrt(2 ** PRECISION)
+
+    assert sketch.estimate() == pytest.approx(count, rel=4 * standard_error)
+
+
+def test_duplicates_do_not_change_estimate():
+    sketch = HyperLogLog(PRECISION)
+    sketch.add_hashes(hashes(3000))
+    estimate = sketch.estimate()
+
+    assert not sketch.add_hashes(hashes(3000))
+    assert sketch.estimate() == estimate
+
+
+def test_merge_estimates_union():
+    first, second, union = HyperLogLog(PRECISION), HyperLogLog(PRECISION), HyperLogLog(PRECISION)
+    first.add_hashes(hashes(30000, prefix='a'))
+    second.add_hashes(hashes(30000, prefix='b'))
+    union.add_hashes(hashes(30000, prefix='a') + hashes(30000, prefix='b'))
+
+    first.merge(second.registers)
+
+    assert first.registers == union.registers
+    assert first.estimate() == pytest.approx(union.estimate())
+
+
+def test_windowed_sketch_forgets_rotated_out_windows():
+    sketch = WindowedHyperLogLog(PRECISION, windows=2)
+    sketch.add_hashes(hashes(5000, prefix='old'))
+
+    assert sketch.rotate()
+    sketch.add_hashes(hashes(100, prefix='new'))
+    assert sketch.estimate() == pytest.approx(5100, rel=0.05)
+
+    assert sketch.rotate()
+    assert sketch.estimate() == pytest.approx(100, rel=0.05)
+
+    assert not sketch.rotate()
+    assert sketch.estimate() == 0
+
+
+def test_limited_label_is_aggregated_again_after_rotations():
+    cardinality = LabelCardinality(
+        precision=PRECISION, max_labels=10, limit=1000, action='drop', sample_rate=0.01, windows=2, window_seconds=3600
+    )
+    cardinality.select({'request_id': [f"r{i}" for i in range(3000)]})
+    assert 'request_id' in cardinality.limited
+    assert cardinality.select({'request_id': ['r-new']}) == {}
+
+    for _ in range(2):
+        cardinality.rotate_at = 0
+        selected = cardinality.select({'request_id': ['r-latest']})
+
+    assert 'request_id' not in cardinality.limited
+    assert selected == {'request_id': ['r-latest']}
+
+
+def test_merged_estimate_of_all_consumers_limits_label():
+    cardinality = LabelCardinality(
+        precision=PRECISION, max_labels=10, limit=1000, action='drop', sample_rate=0.01, windows=2, window_seconds=3600
+    )
+    cardinality.select({'request_id': ['r1', 'r2']})
+
+    cardinality.apply_shared({'request_id': 5000})
+    assert cardinality.select({'request_id': ['r3']}) == {}
+
+    cardinality.apply_shared({'request_id': 10})
+    assert cardinality.select({'request_id': ['r4']}) == {'request_id': ['r4']}
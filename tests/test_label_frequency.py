@@ -0,0 +1,77 @@
+import collections
+import random
+import pytest
+from harp_filters.logic.label_frequency import SpaceSaving, LabelFrequency
+
+
+def test_counts_are_exact_below_capacity():
+    sketch = SpaceSaving(capacity=3)
+    for key in ['a', 'b', 'a', 'c', 'a', 'b']:
+        sketch.add(key, key, 1.0)
+
+    assert [(count, error, value) for count, error, value in sketch.top(3)] == [
+        (3.0, 0.0, 'a'), (2.0, 0.0, 'b'), (1.0, 0.0, 'c')
+    ]
+
+
+def test_new_value_replaces_smallest_counter_and_inherits_its_count():
+    sketch = SpaceSaving(capacity=2)
+    for key in ['a', 'a', 'a', 'b']:
+        sketch.add(key, key, 1.0)
+
+    sketch.add('c', 'c', 1.0)
+
+    assert set(sketch.counters) == {'a', 'c'}
+    assert sketch.counters['c'] == [2.0, 1.0, 'c']
+
+
+def test_outdated_heap_entry_is_pushed_back_with_current_count():
+    sketch = SpaceSaving(capacity=2)
+    sketch.add('a', 'a', 1.0)
+    sketch.add('b', 'b', 1.0)
+    # Increments don't touch the heap, entry of a still has count 1
+    for _ in range(5):
+        sketch.counters['a'][0] += 1.0
+
+    sketch.add('c', 'c', 1.0)
+
+    assert set(sketch.counters) == {'a', 'c'}
+    assert sketch.counters['a'][0] == 6.0
+    assert sorted(count for count, _, _ in sketch.heap) == [2.0, 6.0]
+
+
+def test_heavy_hitters_are_kept_with_bounded_error():
+    rng = random.Random(7)
+    stream = [f"v{min(int(rng.paretovariate(1.2)), 5000)}" for _ in range(20000)]
+    exact = collections.Counter(stream)
+    capacity = 50
+    sketch = SpaceSaving(capacity=capacity)
+    for key in stream:
+        sketch.add(key, key, 1.0)
+
+    assert len(sketch.counters) == capacity
+    for key, (count, error, _) in sketch.counters.items():
+        assert count - error <= exact[key] <= count
+        assert error <= len(stream) / capacity
+    for key, frequency in exact.items():
+        if frequency > len(stream) / capacity:
+            assert key in sketch.counters
+
+
+def test_scale_keeps_heap_consistent():
+    sketch = SpaceSaving(capacity=2)
+    sketch.add('a', 'a', 4.0)
+    sketch.add('b', 'b', 2.0)
+
+    sketch.scale(0.5)
+    sketch.add('c', 'c', 1.0)
+
+    assert set(sketch.counters) == {'a', 'c'}
+    assert sketch.counters['c'] == [2.0, 1.0, 'c']
+
+
+def test_top_values_of_sampled_events_are_weighted():
+    frequency = LabelFrequency(capacity=10, max_labels=10, half_life_seconds=0, sample_every=2)
+    frequency.record_events([{'dc': 'FA0'}, {'dc': 'FA1'}, {'dc': 'FA0'}, {'dc': 'FA1'}])
+
+    assert frequency.top(5) == {'dc': [('FA0', pytest.approx(4.0), 0.0)]}
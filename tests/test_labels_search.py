@@ -0,0 +1,110 @@
+import pytest
+from microservice_template_core import db
+from harp_filters.logic.labels_search import LabelsSearch, encode_cursor, decode_cursor
+from harp_filters.models.filter_labels import FilterLabels, normalized_storage
+from harp_filters.models.filter_label_values import FilterLabelValues
+
+LABELS = {
+    'page-a': ['a0', 'a1', 'a2', 'a3'],
+    'page-b': [],
+    'page-c': ['c0'],
+    'page-d': ['d0', 'd1', 'd2', 'd3', 'd4'],
+}
+
+
+@pytest.fixture(scope='module')
+def labels(app):
+    for label_name, label_values in LABELS.items():
+        FilterLabels.create_label({'label_name': label_name, 'label_values': label_values})
+
+    return LABELS
+
+
+def pages(limit, **search):
+    cursor = None
+    while True:
+        page = LabelsSearch(label_search='page-', cursor=cursor, limit=limit, **search)
+        yield list(page), page.next_cursor
+        cursor = page.next_cursor
+        if cursor is None:
+            return
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor('page-a', 3)) == ('page-a', 3)
+    assert decode_cursor(encode_cursor('page-a', None)) == ('page-a', None)
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64 !', encode_cursor('page-a', 'x').replace('=', ''), 'WzEsMl0=', 'eyJhIjoxfQ=='
+])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize('limit', [1, 3, 4, 100])
+def test_pages_return_every_value_once_in_order(labels, limit):
+    returned = []
+    for page, next_cursor in pages(limit):
+        values = [label_value for item in page for label_value in item['label_values']]
+        assert len(values) <= limit
+        if next_cursor is not None:
+            assert len(values) == limit
+        returned.extend((item['label_name'], label_value) for item in page for label_value in item['label_values'])
+
+    assert returned == [(label_name, label_value) for label_name in sorted(labels) for label_value in labels[label_name]]
+
+
+def test_label_without_values_is_returned(labels):
+    label_names = [item['label_name'] for page, _ in pages(100) for item in page]
+
+    assert 'page-b' in label_names
+
+
+def test_value_search_skips_non_matching_values(labels):
+    returned = [
+        (item['label_name'], label_value)
+        for page, _ in pages(2, value_search='D') for item in page for label_value in item['label_values']
+    ]
+
+    assert returned == [('page-d', f"d{i}") for i in range(5)]
+
+
+def test_cursor_is_stable_when_values_are_added_behind_it(labels):
+    first_page = LabelsSearch(label_search='page-', limit=2)
+    list(first_page)
+    FilterLabels.aggr_labels_bulk({'page-a': ['a-late']})
+
+    second_page = LabelsSearch(label_search='page-', cursor=first_page.next_cursor, limit=3)
+
+    assert [(item['label_name'], item['label_values']) for item in second_page][0] == ('page-a', ['a2', 'a3', 'a-late'])
+
+
+@pytest.fixture(scope='module')
+def mixed_label(app):
+    FilterLabels.create_label({'label_name': 'mixed', 'label_values': ['x/1', 5, True, 'X_2', 'é-3']})
+
+
+@pytest.mark.parametrize('value_search, expected', [
+    ('x', ['x/1', 'X_2']), ('x_', ['X_2']), ('x/', ['x/1']), ('5', [5]), ('tr', [True]), ('é', ['é-3'])
+])
+def test_value_search_matches_str_of_any_value(mixed_label, value_search, expected):
+    page = LabelsSearch(label_search='mixed', value_search=value_search)
+
+    assert [label_value for item in page for label_value in item['label_values']] == expected
+
+
+def test_cursor_does_not_skip_values_after_compaction(app):
+    FilterLabels.create_label({'label_name': 'shifted', 'label_values': ['s0', 's1', 's2', 's3']})
+    first_page = LabelsSearch(label_search='shifted', limit=2)
+    assert [label_value for item in first_page for label_value in item['label_values']] == ['s0', 's1']
+
+    if normalized_storage():
+        FilterLabelValues.delete_values([FilterLabelValues.least_recent_values('shifted', limit=1)[0].value_id])
+    else:
+        FilterLabels.trim_blob_values('shifted', cap=3)
+    db.session.commit()
+
+    second_page = LabelsSearch(label_search='shifted', cursor=first_page.next_cursor, limit=2)
+    assert [label_value for item in second_page for label_value in item['label_values']] == ['s2', 's3']
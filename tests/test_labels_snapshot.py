@@ -0,0 +1,55 @@
+import datetime
+import pytest
+from microservice_template_core import db
+from harp_filters.logic.labels_cache import labels_cache
+from harp_filters.logic.labels_compaction import LabelsCompaction
+from harp_filters.logic.labels_snapshot import LabelsSnapshot
+from harp_filters.models.catalog_change import CatalogChange
+from harp_filters.models.filter_labels import FilterLabels, normalized_storage
+from harp_filters.models.filter_label_values import FilterLabelValues
+
+
+def compact(label_name):
+    """
+    Remove the oldest value of the label the way compaction does and return it
+    """
+    if normalized_storage():
+        rows = FilterLabelValues.least_recent_values(label_name, limit=1)
+        LabelsCompaction(pause_seconds=0).remove_rows(rows)
+        return 'prod'
+
+    removed_values = FilterLabels.trim_blob_values(label_name, cap=1)
+    db.session.commit()
+    return removed_values[0]
+
+
+@pytest.fixture
+def snapshot(app, tmp_path, request):
+    label_name = request.node.name
+    FilterLabels.create_label({'label_name': label_name, 'label_values': ['prod', 'stage']})
+    labels_cache.clear()
+    labels_cache.add_values(label_name, ['prod', 'stage'])
+    snapshot = LabelsSnapshot(path=str(tmp_path / 'labels.snapshot'))
+    snapshot.write()
+    labels_cache.clear()
+
+    yield snapshot, label_name
+    labels_cache.clear()
+
+
+def test_values_compacted_after_snapshot_are_not_loaded(snapshot):
+    snapshot, label_name = snapshot
+    assert compact(label_name) == 'prod'
+
+    assert snapshot.load()
+    assert not labels_cache.contains(label_name, 'prod')
+    assert labels_cache.contains(label_name, 'stage')
+
+
+def test_snapshot_older_than_trimmed_changes_is_discarded(snapshot):
+    snapshot, label_name = snapshot
+    compact(label_name)
+    CatalogChange.trim(created_before=datetime.datetime.utcnow() + datetime.timedelta(seconds=1))
+
+    assert not snapshot.load()
+    assert len(labels_cache) == 0
@@ -0,0 +1,18 @@
+import ujson as json
+from microservice_template_core import db
+from harp_filters.migrations.normalize_labels import migrate, reverse_migrate
+from harp_filters.models.filter_labels import FilterLabels
+from harp_filters.models.filter_label_values import FilterLabelValues
+
+
+def test_reverse_migration_writes_values_added_after_migration_to_blob(app):
+    db.session.add(FilterLabels(label_name='migrated', label_values=json.dumps(['prod', 1])))
+    db.session.commit()
+    migrate()
+    FilterLabelValues.add_values({'migrated': ['stage']})
+    db.session.commit()
+
+    reverse_migrate()
+
+    single_label = FilterLabels.query.filter_by(label_name='migrated').one()
+    assert json.loads(single_label.label_values) == ['prod', 1, 'stage']
@@ -0,0 +1,60 @@
+import datetime
+import pytest
+from microservice_template_core import db
+from harp_filters.logic import typeahead_index as typeahead_module
+from harp_filters.logic.typeahead_index import TypeaheadIndex
+from harp_filters.models.catalog_change import CatalogChange
+
+
+def test_values_keep_their_type():
+    index = TypeaheadIndex()
+    index.build(lambda: [('port', 80), ('port', '80'), ('port', 8080), ('enabled', True), ('port', 80)])
+
+    assert index.search('port', prefix='80') == ['80', 80, 8080]
+    assert index.search('enabled', prefix='t') == [True]
+
+
+def test_search_is_case_insensitive_and_limited():
+    index = TypeaheadIndex()
+    index.build(lambda: [('host', 'DB-1'), ('host', 'db-2'), ('host', 'web-1')])
+
+    assert index.search('host', prefix='db') == ['DB-1', 'db-2']
+    assert index.search('host', prefix='DB', limit=1) == ['DB-1']
+
+
+@pytest.fixture
+def index(app, monkeypatch):
+    # Changes are applied as soon as they are committed, without the settle window
+    monkeypatch.setattr(typeahead_module, 'settled_change_id', lambda: CatalogChange.last_change_id())
+    index = TypeaheadIndex(page_size=2)
+    index.sync(lambda: [('typeahead-env', 'prod')])
+
+    return index
+
+
+def record(operation, payload):
+    CatalogChange.record('labels', operation, payload)
+    db.session.commit()
+
+
+def test_changes_of_other_processes_are_applied(index):
+    record('add_values', {'label_name': 'typeahead-env', 'label_values': ['stage', 'dev']})
+    record('create', {'label_name': 'typeahead-dc', 'label_values': ['FA0']})
+    record('remove_values', {'label_name': 'typeahead-env', 'label_values': ['prod']})
+    record('update', {'label_name': 'typeahead-region', 'old_label_name': 'typeahead-dc', 'label_values': ['eu']})
+
+    index.sync(lambda: pytest.fail('Index was built again'))
+
+    assert index.search('typeahead-env') == ['dev', 'stage']
+    assert index.search('typeahead-dc') == []
+    assert index.search('typeahead-region') == ['eu']
+
+
+def test_index_is_built_again_when_changes_were_trimmed(index):
+    record('add_values', {'label_name': 'typeahead-env', 'label_values': ['stage']})
+    record('add_values', {'label_name': 'typeahead-env', 'label_values': ['dev']})
+    CatalogChange.trim(created_before=CatalogChange.db_now() + datetime.timedelta(seconds=1))
+
+    index.sync(lambda: [('typeahead-env', 'qa')])
+
+    assert index.search('typeahead-env') == ['qa']